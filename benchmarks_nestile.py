@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the nestile NES Tile Editor
+
+Times the tile codec, the tile set file I/O and PNG images, the compression
+codecs, the tile layer index and the redraw functions of the UI, writes the
+results as JSON and compares them with a baseline saved by an earlier run:
+
+    python benchmarks_nestile.py --save-baseline
+    python benchmarks_nestile.py --baseline benchmarks_baseline.json
+
+The UI benchmarks need a display, such as the one xvfb-run provides, and are
+skipped without one.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+import nestile
+from nestile import Tile, TileSet, TileLayerData, BYTES_PER_TILE, TLAYOUT_XSPAN, TLAYOUT_YSPAN
+
+# Sizes of the synthetic CHR files used by the file benchmarks
+CHR_FILE_SIZES = (8 * 1024, 64 * 1024, 1024 * 1024)
+# The best of BENCH_REPEAT timing runs is kept
+BENCH_REPEAT = 5
+# A benchmark slower than the baseline by more than this ratio is a regression
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_BASELINE = 'benchmarks_baseline.json'
+
+# name: function returning the function to time, or None to skip it
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """Decorator registering a benchmark setup function under name"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def random_chr(size: int, seed: int = 0) -> bytes:
+    """Returns size bytes of tile data, a quarter of the tiles blank as in real ROMs"""
+    rand = random.Random(seed)
+    tiles = []
+    for _ in range(size // BYTES_PER_TILE):
+        if rand.random() < 0.25:
+            tiles.append(bytes(BYTES_PER_TILE))
+        else:
+            tiles.append(rand.randbytes(BYTES_PER_TILE))
+    return b''.join(tiles)
+
+
+def drawn_chr(size: int, seed: int = 0) -> bytes:
+    """Returns size bytes of tile data looking drawn rather than random: a
+    quarter of the tiles blank, the others each made of a few row patterns"""
+    rand = random.Random(seed)
+    tiles = []
+    for _ in range(size // BYTES_PER_TILE):
+        if rand.random() < 0.25:
+            tiles.append(bytes(BYTES_PER_TILE))
+            continue
+        patterns = [0, 0xFF] + [rand.randrange(256) for _ in range(2)]
+        tiles.append(bytes(patterns[min(3, int(rand.expovariate(1.5)))]
+                           for _ in range(BYTES_PER_TILE)))
+    return b''.join(tiles)
+
+
+@benchmark('tile.frombytes')
+def bench_tile_frombytes():
+    """Loads 512 tiles from bytes"""
+    data = random_chr(512 * BYTES_PER_TILE)
+    chunks = [data[i:i+BYTES_PER_TILE] for i in range(0, len(data), BYTES_PER_TILE)]
+    tile = Tile()
+    def run():
+        for chunk in chunks:
+            tile.frombytes(chunk)
+    return run
+
+
+@benchmark('tile.tobytes')
+def bench_tile_tobytes():
+    """Serializes 512 tiles"""
+    data = random_chr(512 * BYTES_PER_TILE)
+    tiles = [Tile(data[i:i+BYTES_PER_TILE]) for i in range(0, len(data), BYTES_PER_TILE)]
+    def run():
+        for tile in tiles:
+            tile.tobytes()
+    return run
+
+
+# Files made by the benchmarks, removed once they have run
+_temp_files = []
+
+def _chr_file(size: int) -> str:
+    """Returns the name of a temporary raw CHR file of size bytes"""
+    fd, filename = tempfile.mkstemp(suffix='.chr')
+    _temp_files.append(filename)
+    with os.fdopen(fd, 'wb') as chr_file:
+        chr_file.write(random_chr(size))
+    return filename
+
+
+def _register_file_benchmarks(size: int):
+    label = f'{size // 1024}k'
+
+    @benchmark(f'tileset.do_open.{label}')
+    def bench_open():
+        filename = _chr_file(size)
+        tile_set = TileSet()
+        def run():
+            tile_set.do_open(filename, use_mmap=False)
+        return run
+
+    @benchmark(f'tileset.do_open.mmap.{label}')
+    def bench_open_mmap():
+        filename = _chr_file(size)
+        tile_set = TileSet()
+        def run():
+            tile_set.do_open(filename, use_mmap=True)
+        return run
+
+    @benchmark(f'tileset.do_save.{label}')
+    def bench_save():
+        filename = _chr_file(size)
+        tile_set = TileSet(filename=filename)
+        def run():
+            # A full rewrite, as after a resize
+            tile_set.modified = True
+            tile_set.do_save(filename)
+        return run
+
+    @benchmark(f'tileset.do_save.one_tile.{label}')
+    def bench_save_tile():
+        filename = _chr_file(size)
+        tile_set = TileSet(filename=filename, use_mmap=True)
+        def run():
+            tile_set.update_tile_pixel(1, 0, 0, (tile_set[1].get(0, 0) + 1) % 4)
+            tile_set.do_save(filename)
+        return run
+
+for _size in CHR_FILE_SIZES:
+    _register_file_benchmarks(_size)
+
+
+@benchmark('tileset.bank_pixels')
+def bench_bank_pixels():
+    """Decodes one 8 KB bank of a 256 KB file"""
+    filename = _chr_file(256 * 1024)
+    tile_set = TileSet(filename=filename, use_mmap=True)
+    def run():
+        tile_set._banks.clear()
+        tile_set.bank_pixels(17)
+    return run
+
+
+@benchmark('tileset.export_png')
+def bench_export_png():
+    """Saves a 64 KB file as a PNG image"""
+    tile_set = TileSet(filename=_chr_file(64 * 1024))
+    png_file = _chr_file(0)
+    def run():
+        tile_set.export_png(png_file)
+    return run
+
+
+@benchmark('tileset.import_png')
+def bench_import_png():
+    """Loads the tiles of a 64 KB file from a PNG image"""
+    tile_set = TileSet(filename=_chr_file(64 * 1024))
+    png_file = _chr_file(0)
+    tile_set.export_png(png_file)
+    def run():
+        tile_set.import_png(png_file)
+    return run
+
+
+def _transform_benchmark(name: str, transform):
+    @benchmark(f'chr.{name}.bank')
+    def bench():
+        data = random_chr(8 * 1024)
+        def run():
+            transform(data)
+        return run
+
+for _name in ('hflip', 'vflip', 'invert', 'rotate_cw', 'rotate_ccw', 'shift_up', 'shift_left'):
+    _transform_benchmark(_name, getattr(nestile, f'chr_{_name}'))
+
+
+def _codec_benchmarks(codec: 'nestile.ChrCodec'):
+    """Times encoding and decoding 8 KB of drawn tiles, reporting the
+    compression ratio and the throughput on the raw data"""
+    data = drawn_chr(8 * 1024)
+    encoded = codec.encode(data)
+    info = {'bytes': len(data), 'ratio': len(encoded) / len(data)}
+
+    @benchmark(f'codec.{codec.name}.encode')
+    def bench_encode():
+        def run():
+            codec.encode(data)
+        run.info = info
+        return run
+
+    @benchmark(f'codec.{codec.name}.decode')
+    def bench_decode():
+        def run():
+            codec.decode(encoded)
+        run.info = info
+        return run
+
+for _codec in nestile.CHR_CODECS.values():
+    _codec_benchmarks(_codec)
+
+
+@benchmark('clipboard.paste_256')
+def bench_clipboard_paste():
+    """Pastes a 256 tile block copied from another bank"""
+    tile_set = TileSet(filename=_chr_file(64 * 1024))
+    text = nestile.clipboard_encode(tile_set.get_chr(0, 256))
+    def run():
+        tile_set.set_chr(nestile.clipboard_decode(text), 1024)
+    return run
+
+
+def _full_tile_layer() -> TileLayerData:
+    """Returns a tile layer with every place used, by 256 different tiles"""
+    tlayer = TileLayerData()
+    for x in range(TLAYOUT_XSPAN):
+        for y in range(TLAYOUT_YSPAN):
+            tlayer.lay_tile(x, y, (x + y * TLAYOUT_XSPAN) % 256, nestile.default_palette)
+    return tlayer
+
+
+@benchmark('tlayer.tile_layout')
+def bench_tile_layout():
+    """Looks up the places of each of 256 tiles"""
+    tlayer = _full_tile_layer()
+    def run():
+        for tile_num in range(256):
+            tlayer.tile_layout(tile_num)
+    return run
+
+
+_app = None
+
+def _tk_app() -> 'nestile.NesTileEdit':
+    """Returns the editor the UI benchmarks draw in, or None without a display"""
+    global _app # pylint: disable=global-statement
+    if _app is None:
+        try:
+            nestile.import_tk()
+        except ImportError:
+            return None
+        try:
+            _app = nestile.NesTileEdit()
+        except nestile.tk.TclError:
+            return None
+        _app._tile_set.do_open(_chr_file(8 * 1024), use_mmap=False)
+        _app._tlayer = _full_tile_layer()
+    return _app
+
+
+def _ui_benchmark(name: str, redraw):
+    @benchmark(name)
+    def bench():
+        app = _tk_app()
+        if app is None:
+            return None
+        def run():
+            redraw(app)
+            app._ui.root.update_idletasks()
+        return run
+
+_ui_benchmark('ui.tileset_redraw_all', lambda app: app._ui.tileset_redraw_all(
+    app._tile_set, app.current_tile_num))
+_ui_benchmark('ui.edit_redraw_all', lambda app: app._ui.edit_redraw_all(
+    app.current_tile_num, app._tile_set[app.current_tile_num], app.current_pal))
+_ui_benchmark('ui.colors_redraw_all', lambda app: app._ui.colors_redraw_all(
+    app.current_pal, app.current_col))
+_ui_benchmark('ui.tlayout_redraw_all', lambda app: app._ui.tlayout_redraw_all(
+    app._tile_set, app._tlayer))
+_ui_benchmark('ui.update_tile', lambda app: app._ui.update_tile(
+    app._tlayer, app._tile_set, app.current_tile_num, app.current_pal))
+
+
+def time_function(run) -> dict:
+    """Returns the best time of one call to run, in seconds"""
+    timer = timeit.Timer(run)
+    # autorange picks a number of calls taking at least 0.2 seconds
+    number, _ = timer.autorange()
+    best = min(timer.repeat(BENCH_REPEAT, number))
+    return {'seconds': best / number, 'number': number, 'repeat': BENCH_REPEAT}
+
+
+def run_benchmarks(selected: list[str] = None) -> dict:
+    """Runs the benchmarks whose names contain one of selected, or all of them
+    Returns:
+        the results, with the benchmarks that could not run listed in 'skipped'
+    """
+    results = {}
+    skipped = []
+    try:
+        for name, setup in BENCHMARKS.items():
+            if selected and not any(pattern in name for pattern in selected):
+                continue
+            run = setup()
+            if run is None:
+                skipped.append(name)
+                continue
+            results[name] = time_function(run)
+            # Benchmarks of a number of bytes also report the throughput
+            info = getattr(run, 'info', {})
+            results[name].update(info)
+            if 'bytes' in info:
+                results[name]['mb_per_s'] = info['bytes'] / results[name]['seconds'] / 1e6
+    finally:
+        for filename in _temp_files:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        _temp_files.clear()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': nestile.np is not None,
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[tuple]:
+    """Compares results with a baseline run
+    Returns:
+        the (name, baseline seconds, seconds, ratio) of the benchmarks slower
+        than in the baseline by more than threshold
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['seconds'] / base['seconds']
+        if ratio > 1 + threshold:
+            regressions.append((name, base['seconds'], result['seconds'], ratio))
+    return regressions
+
+
+def main(argv: list[str]) -> int:
+    """Entry point of the benchmarks
+    Returns:
+        the exit status, 1 if a benchmark regressed
+    """
+    parser = argparse.ArgumentParser(description='Benchmark nestile')
+    parser.add_argument('patterns', nargs='*',
+                        help='only run the benchmarks whose names contain one of these')
+    parser.add_argument('-o', '--output', help='write the JSON results to this file')
+    parser.add_argument('-b', '--baseline', default=DEFAULT_BASELINE,
+                        help=f'results to compare with (default: {DEFAULT_BASELINE})')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='slowdown ratio counted as a regression (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results to the baseline file')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.patterns)
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    for name, result in results['results'].items():
+        line = f"{name:40} {result['seconds'] * 1e6:12.1f} us"
+        if 'mb_per_s' in result:
+            line += f"  {result['mb_per_s']:8.2f} MB/s"
+        if 'ratio' in result:
+            line += f"  ratio {result['ratio']:.2f}"
+        if baseline is not None and name in baseline['results']:
+            line += f"  x{result['seconds'] / baseline['results'][name]['seconds']:.2f}"
+        print(line)
+    for name in results['skipped']:
+        print(f"{name:40} skipped")
+
+    output = args.baseline if args.save_baseline else args.output
+    if output:
+        with open(output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for name, base, seconds, ratio in regressions:
+        print(f"REGRESSION {name}: {base * 1e6:.1f} us -> {seconds * 1e6:.1f} us (x{ratio:.2f})",
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
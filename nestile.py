@@ -8,15 +8,48 @@ See changes.txt for changes and version info
 """
 
 from collections import namedtuple
-from tkinter import filedialog
-from tkinter import messagebox
-from tkinter import simpledialog
-from tkinter import ttk
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+import argparse
+import base64
+import cProfile
+import functools
+import itertools
+import json
+import mmap
 import os
+import queue
 import re
+import shutil
+import struct
 import sys
-import tkinter as tk
+import tempfile
+import threading
+import time
 import traceback
+import zlib
+
+# tkinter is only imported by the GUI, through import_tk, so the headless
+# batch mode runs without it
+tk = ttk = filedialog = messagebox = simpledialog = None
+
+def import_tk():
+    """Imports tkinter into the module for the GUI
+    Raises:
+        ImportError: tkinter is not installed
+    """
+    global tk, ttk, filedialog, messagebox, simpledialog # pylint: disable=global-statement
+    if tk is None:
+        # pylint: disable=import-outside-toplevel
+        from tkinter import filedialog, messagebox, simpledialog, ttk
+        import tkinter as tk
+
+try:
+    import numpy as np
+except ImportError:
+    # Bulk CHR conversions fall back to pure Python
+    np = None
 
 #Size of a Tile
 TILESIZE=8
@@ -24,10 +57,44 @@ BYTES_PER_TILE=16
 
 # ROM Sizes
 CROM_INC = 8192
+TILES_PER_BANK = CROM_INC // BYTES_PER_TILE
 PROM_INC = 16384
 INES_HEADER_SIZE = 16
 INES_HEADER_PROMS_IDX=4
 INES_HEADER_CROMS_IDX=5
+INES_HEADER_FLAGS6_IDX=6
+INES_HEADER_FLAGS7_IDX=7
+INES_HEADER_ROM_MSB_IDX=9
+INES_TRAINER_FLAG=0x04
+INES_TRAINER_SIZE=512
+
+#Time between two renders of pixels drawn by dragging the mouse, in ms
+FRAME_MS=16
+
+#Background file access: the UI polls for progress every TASK_POLL_MS ms, and
+#files are read FILE_CHUNK_SIZE bytes at a time between progress reports
+TASK_POLL_MS=50
+FILE_CHUNK_SIZE=1<<20
+
+#Tiles copied to the clipboard are tagged with CLIPBOARD_TAG, the format
+#version, the tile count and the base64 of their raw data
+CLIPBOARD_TAG='NESTILE-CHR'
+CLIPBOARD_VERSION='v1'
+
+#PNG files are written in IDAT chunks of PNG_IDAT_SIZE bytes, and read by
+#inflating at most that much at a time
+PNG_SIGNATURE=b'\x89PNG\r\n\x1a\n'
+PNG_IDAT_SIZE=1<<16
+
+#Recovery journal kept next to the opened file, written to disk at most
+#every JOURNAL_SYNC_MS ms
+JOURNAL_SUFFIX='.nestile-journal'
+JOURNAL_SYNC_MS=500
+
+#Instrumentation, enabled by --profile or the environment variable
+PROFILE_ENV='NESTILE_PROFILE'
+PROFILE_STATUS_MS=500
+PROFILE_TRACE_SIZE=10000
 
 #Size of Tile Editor Window
 EDITSCALE=32
@@ -46,6 +113,8 @@ TSET_SPAN=16
 TSET_OFFSET=TILESIZE*TSET_SCALE
 TSET_WIDTH=TSET_OFFSET*TSET_SPAN
 TSET_HEIGHT=(TSET_OFFSET * CROM_INC) // (TSET_SPAN * BYTES_PER_TILE)
+# Rows rendered above and below the visible part of the Tile Set Window
+TSET_PREFETCH_ROWS=4
 
 #size of Tile Layout Window
 TLAYOUT_SCALE=3
@@ -55,10 +124,28 @@ TLAYOUT_OFFSET=TILESIZE*TLAYOUT_SCALE
 TLAYOUT_WIDTH=TLAYOUT_XSPAN*TLAYOUT_OFFSET
 TLAYOUT_HEIGHT=TLAYOUT_YSPAN*TLAYOUT_OFFSET
 
+# Nametable layout, one byte per tile followed by the attribute table
+NAMETABLE_SIZE=1024
+ATTRIBUTE_TABLE_IDX=TLAYOUT_XSPAN*TLAYOUT_YSPAN
+ATTRIBUTE_SPAN=8
+QUAD_SIZE=2
+QUAD_XSPAN=TLAYOUT_XSPAN//QUAD_SIZE
+QUAD_YSPAN=TLAYOUT_YSPAN//QUAD_SIZE
+PALETTE_RAM_SIZE=16
+PALETTE_SLOTS=4
+
 #size of Palette selection Window
 PALETTE_BOXSIZE=16
 PALETTE_SPAN=16
 
+#Memory used at most by the undo history, in bytes
+UNDO_MAX_BYTES=1024*1024
+
+#Number of rendered tile images kept for redrawing the tile set and layer
+TILE_IMAGE_CACHE_SIZE=2048
+#Number of decoded CHR banks kept by a TileSet
+BANK_CACHE_SIZE=8
+
 nes_palette = (
     "#808080", "#0000bb", "#3700bf", "#8400a6",
     "#bb006a", "#b7001e", "#b30000", "#912600",
@@ -86,26 +173,52 @@ tileset_palette = (
 nes_filetypes = (
     ('Raw files', '.*'), ('NES files', '.nes'))
 
+nametable_filetypes = (
+    ('Nametable files', '.nam'), ('All files', '.*'))
+
+png_filetypes = (
+    ('PNG files', '.png'), ('All files', '.*'))
+
 default_palette = (15, 2, 10, 6)
 
 
 class NesTileEditTk:
     """Class encapsulating the UI components for the NES Tile Editor program"""
     def __init__(self, event_map: 'NesTileEdit'):
+        import_tk()
         # Create widgets
         self.event_map = event_map
         self.root = tk.Tk()
         self.main_win = self.root
         self.tileset_pixmap = tk.Canvas(self.main_win)
-        scroll_y = ttk.Scrollbar(self.main_win, orient="vertical",
-                                 command=self.tileset_pixmap.yview)
-        scroll_y.grid(row=0, column=1, sticky="ns")
-        self.tileset_pixmap.configure(yscrollcommand=scroll_y.set)
+        self._tileset_scroll = ttk.Scrollbar(self.main_win, orient="vertical",
+                                             command=self.tileset_pixmap.yview)
+        self._tileset_scroll.grid(row=0, column=1, sticky="ns")
+        self.tileset_pixmap.configure(yscrollcommand=self._tileset_yscroll)
         self.edit_win = tk.Toplevel(self.root)
         self.edit_pixmap = tk.Canvas(self.edit_win)
         self.colors_pixmap = tk.Canvas(self.edit_win)
         self.tlayout_win = tk.Toplevel(self.root)
         self.tlayout_pixmap = tk.Canvas(self.tlayout_win)
+        # Rendered images of the canvases
+        self._edit_image = self._tlayout_image = None
+        # Canvas items, created once and updated in place
+        self._tileset_highlight = self._tileset_selection = None
+        self._edit_item = self._tlayout_item = None
+        self._colors_items = []
+        # Status line and progress bar, only created when there is something to show
+        self._status = None
+        self._progress = self._progress_bar = self._progress_label = None
+        # The tile set is only rendered around the visible rows. Rendered rows
+        # are tile row number: (canvas item, image), rows scrolled away are
+        # kept in the free list to be reused.
+        self._tile_set = None
+        # Bank shown in the title
+        self._tileset_bank = None
+        self._tileset_rows = {}
+        self._tileset_free_rows = []
+        # Rendered tiles, keyed by (tile bytes, colors, scale)
+        self._tile_images = LRUCache(TILE_IMAGE_CACHE_SIZE)
         # Setup user interface
         self._setup_ui(event_map)
         self._build_menu(event_map)
@@ -120,6 +233,7 @@ class NesTileEditTk:
         self.tileset_pixmap.config(bg='#FF0000', width=TSET_WIDTH-1, height= TSET_HEIGHT-1)
         self.tileset_pixmap.grid(row=0, column=0)
         self.tileset_pixmap.bind("<Button-1>", self._tileset_click)
+        self.tileset_pixmap.bind("<Shift-Button-1>", self._tileset_shift_click)
         self.tileset_pixmap.bind("<Button-4>", self._tileset_mousewheel)
         self.tileset_pixmap.bind("<Button-5>", self._tileset_mousewheel)
 
@@ -133,6 +247,8 @@ class NesTileEditTk:
         self.edit_pixmap.bind("<B1-Motion>", self._edit_leftclick)
         self.edit_pixmap.bind("<Button-3>", self._edit_rightclick)
         self.edit_pixmap.bind("<B3-Motion>", self._edit_rightclick)
+        self.edit_pixmap.bind("<ButtonRelease-1>", lambda x: event_map.end_stroke())
+        self.edit_pixmap.bind("<ButtonRelease-3>", lambda x: event_map.end_stroke())
 
         self.colors_pixmap.config(width=EDIT_WIDTH-1, height=COLORS_HEIGHT-1, bg='#FF0000')
         self.colors_pixmap.grid(column=0, row=1, sticky="sew")
@@ -146,6 +262,47 @@ class NesTileEditTk:
         self.tlayout_pixmap.config(width=TLAYOUT_WIDTH-1, height=TLAYOUT_HEIGHT-1, bg='#FF0000')
         self.tlayout_pixmap.pack()
         self.tlayout_pixmap.bind("<Button-1>", self._tlayout_click)
+        tlayout_menubar = tk.Menu(self.tlayout_win)
+        self.tlayout_win.config(menu = tlayout_menubar)
+        tlayout_file_menu = tk.Menu(tlayout_menubar)
+        tlayout_file_menu.add_command(label="Open Nametable...",
+                                      command=event_map.open_tlayer, underline=0)
+        tlayout_file_menu.add_command(label="Save Nametable",
+                                      command=event_map.save_tlayer, underline=0)
+        tlayout_file_menu.add_command(label="Save Nametable As...",
+                                      command=event_map.save_as_tlayer, underline=5)
+        tlayout_file_menu.add_separator()
+        tlayout_file_menu.add_command(label="Export PNG...",
+                                      command=event_map.export_tlayer_png, underline=0)
+        tlayout_menubar.add_cascade(label="File", menu=tlayout_file_menu, underline=0)
+        tlayout_palette_menu = tk.Menu(tlayout_menubar)
+        self.tlayout_palette_mode = tk.StringVar(self.tlayout_win, value='tile')
+        tlayout_palette_menu.add_radiobutton(label="Palette per Tile", value='tile',
+                variable=self.tlayout_palette_mode, underline=12,
+                command=lambda: event_map.set_tlayer_palette_mode('tile'))
+        tlayout_palette_menu.add_radiobutton(label="PPU Attribute Palettes", value='ppu',
+                variable=self.tlayout_palette_mode, underline=0,
+                command=lambda: event_map.set_tlayer_palette_mode('ppu'))
+        tlayout_palette_menu.add_separator()
+        self.tlayout_palette_slot = tk.IntVar(self.tlayout_win, value=0)
+        for slot in range(PALETTE_SLOTS):
+            tlayout_palette_menu.add_radiobutton(label=f"Background Palette {slot}",
+                    value=slot, variable=self.tlayout_palette_slot, underline=19,
+                    command=lambda slot=slot: event_map.set_palette_slot(slot))
+        tlayout_menubar.add_cascade(label="Palette", menu=tlayout_palette_menu, underline=0)
+
+        # The canvas items are reused by every redraw so their number stays
+        # the same for the whole session
+        self._tileset_highlight = self.tileset_pixmap.create_rectangle(
+            0, 0, TSET_OFFSET-1, TSET_OFFSET-1, fill='', outline='#00FFFF')
+        self._tileset_selection = self.tileset_pixmap.create_polygon(
+            0, 0, 0, 0, 0, 0, fill='', outline='#FFFF00', dash=(4, 4), state='hidden')
+        self._edit_item = self.edit_pixmap.create_image(0, 0, anchor='nw')
+        self._tlayout_item = self.tlayout_pixmap.create_image(0, 0, anchor='nw')
+        self._colors_items = [
+            self.colors_pixmap.create_rectangle(i*COLORS_BOXSIZE, 0,
+                                                (i+1)*COLORS_BOXSIZE-1, COLORS_BOXSIZE-1)
+            for i in range(COLORS_SPAN) ]
 
     def _build_menu(self, event_map: 'NesTileEdit'):
         """Creates the UI menu"""
@@ -164,13 +321,37 @@ class NesTileEditTk:
         main_file_menu.add_command(label="Save As...", command=event_map.save_as_tileset,
                                         underline=5, accelerator="Ctrl+Shift+S")
         self.root.bind_all("<Control-S>", lambda x: event_map.save_as_tileset())
+        main_file_menu.add_separator()
+        main_file_menu.add_command(label="Import PNG...", command=event_map.import_tileset_png,
+                                        underline=0)
+        main_file_menu.add_command(label="Export PNG...", command=event_map.export_tileset_png,
+                                        underline=0)
+        main_import_menu = tk.Menu(main_file_menu)
+        main_export_menu = tk.Menu(main_file_menu)
+        for codec in CHR_CODECS.values():
+            main_import_menu.add_command(label=f"{codec.description}...",
+                command=lambda name=codec.name: event_map.import_tileset_compressed(name))
+            main_export_menu.add_command(label=f"{codec.description}...",
+                command=lambda name=codec.name: event_map.export_tileset_compressed(name))
+        main_file_menu.add_cascade(label="Import Compressed", menu=main_import_menu,
+                                   underline=7)
+        main_file_menu.add_cascade(label="Export Compressed", menu=main_export_menu,
+                                   underline=7)
+        main_file_menu.add_separator()
         main_file_menu.add_command(label="Quit", command=event_map.destroy,
                                         underline=0, accelerator="Ctrl+Q")
         self.root.bind_all("<Control-q>", lambda x: event_map.destroy())
         main_menubar.add_cascade(label="File", menu=main_file_menu, underline=0)
 
         main_edit_menu = tk.Menu(main_menubar)
-        main_edit_menu.add_command(label="Cut", command=event_map.tile_copy,
+        main_edit_menu.add_command(label="Undo", command=event_map.undo,
+                                        underline=0, accelerator="Ctrl+Z")
+        self.root.bind_all("<Control-z>", lambda x: event_map.undo())
+        main_edit_menu.add_command(label="Redo", command=event_map.redo,
+                                        underline=0, accelerator="Ctrl+Y")
+        self.root.bind_all("<Control-y>", lambda x: event_map.redo())
+        self.root.bind_all("<Control-Z>", lambda x: event_map.redo())
+        main_edit_menu.add_command(label="Cut", command=event_map.tile_cut,
                                         underline=2, accelerator="Ctrl+X")
         self.root.bind_all("<Control-x>", lambda x: event_map.tile_cut())
         main_edit_menu.add_command(label="Copy", command=event_map.tile_copy,
@@ -211,8 +392,29 @@ class NesTileEditTk:
         main_tile_menu.add_command(label="Rotate CW", command=event_map.tile_cwrotate,
                                         underline=0, accelerator="$")
         self.root.bind_all("$", lambda x: event_map.tile_cwrotate())
+        main_tile_menu.add_separator()
+        main_tile_menu.add_command(label="Find Duplicates",
+                                   command=event_map.find_duplicates, underline=5)
+        main_tile_menu.add_command(label="Find Mirror Duplicates",
+                                   command=lambda: event_map.find_duplicates(mirrors=True),
+                                   underline=5)
         main_menubar.add_cascade(label="Tile", menu=main_tile_menu, underline=0)
 
+        main_bank_menu = tk.Menu(main_menubar)
+        main_bank_menu.add_command(label="Previous Bank", command=event_map.prev_bank,
+                                        underline=0, accelerator="PgUp")
+        self.root.bind_all("<Prior>", lambda x: event_map.prev_bank())
+        main_bank_menu.add_command(label="Next Bank", command=event_map.next_bank,
+                                        underline=0, accelerator="PgDn")
+        self.root.bind_all("<Next>", lambda x: event_map.next_bank())
+        main_bank_menu.add_command(label="Go to Bank...", command=event_map.goto_bank,
+                                        underline=0, accelerator="Ctrl+G")
+        self.root.bind_all("<Control-g>", lambda x: event_map.goto_bank())
+        main_bank_menu.add_command(label="Select Bank", command=event_map.select_bank,
+                                        underline=0, accelerator="Ctrl+B")
+        self.root.bind_all("<Control-b>", lambda x: event_map.select_bank())
+        main_menubar.add_cascade(label="Bank", menu=main_bank_menu, underline=0)
+
     def destroy(self):
         '''Shutsdown and cleans up the UI'''
         self.root.destroy()
@@ -221,12 +423,87 @@ class NesTileEditTk:
         '''Main event loop of the UI'''
         self.root.mainloop()
 
+    def after_frame(self, callback: 'Callable', delay: int = FRAME_MS):
+        '''Calls callback from the event loop once the current frame, or delay ms, is over'''
+        self.root.after(delay, callback)
+
+    def canvas_item_counts(self) -> dict:
+        '''Returns the number of items on each canvas'''
+        return { 'tileset': len(self.tileset_pixmap.find_all()),
+                 'edit': len(self.edit_pixmap.find_all()),
+                 'colors': len(self.colors_pixmap.find_all()),
+                 'tlayout': len(self.tlayout_pixmap.find_all()) }
+
+    def show_status(self, text: str):
+        '''Shows text in a status line under the tile set'''
+        if self._status is None:
+            self._status = tk.Label(self.main_win, anchor='w', justify='left',
+                                    font='TkFixedFont')
+            self._status.grid(row=1, column=0, columnspan=2, sticky="ew")
+        self._status.config(text=text)
+
+    def show_progress(self, text: str, fraction: float):
+        '''Shows the progress of a background task under the tile set, with a
+        button cancelling it
+        Args:
+            text: what the task does
+            fraction: how much of it is done (0.0-1.0)
+        '''
+        if self._progress is None:
+            self._progress = tk.Frame(self.main_win)
+            self._progress_label = tk.Label(self._progress, anchor='w')
+            self._progress_label.pack(side='left')
+            ttk.Button(self._progress, text='Cancel',
+                       command=self.event_map.cancel_task).pack(side='right')
+            self._progress_bar = ttk.Progressbar(self._progress, maximum=1.0)
+            self._progress_bar.pack(side='right', fill='x', expand=True)
+        self._progress.grid(row=2, column=0, columnspan=2, sticky="ew")
+        self._progress_label.config(text=text)
+        self._progress_bar.config(value=fraction)
+
+    def hide_progress(self):
+        '''Removes the progress shown by show_progress'''
+        if self._progress is not None:
+            self._progress.grid_remove()
+
     def _tileset_click(self, event):
         x = self.tileset_pixmap.canvasx(event.x)
         y = self.tileset_pixmap.canvasy(event.y)
         i = box_number(int(x), int(y), TSET_OFFSET, TSET_SPAN)
         self.event_map.set_current_tile_num(i)
 
+    def _tileset_shift_click(self, event):
+        x = self.tileset_pixmap.canvasx(event.x)
+        y = self.tileset_pixmap.canvasy(event.y)
+        i = box_number(int(x), int(y), TSET_OFFSET, TSET_SPAN)
+        self.event_map.select_tile_range(i)
+
+    def tileset_select(self, first: int, stop: int):
+        '''Outlines the selected tiles in the tileset window
+        Args:
+            first: the number of the first selected tile
+            stop: the number after the last selected tile, the outline is
+                hidden when only one tile is selected
+        '''
+        if stop - first <= 1:
+            self.tileset_pixmap.itemconfig(self._tileset_selection, state='hidden')
+            return
+        # The tiles run left to right then top to bottom, the outline follows
+        # the first row from the first tile and the last row up to the last one
+        first_row, first_col = divmod(first, TSET_SPAN)
+        last_row, last_col = divmod(stop - 1, TSET_SPAN)
+        top, bottom = first_row * TSET_OFFSET, (last_row + 1) * TSET_OFFSET
+        left, right = first_col * TSET_OFFSET, (last_col + 1) * TSET_OFFSET
+        if first_row == last_row:
+            points = (left, top, right, top, right, bottom, left, bottom)
+        else:
+            points = (left, top, TSET_WIDTH, top, TSET_WIDTH, bottom - TSET_OFFSET,
+                      right, bottom - TSET_OFFSET, right, bottom, 0, bottom,
+                      0, top + TSET_OFFSET, left, top + TSET_OFFSET)
+        self.tileset_pixmap.coords(self._tileset_selection, *points)
+        self.tileset_pixmap.itemconfig(self._tileset_selection, state='normal')
+        self.tileset_pixmap.tag_raise(self._tileset_selection)
+
     def tileset_updatehighlight(self, tile_set: 'TileSet', old_tile_num:int, new_tile_num:int):
         '''Changes the selected tile in the tileset window
         Args:
@@ -234,23 +511,23 @@ class NesTileEditTk:
             old_tile_num: the number of the tile lose selection
             new_tile_num: the number of the tile to show as selected
         '''
-        # redraw old Tile without highlight
-        x_off = (old_tile_num  % TSET_SPAN) * TSET_OFFSET
-        y_off = (old_tile_num // TSET_SPAN) * TSET_OFFSET
-        # create draw callback to draw tile to
-        def _draw( start_x, start_y, stop_x, stop_y, color ):
-            self.tileset_pixmap.create_rectangle(
-                x_off+start_x*TSET_SCALE,  y_off+start_y*TSET_SCALE,
-                x_off+stop_x*TSET_SCALE-1, y_off+stop_y*TSET_SCALE-1,
-                fill=color, outline=color)
-        tile_set[old_tile_num].draw( _draw, tileset_palette)
-        # draw highlight around new tile
+        # the highlight is drawn over the tiles, moving it uncovers the old tile
         x_off = (new_tile_num  % TSET_SPAN) * TSET_OFFSET
         y_off = (new_tile_num // TSET_SPAN) * TSET_OFFSET
-        self.tileset_pixmap.create_rectangle(
-            x_off, y_off,
-            x_off+TSET_OFFSET-1, y_off+TSET_OFFSET-1,
-            fill='', outline='#00FFFF')
+        self.tileset_pixmap.coords(self._tileset_highlight,
+                                   x_off, y_off, x_off+TSET_OFFSET-1, y_off+TSET_OFFSET-1)
+        # The title shows the bank of the selected tile
+        bank = new_tile_num // TILES_PER_BANK
+        if bank != self._tileset_bank:
+            self._tileset_bank = bank
+            title = 'Tile Set' if tile_set.filename == '' else f"Tile Set - {tile_set.filename}"
+            if tile_set.bank_count() > 1:
+                title += f" [bank {bank}/{tile_set.bank_count()}]"
+            self.main_win.wm_title(title)
+
+    def tileset_show_bank(self, tile_set: 'TileSet', bank: int):
+        '''Scrolls the tileset window to the top of bank'''
+        self.tileset_pixmap.yview_moveto(bank * TILES_PER_BANK / max(1, len(tile_set)))
 
     def _tileset_mousewheel(self, event):
         if event.num==4: # Up
@@ -258,6 +535,57 @@ class NesTileEditTk:
         else: # Down
             self.tileset_pixmap.yview_scroll(1, "units")
 
+    def _tileset_yscroll(self, first, last):
+        """Follows the tile set view scrolling with the scrollbar and the rendered rows"""
+        self._tileset_scroll.set(first, last)
+        self._tileset_update_viewport()
+
+    def _tileset_update_viewport(self):
+        """Renders the tile set rows that came into view, reusing the rows that left it"""
+        if self._tile_set is None:
+            return
+        top = int(self.tileset_pixmap.canvasy(0)) // TSET_OFFSET
+        bottom = int(self.tileset_pixmap.canvasy(TSET_HEIGHT)) // TSET_OFFSET
+        num_rows = -(-len(self._tile_set) // TSET_SPAN)
+        wanted = range(max(0, top - TSET_PREFETCH_ROWS),
+                       min(num_rows, bottom + TSET_PREFETCH_ROWS + 1))
+        for row in [ row for row in self._tileset_rows if row not in wanted ]:
+            self._tileset_recycle_row(row)
+        for row in wanted:
+            if row not in self._tileset_rows:
+                self._tileset_render_row(row)
+        self.tileset_pixmap.tag_raise(self._tileset_highlight)
+        self.tileset_pixmap.tag_raise(self._tileset_selection)
+
+    def _tileset_recycle_row(self, row: int):
+        """Moves a rendered row out of view and into the free list"""
+        item, image = self._tileset_rows.pop(row)
+        self.tileset_pixmap.coords(item, 0, -TSET_OFFSET)
+        self._tileset_free_rows.append((item, image))
+
+    def _tileset_render_row(self, row: int):
+        """Renders one row of tiles of the tile set view"""
+        if self._tileset_free_rows:
+            item, image = self._tileset_free_rows.pop()
+        else:
+            image = tk.PhotoImage(master=self.root, width=TSET_WIDTH, height=TSET_OFFSET)
+            item = self.tileset_pixmap.create_image(0, 0, anchor='nw', image=image)
+        first = row * TSET_SPAN - (row * TSET_SPAN) % TILES_PER_BANK
+        pixels = self._tile_set.bank_pixels(first // TILES_PER_BANK)[
+            row * TSET_SPAN - first:(row + 1) * TSET_SPAN - first]
+        row_image = self._photo_image(tile_sheet_rows(pixels, TSET_SPAN), tileset_palette, 1)
+        image.tk.call(image, 'copy', row_image, '-zoom', TSET_SCALE)
+        self.tileset_pixmap.coords(item, 0, row * TSET_OFFSET)
+        self._tileset_rows[row] = (item, image)
+
+    def _tileset_tile_pos(self, tile_num: int):
+        """Returns the rendered row image holding tile_num and the tile's x offset in it,
+        or None if the row is not rendered"""
+        rendered = self._tileset_rows.get(tile_num // TSET_SPAN)
+        if rendered is None:
+            return None
+        return rendered[1], (tile_num % TSET_SPAN) * TSET_OFFSET
+
     def _edit_leftclick(self, event):
         # Figure out discrete row and column of pixel
         col = event.x // EDITSCALE
@@ -276,54 +604,92 @@ class NesTileEditTk:
         row = 0 if row < 0 else TILESIZE-1 if row > (TILESIZE-1) else row
         self.event_map.draw_tile_pixel_bg(col, row)
 
+    @staticmethod
+    def _fill(image: 'tk.PhotoImage', color: str, x: int, y: int, size: int):
+        """Fills the size by size square at (x,y) of image with color"""
+        image.put('{'+color+'}', to=(x, y, x+size, y+size))
+
+    def _tile_image(self, tile: 'Tile', colors: list[str], scale: int) -> 'tk.PhotoImage':
+        """Returns the image of tile in colors zoomed by scale, rendering it only if it
+        is not cached. The key holds the tile bytes, so edited tiles never hit stale images.
+        """
+        key = (tile.tobytes(), tuple(colors), scale)
+        image = self._tile_images.get(key)
+        if image is None:
+            image = self._photo_image(tile.tolist(), colors, scale)
+            self._tile_images.put(key, image)
+        return image
+
+    def _blit_tile(self, image: 'tk.PhotoImage', tile: 'Tile', colors: list[str],
+                   scale: int, x: int, y: int):
+        """Draws tile scaled by scale into image with its top left corner at (x,y)"""
+        image.tk.call(image, 'copy', self._tile_image(tile, colors, scale), '-to', x, y)
+
     def update_tile_pixel(self, tlayer, tile_num, pal, pixel_update):
         '''Updates a pixel in current tile across all windows'''
+        self.update_tile_pixels(tlayer, tile_num, pal, [pixel_update])
+
+    def update_tile_pixels(self, tlayer, tile_num, pal, pixel_updates):
+        '''Updates a group of pixels in current tile across all windows'''
         # Update edit pixmap
-        color = nes_palette[pal[pixel_update.color]]
-        self.edit_pixmap.create_rectangle(
-            pixel_update.x*EDITSCALE, pixel_update.y*EDITSCALE,
-            (pixel_update.x+1)*EDITSCALE-1, (pixel_update.y+1)*EDITSCALE-1,
-            fill=color, outline=color)
+        for pixel_update in pixel_updates:
+            self._fill(self._edit_image, nes_palette[pal[pixel_update.color]],
+                       pixel_update.x*EDITSCALE, pixel_update.y*EDITSCALE, EDITSCALE)
         # Update tileset pixmap
-        color = tileset_palette[pixel_update.color]
-        tile_x = pixel_update.x*TSET_SCALE+(tile_num % TSET_SPAN)*TSET_OFFSET
-        tile_y = pixel_update.y*TSET_SCALE+(tile_num // TSET_SPAN)*TSET_OFFSET
-        self.tileset_pixmap.create_rectangle(
-            tile_x, tile_y, tile_x+TSET_SCALE-1, tile_y+TSET_SCALE-1, fill=color, outline=color)
+        tile_pos = self._tileset_tile_pos(tile_num)
+        if tile_pos is not None:
+            for pixel_update in pixel_updates:
+                self._fill(tile_pos[0], tileset_palette[pixel_update.color],
+                           pixel_update.x*TSET_SCALE+tile_pos[1], pixel_update.y*TSET_SCALE,
+                           TSET_SCALE)
         # Updates all the tiles laid on the tile layer of the same kind
         t_info = tlayer.tile_layout(tile_num)
         for t_layout in t_info:
-            color =  nes_palette[t_layout.palette[pixel_update.color]]
-            lay_x = pixel_update.x * TLAYOUT_SCALE + t_layout.x * TLAYOUT_OFFSET
-            lay_y = pixel_update.y * TLAYOUT_SCALE + t_layout.y * TLAYOUT_OFFSET
-            self.tlayout_pixmap.create_rectangle(
-                lay_x, lay_y,lay_x+TLAYOUT_SCALE-1, lay_y+TLAYOUT_SCALE-1,
-                fill=color, outline=color)
-
-    def update_tile(self, tlayer, tile_set, tile_num, pal):
-        '''Updates current tile across all windows'''
+            for pixel_update in pixel_updates:
+                self._fill(self._tlayout_image,
+                           nes_palette[t_layout.palette[pixel_update.color]],
+                           pixel_update.x * TLAYOUT_SCALE + t_layout.x * TLAYOUT_OFFSET,
+                           pixel_update.y * TLAYOUT_SCALE + t_layout.y * TLAYOUT_OFFSET,
+                           TLAYOUT_SCALE)
+
+    def update_tile(self, tlayer, tile_set, tile_num, pal, current=True):
+        '''Updates current tile across all windows
+        Only the tile set and tile layer are updated for a tile that is not current.
+        '''
         tile = tile_set[tile_num]
         # Update edit pixmap
-        self.edit_redraw_all( tile_num, tile, pal)
+        if current:
+            self.edit_redraw_all( tile_num, tile, pal)
 
         # Update tileset pixmap
-        self.tileset_updatehighlight( tile_set, tile_num, tile_num)
-
-        x_off = 0
-        y_off = 0
-        # create draw callback to draw tile to tlayout_pixmap
-        def _draw( start_x, start_y, stop_x, stop_y, color ):
-            self.tlayout_pixmap.create_rectangle(
-                x_off+start_x*TLAYOUT_SCALE,  y_off+start_y*TLAYOUT_SCALE,
-                x_off+stop_x*TLAYOUT_SCALE-1, y_off+stop_y*TLAYOUT_SCALE-1,
-                fill=color, outline=color)
+        tile_pos = self._tileset_tile_pos(tile_num)
+        if tile_pos is not None:
+            self._blit_tile(tile_pos[0], tile, tileset_palette, TSET_SCALE, tile_pos[1], 0)
 
         # Updates all the tiles laid on the tile layer of the same kind
         t_info = tlayer.tile_layout(tile_num)
         for t_layout in t_info:
-            x_off = t_layout.x * TLAYOUT_OFFSET
-            y_off = t_layout.y * TLAYOUT_OFFSET
-            tile.draw(_draw, [nes_palette[i] for i in t_layout.palette])
+            self._blit_tile(self._tlayout_image, tile,
+                            [nes_palette[i] for i in t_layout.palette], TLAYOUT_SCALE,
+                            t_layout.x * TLAYOUT_OFFSET, t_layout.y * TLAYOUT_OFFSET)
+
+    def update_tiles(self, tlayer, tile_set, first, stop, pal, current_tile_num):
+        '''Updates the tiles from first up to stop across all windows, such as
+        after a paste. The tileset rows holding them are rendered again once.
+        '''
+        if first <= current_tile_num < stop:
+            self.edit_redraw_all(current_tile_num, tile_set[current_tile_num], pal)
+        for row in range(first // TSET_SPAN, -(-stop // TSET_SPAN)):
+            if row in self._tileset_rows:
+                self._tileset_recycle_row(row)
+                self._tileset_render_row(row)
+        self.tileset_pixmap.tag_raise(self._tileset_highlight)
+        self.tileset_pixmap.tag_raise(self._tileset_selection)
+        for tile_num in range(first, stop):
+            for t_layout in tlayer.tile_layout(tile_num):
+                self._blit_tile(self._tlayout_image, tile_set[tile_num],
+                                [nes_palette[i] for i in t_layout.palette], TLAYOUT_SCALE,
+                                t_layout.x * TLAYOUT_OFFSET, t_layout.y * TLAYOUT_OFFSET)
 
     def _colors_leftclick(self, event):
         i = box_number(event.x, event.y, COLORS_BOXSIZE, COLORS_SPAN)
@@ -376,17 +742,40 @@ class NesTileEditTk:
             tile: the Tile data of the tile
             pal: the color palette a list of 4 nes colors(0-63)
         '''
-        x_off = col * TLAYOUT_OFFSET
-        y_off = row * TLAYOUT_OFFSET
+        self._blit_tile(self._tlayout_image, tile, [nes_palette[i] for i in pal],
+                        TLAYOUT_SCALE, col * TLAYOUT_OFFSET, row * TLAYOUT_OFFSET)
 
-        # create draw callback to draw tile to tlayout_pixmap
-        def _draw( start_x, start_y, stop_x, stop_y, color ):
-            self.tlayout_pixmap.create_rectangle(
-                x_off+start_x*TLAYOUT_SCALE,  y_off+start_y*TLAYOUT_SCALE,
-                x_off+stop_x*TLAYOUT_SCALE-1, y_off+stop_y*TLAYOUT_SCALE-1,
-                fill=color, outline=color)
+    def tlayout_update_cells(self, tile_set: 'TileSet', tlayout: 'TileLayerData',
+                             cells: list[tuple[int, int]]):
+        '''Redraws only some places of the tile layer, such as the ones whose
+        palette changed
+        Args:
+            tile_set : the TileSet to draw tiles from
+            tlayout : the TileLayerData holding the places
+            cells : the (x, y) positions to redraw
+        '''
+        for x, y in cells:
+            tle = tlayout.tile_at_xy(x, y)
+            if tle is None:
+                self._fill(self._tlayout_image, tileset_palette[0],
+                           x * TLAYOUT_OFFSET, y * TLAYOUT_OFFSET, TLAYOUT_OFFSET)
+            else:
+                self.lay_tile(x, y, tile_set[tle.tile], tle.palette)
 
-        tile.draw( _draw, [nes_palette[i] for i in pal] )
+    def _photo_image(self, rows, colors: list[str], scale: int) -> 'tk.PhotoImage':
+        """Returns an image of the pixel color indexes in rows, blitted in one
+        put call and zoomed by scale
+        Args:
+            rows: a list of pixel rows, each a list of indexes into colors
+            colors: the colors of the pixel values
+            scale: the zoom factor of the image
+        """
+        if hasattr(rows, 'tolist'):
+            rows = rows.tolist()
+        image = tk.PhotoImage(master=self.root, width=len(rows[0]), height=len(rows))
+        image.put(' '.join('{'+' '.join([colors[col] for col in row])+'}' for row in rows),
+                  to=(0, 0))
+        return image.zoom(scale) if scale != 1 else image
 
     def tileset_redraw_all(self, tile_set: 'TileSet', current_tile_num: int):
         '''Redraws the tileset window
@@ -394,32 +783,15 @@ class NesTileEditTk:
             tile_set : the tileset shown in the window
             current_tile_num: the number of the tile to show as selected
         '''
-        # Clear out draw window (done in configure before, but trying to avoid
-        # having my graphics drawn over.
-        if tile_set.filename == '':
-            self.main_win.wm_title('Tile Set')
-        else:
-            self.main_win.wm_title(f"Tile Set - {tile_set.filename}")
+        self._tileset_bank = None
         self.tileset_pixmap.config(
             scrollregion=(0,0,TSET_WIDTH,(TSET_OFFSET * len(tile_set)) // TSET_SPAN) )
-        self.tileset_pixmap.delete('all')
-        x = 0
-        y = 0
-        for i, tile in enumerate(tile_set):
-            # create draw callback to draw tile to tileset_pixmap
-            def _draw( start_x, start_y, stop_x, stop_y, color ):
-                self.tileset_pixmap.create_rectangle(
-                    x+start_x*TSET_SCALE, y+start_y*TSET_SCALE,
-                    x+stop_x*TSET_SCALE-1, y+stop_y*TSET_SCALE-1,
-                    fill=color, outline=color)
-            tile.draw( _draw, tileset_palette)
-            if i == current_tile_num:
-                self.tileset_pixmap.create_rectangle(x, y, x+TSET_OFFSET-1, y+TSET_OFFSET-1,
-                                             fill='', outline='#00FFFF')
-            x += TSET_OFFSET
-            if x >= TSET_WIDTH:
-                y += TSET_OFFSET
-                x = 0
+        # Only the rows in view are rendered, as they get scrolled to
+        self._tile_set = tile_set
+        for row in list(self._tileset_rows):
+            self._tileset_recycle_row(row)
+        self._tileset_update_viewport()
+        self.tileset_updatehighlight(tile_set, current_tile_num, current_tile_num)
 
     def edit_redraw_all(self, current_tile_num: int, tile: 'Tile', pal: list):
         '''Redraws the main tile view of the tile edit window
@@ -429,15 +801,9 @@ class NesTileEditTk:
             pal: the current color palette a list of 4 nes colors(0-63)
         '''
         self.edit_win.wm_title('Tile #' + str(current_tile_num))
-        self.edit_pixmap.delete('all')
-        # create draw callback to draw tile to edit_pixmap
-        def _draw( start_x, start_y, stop_x, stop_y, color ):
-            self.edit_pixmap.create_rectangle(
-                start_x*EDITSCALE, start_y*EDITSCALE,
-                stop_x*EDITSCALE-1, stop_y*EDITSCALE-1,
-                fill=color, outline=color)
-
-        tile.draw( _draw, [nes_palette[i] for i in pal] )
+        self._edit_image = self._photo_image(
+            tile.tolist(), [nes_palette[i] for i in pal], EDITSCALE)
+        self.edit_pixmap.itemconfig(self._edit_item, image=self._edit_image)
 
     def colors_redraw_all(self, pal: list, selected_col: int):
         '''Redraws the tile color display in the tile edit window
@@ -445,18 +811,14 @@ class NesTileEditTk:
             pal: the current color palette a list of 4 nes colors(0-63)
             selected_col: the current tile color (0-3) to show as selected
         '''
-        self.colors_pixmap.delete('all')
         for i, col_idx in enumerate(pal):
             color = nes_palette[col_idx]
-            x = i * COLORS_BOXSIZE
             if i == selected_col:
-                self.colors_pixmap.create_rectangle(x,0,
-                                                    x+COLORS_BOXSIZE-1, COLORS_BOXSIZE-1,
-                                                    fill=color, outline="#00FFFF")
+                self.colors_pixmap.itemconfig(self._colors_items[i],
+                                              fill=color, outline="#00FFFF")
             else:
-                self.colors_pixmap.create_rectangle(x,0,
-                                                    x+COLORS_BOXSIZE-1, COLORS_BOXSIZE-1,
-                                                    fill=color, outline=color)
+                self.colors_pixmap.itemconfig(self._colors_items[i],
+                                              fill=color, outline=color)
 
     def tlayout_redraw_all(self, tile_set: 'TileSet', tlayout: 'TileLayerData'):
         '''Redraws the tilelayout information with updated information.
@@ -468,27 +830,18 @@ class NesTileEditTk:
             self.tlayout_win.wm_title('Tile Layer')
         else:
             self.tlayout_win.wm_title(f"Tile Layer - {tlayout.filename}")
-        self.tlayout_pixmap.delete('all')
-        x_off = 0
-        y_off = 0
-        empty = Tile()
-        # create draw callback to draw tile to tlayout_pixmap
-        def _draw( start_x, start_y, stop_x, stop_y, color ):
-            self.tlayout_pixmap.create_rectangle(
-                x_off+start_x*TLAYOUT_SCALE,  y_off+start_y*TLAYOUT_SCALE,
-                x_off+stop_x*TLAYOUT_SCALE-1, y_off+stop_y*TLAYOUT_SCALE-1,
-                fill=color, outline=color)
-
+        self._tlayout_image = tk.PhotoImage(master=self.root,
+                                            width=TLAYOUT_WIDTH, height=TLAYOUT_HEIGHT)
+        self._tlayout_image.put('{'+tileset_palette[0]+'}',
+                                to=(0, 0, TLAYOUT_WIDTH, TLAYOUT_HEIGHT))
         for x in range(TLAYOUT_XSPAN):
             for y in range(TLAYOUT_YSPAN):
                 tle = tlayout.tile_at_xy(x,y)
-                if tle is None:
-                    empty.draw(_draw, tileset_palette)
-                else:
-                    tile_set[tle.tile].draw(_draw, [nes_palette[i] for i in tle.palette])
-                y_off += TLAYOUT_OFFSET
-            x_off += TLAYOUT_OFFSET
-            y_off = 0
+                if tle is not None:
+                    self._blit_tile(self._tlayout_image, tile_set[tle.tile],
+                                    [nes_palette[i] for i in tle.palette], TLAYOUT_SCALE,
+                                    x * TLAYOUT_OFFSET, y * TLAYOUT_OFFSET)
+        self.tlayout_pixmap.itemconfig(self._tlayout_item, image=self._tlayout_image)
 
     def clipboard_set( self, value ):
         """Sets the contents of the clipboard"""
@@ -499,6 +852,14 @@ class NesTileEditTk:
         """Gets the contents of the clipboard"""
         return self.root.clipboard_get()
 
+    @staticmethod
+    def showinfo( info: str ):
+        '''Display information to the user
+        Args:
+             info : the message to display
+        '''
+        messagebox.showinfo("Information", info)
+
     @staticmethod
     def showwarning( warning: str ):
         '''Display warning to the user
@@ -515,6 +876,18 @@ class NesTileEditTk:
         '''
         messagebox.showerror("Error", error)
 
+    @staticmethod
+    def askyesno( question: str ) -> bool:
+        '''Ask user a yes or no question
+        Args:
+            question : str of message to display in box
+
+        Returns:
+            True: Yes was selected
+            False: No was selected
+        '''
+        return messagebox.askyesno("Question", question)
+
     @staticmethod
     def askyesnocancel( question: str ) -> bool:
         '''Ask user a yes or no question with option to cancel
@@ -528,6 +901,30 @@ class NesTileEditTk:
         '''
         return messagebox.askyesnocancel("Question", question)
 
+    @staticmethod
+    def askbank( bank: int, bank_count: int ) -> int:
+        '''Ask user for the number of a CHR bank
+        Args:
+            bank : the bank shown at first
+            bank_count : the number of banks
+        Returns:
+            the bank number, None if cancelled
+        '''
+        return simpledialog.askinteger('Go to Bank', f"Bank number (0-{bank_count-1})",
+                                       initialvalue=bank, minvalue=0, maxvalue=bank_count-1)
+
+    @staticmethod
+    def askoffset( file_size: int ) -> int:
+        '''Ask user for the offset of compressed data in a file
+        Args:
+            file_size : the size of the file
+        Returns:
+            the offset, None if cancelled
+        '''
+        return simpledialog.askinteger('Import Compressed', "Offset of the data in the file",
+                                       initialvalue=0, minvalue=0,
+                                       maxvalue=max(0, file_size-1))
+
     @staticmethod
     def askconfigsettings( config: dict, callback: 'Callable' ):
         '''Ask user for configuration settings
@@ -550,89 +947,826 @@ def box_number(x:int, y:int, scale:int, row_span:int) -> int:
     return (x // scale) + row_span * (y // scale)
 
 
+# Color values(0-3) contributed by each bit of a low / high bitplane byte
+_LO_PLANE_BITS = tuple(tuple((byte >> i) & 1 for i in range(7,-1,-1)) for byte in range(256))
+_HI_PLANE_BITS = tuple(tuple(((byte >> i) & 1) << 1 for i in range(7,-1,-1))
+                       for byte in range(256))
+
+def chr_decode(chr_data: bytes):
+    """Decodes raw NES graphics data to the color values(0-3) of its pixels.
+    Args:
+        chr_data: the raw data, a whole number of 16 byte tiles
+    Returns:
+        an (N, 8, 8) uint8 array of tile/row/column when NumPy is installed,
+        otherwise a list of N tiles each a list of 8 rows of 8 values
+    Raises:
+        ValueError: the data ends with a partial tile
+    """
+    if len(chr_data) % BYTES_PER_TILE:
+        raise ValueError(f'CHR data of {len(chr_data)} bytes is not a whole number of tiles')
+    if np is not None:
+        planes = np.frombuffer(chr_data, dtype=np.uint8).reshape(-1, 2, TILESIZE)
+        bits = np.unpackbits(planes, axis=2).reshape(-1, 2, TILESIZE, TILESIZE)
+        return bits[:, 0] | (bits[:, 1] << 1)
+    chr_data = bytes(chr_data)
+    return [ [ list(map(int.__add__, _LO_PLANE_BITS[chr_data[base+y]],
+                        _HI_PLANE_BITS[chr_data[base+y+TILESIZE]]))
+               for y in range(TILESIZE) ]
+             for base in range(0, len(chr_data), BYTES_PER_TILE) ]
+
+def chr_encode(pixels) -> bytes:
+    """Encodes the color values(0-3) of tiles as raw NES graphics data.
+    Args:
+        pixels: an (N, 8, 8) array or nested sequence of tile/row/column values
+    Returns:
+        the raw data, 16 bytes per tile
+    """
+    if np is not None:
+        pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, TILESIZE, TILESIZE)
+        lo_plane = np.packbits(pixels & 1, axis=2)
+        hi_plane = np.packbits((pixels >> 1) & 1, axis=2)
+        return np.concatenate((lo_plane, hi_plane), axis=1).tobytes()
+    chr_data = bytearray()
+    for tile in pixels:
+        hi_data = bytearray()
+        for row in tile:
+            hi_bits = 0
+            lo_bits = 0
+            for col in row:
+                hi_bits = (hi_bits << 1)+((col >> 1) & 1)
+                lo_bits = (lo_bits << 1)+(col & 1)
+            hi_data.append(hi_bits)
+            chr_data.append(lo_bits)
+        chr_data += hi_data
+    return bytes(chr_data)
+
+def tile_sheet_rows(pixels, span: int):
+    """Lays out decoded tiles left to right and top to bottom, span tiles per row.
+    Args:
+        pixels: the tile/row/column color values, as returned by chr_decode
+        span: the number of tiles in a row of the sheet
+    Returns:
+        the rows of pixel color values(0-3) of the sheet, an array when NumPy
+        is installed. Blank tiles pad out the last row.
+    """
+    if np is not None:
+        pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, TILESIZE, TILESIZE)
+        padding = -len(pixels) % span
+        if padding:
+            pixels = np.concatenate((pixels, np.zeros((padding, TILESIZE, TILESIZE), np.uint8)))
+        return (pixels.reshape(-1, span, TILESIZE, TILESIZE).swapaxes(1, 2)
+                .reshape(-1, span*TILESIZE))
+    pixels = list(pixels)
+    pixels += [[[0]*TILESIZE]*TILESIZE] * (-len(pixels) % span)
+    return [ [ col for tile in pixels[first:first+span] for col in tile[y] ]
+             for first in range(0, len(pixels), span) for y in range(TILESIZE) ]
+
+def sheet_tiles(rows: list[bytes], span: int):
+    """Cuts 8 rows of a tile sheet into its span tiles, the reverse of tile_sheet_rows
+    Args:
+        rows: the 8 pixel rows, bytes of color values(0-3)
+    Returns:
+        the tile/row/column color values, as taken by chr_encode
+    Raises:
+        ValueError: a pixel value is over 3
+    """
+    if np is not None:
+        pixels = np.frombuffer(b''.join(rows), dtype=np.uint8)
+        if pixels.size and pixels.max() > 3:
+            raise ValueError('Tiles can only use 4 colors')
+        return pixels.reshape(TILESIZE, span, TILESIZE).swapaxes(0, 1)
+    if any(value > 3 for row in rows for value in row):
+        raise ValueError('Tiles can only use 4 colors')
+    return [ [ list(row[x*TILESIZE:(x+1)*TILESIZE]) for row in rows ] for x in range(span) ]
+
+# bytes.translate tables reversing the bits of a byte / inverting them /
+# rotating them one bit left or right
+_BIT_REVERSE = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256))
+_BIT_INVERT = bytes(byte ^ 0xFF for byte in range(256))
+_BIT_ROTATE_LEFT = bytes(((byte << 1) | (byte >> 7)) & 0xFF for byte in range(256))
+_BIT_ROTATE_RIGHT = bytes(((byte >> 1) | (byte << 7)) & 0xFF for byte in range(256))
+
+# Bit masks and shifts of the three delta swaps transposing an 8x8 bit matrix
+_TRANSPOSE_SWAPS = ((0x00AA00AA00AA00AA, 7), (0x0000CCCC0000CCCC, 14),
+                    (0x00000000F0F0F0F0, 28))
+
+def _plane_transpose(rows: bytes) -> bytes:
+    """Transposes an 8x8 bit matrix held as 8 row bytes, most significant bit first"""
+    bits = int.from_bytes(rows, 'big')
+    for mask, shift in _TRANSPOSE_SWAPS:
+        swap = (bits ^ (bits >> shift)) & mask
+        bits ^= swap ^ (swap << shift)
+    return bits.to_bytes(TILESIZE, 'big')
+
+def _plane_rows(data: bytes):
+    """Returns the tile data as an (N*2, 8) array of bitplane rows"""
+    return np.frombuffer(bytes(data), dtype=np.uint8).reshape(-1, TILESIZE)
+
+# The transforms below work on any whole number of 16 byte tiles, such as a
+# whole bank, without decoding their pixels
+
+def chr_hflip(data: bytes) -> bytes:
+    """Returns the tiles flipped horizontally"""
+    return bytes(data).translate(_BIT_REVERSE)
+
+def chr_vflip(data: bytes) -> bytes:
+    """Returns the tiles flipped vertically"""
+    if np is not None:
+        return _plane_rows(data)[:, ::-1].tobytes()
+    data = bytes(data)
+    return b''.join(data[base+TILESIZE-1:base-1 if base else None:-1]
+                    for base in range(0, len(data), TILESIZE))
+
+def chr_transpose(data: bytes) -> bytes:
+    """Returns the tiles mirrored along their top left to bottom right diagonal"""
+    if np is not None:
+        # The same swaps as _plane_transpose, on every bitplane at once
+        bits = np.frombuffer(bytes(data), dtype='>u8').astype(np.uint64)
+        for mask, shift in _TRANSPOSE_SWAPS:
+            mask, shift = np.uint64(mask), np.uint64(shift)
+            swap = (bits ^ (bits >> shift)) & mask
+            bits ^= swap ^ (swap << shift)
+        return bits.astype('>u8').tobytes()
+    data = bytes(data)
+    return b''.join(_plane_transpose(data[base:base+TILESIZE])
+                    for base in range(0, len(data), TILESIZE))
+
+def chr_invert(data: bytes) -> bytes:
+    """Returns the tiles with their colors inverted"""
+    return bytes(data).translate(_BIT_INVERT)
+
+def chr_rotate_cw(data: bytes) -> bytes:
+    """Returns the tiles rotated clockwise"""
+    return chr_hflip(chr_transpose(data))
+
+def chr_rotate_ccw(data: bytes) -> bytes:
+    """Returns the tiles rotated counter-clockwise"""
+    return chr_vflip(chr_transpose(data))
+
+def chr_shift_left(data: bytes) -> bytes:
+    """Returns the tiles shifted left 1 pixel, wrapping around"""
+    return bytes(data).translate(_BIT_ROTATE_LEFT)
+
+def chr_shift_right(data: bytes) -> bytes:
+    """Returns the tiles shifted right 1 pixel, wrapping around"""
+    return bytes(data).translate(_BIT_ROTATE_RIGHT)
+
+def chr_shift_up(data: bytes) -> bytes:
+    """Returns the tiles shifted up 1 pixel, wrapping around"""
+    if np is not None:
+        return np.roll(_plane_rows(data), -1, axis=1).tobytes()
+    data = bytes(data)
+    return b''.join(data[base+1:base+TILESIZE] + data[base:base+1]
+                    for base in range(0, len(data), TILESIZE))
+
+def chr_shift_down(data: bytes) -> bytes:
+    """Returns the tiles shifted down 1 pixel, wrapping around"""
+    if np is not None:
+        return np.roll(_plane_rows(data), 1, axis=1).tobytes()
+    data = bytes(data)
+    return b''.join(data[base+TILESIZE-1:base+TILESIZE] + data[base:base+TILESIZE-1]
+                    for base in range(0, len(data), TILESIZE))
+
+def chr_canonical(data: bytes) -> bytes:
+    """Returns the smallest of the 16 byte encodings a tile takes under flips,
+    rotations and color inversion, the same for all the mirrored forms of a tile"""
+    data = bytes(data)
+    variants = [data, chr_transpose(data)]
+    variants += [chr_hflip(variant) for variant in variants]
+    variants += [chr_vflip(variant) for variant in variants]
+    variants += [chr_invert(variant) for variant in variants]
+    return min(variants)
+
+def clipboard_encode(chr_data: bytes) -> str:
+    """Returns the clipboard text holding tiles
+    Args:
+        chr_data: the raw NES graphics data of the tiles, 16 bytes per tile
+    """
+    return (f"{CLIPBOARD_TAG}:{CLIPBOARD_VERSION}:{len(chr_data) // BYTES_PER_TILE}:" +
+            base64.b64encode(chr_data).decode('ascii'))
+
+def clipboard_decode(text: str) -> bytes:
+    """Returns the raw data of the tiles in clipboard text made by
+    clipboard_encode, or by the repr of a single Tile
+    Raises:
+        ValueError: the text does not hold tiles
+    """
+    text = text.strip()
+    if not text.startswith(CLIPBOARD_TAG + ':'):
+        try:
+            return Tile().from_str(text).tobytes()
+        except AttributeError:
+            raise ValueError('The clipboard does not hold tiles') from None
+    _, version, count, payload = text.split(':', 3)
+    if version != CLIPBOARD_VERSION:
+        raise ValueError(f'Unknown clipboard tile format {version}')
+    chr_data = base64.b64decode(payload, validate=True)
+    if len(chr_data) != int(count) * BYTES_PER_TILE:
+        raise ValueError('The clipboard tile data is truncated')
+    return chr_data
+
+
+def _png_chunk(fout, kind: bytes, data: bytes):
+    """Writes one PNG chunk with its length and CRC"""
+    fout.write(struct.pack('>I', len(data)) + kind)
+    fout.write(data)
+    fout.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+def png_write(fout, width: int, height: int, colors: list[str], rows):
+    """Writes an 8 bit indexed color PNG, compressing the rows as they come so
+    only one IDAT chunk is held in memory.
+    Args:
+        fout: the binary file to write to
+        width, height: the size of the image in pixels
+        colors: the palette, '#RRGGBB' strings
+        rows: iterable of the height rows of width color indexes, as bytes
+    """
+    fout.write(PNG_SIGNATURE)
+    _png_chunk(fout, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+    _png_chunk(fout, b'PLTE', b''.join(bytes.fromhex(color[1:]) for color in colors))
+    compressor = zlib.compressobj()
+    idat = bytearray()
+    for row in rows:
+        # Each row starts with its filter type, none
+        idat += compressor.compress(b'\0')
+        idat += compressor.compress(row)
+        if len(idat) >= PNG_IDAT_SIZE:
+            _png_chunk(fout, b'IDAT', bytes(idat))
+            idat.clear()
+    idat += compressor.flush()
+    _png_chunk(fout, b'IDAT', bytes(idat))
+    _png_chunk(fout, b'IEND', b'')
+
+def _png_chunks(fin):
+    """Yields the (type, data) of the chunks of a PNG file after its signature"""
+    while True:
+        header = fin.read(8)
+        if len(header) < 8:
+            raise ValueError('PNG file is truncated')
+        length, kind = struct.unpack('>I4s', header)
+        data = fin.read(length)
+        crc = fin.read(4)
+        if len(data) < length or len(crc) < 4:
+            raise ValueError('PNG file is truncated')
+        if struct.unpack('>I', crc)[0] != zlib.crc32(data, zlib.crc32(kind)):
+            raise ValueError(f'PNG {kind.decode("latin-1")} chunk is corrupted')
+        yield kind, data
+        if kind == b'IEND':
+            return
+
+class PngImage(namedtuple('PngImage', ['width', 'height', 'depth', 'palette', 'rows'])):
+    """A PNG being read: its size, its bits per pixel, the (r, g, b) of its
+    palette (None for grayscale) and an iterator over its rows of pixel values"""
+    __slots__ = ()
+
+def png_read(fin) -> PngImage:
+    """Reads an indexed color or grayscale PNG of up to 8 bits per pixel
+    Args:
+        fin: the binary file to read from
+    Returns:
+        the image, whose rows are bytes of one value per pixel, decoded as
+        the file is read
+    """
+    if fin.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise ValueError('Not a PNG file')
+    chunks = _png_chunks(fin)
+    kind, data = next(chunks)
+    if kind != b'IHDR':
+        raise ValueError('PNG file does not start with its header')
+    width, height, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', data)
+    if color_type not in (0, 3) or depth > 8 or interlace:
+        raise ValueError('Only non interlaced indexed color or grayscale PNG files '
+                         'of up to 8 bits per pixel can be read')
+    # The palette comes before the image data
+    palette = None
+    for kind, data in chunks:
+        if kind == b'PLTE':
+            palette = [ tuple(data[i:i+3]) for i in range(0, len(data) - 2, 3) ]
+        elif kind in (b'IDAT', b'IEND'):
+            break
+    if color_type == 3 and palette is None:
+        raise ValueError('Indexed color PNG file has no palette')
+    chunks = itertools.chain(((kind, data),), chunks)
+    return PngImage(width, height, depth, palette, _png_rows(chunks, width, height, depth))
+
+def png_color_table(image: PngImage, values: set[int]) -> bytes:
+    """Returns the bytes.translate table taking the pixel values of image to
+    tile colors(0-3). Grays go from dark to light, except the 4 evenly spaced
+    levels of a 2 bit image that are mapped to the colors of the same level.
+    Palette indexes 0-3 are kept, other indexes are ordered as in the palette.
+    Args:
+        values: the pixel values used by image
+    Raises:
+        ValueError: more than 4 values are used
+    """
+    if len(values) > 4:
+        raise ValueError('Tiles can only use 4 colors')
+    table = bytearray(range(256))
+    top = (1 << image.depth) - 1
+    if image.palette is None and all(value * 3 % top == 0 for value in values):
+        for value in values:
+            table[value] = value * 3 // top
+    elif image.palette is None or max(values, default=0) > 3:
+        for color, value in enumerate(sorted(values)):
+            table[value] = color
+    return bytes(table)
+
+def _png_rows(chunks, width: int, height: int, depth: int):
+    """Yields the unfiltered and unpacked rows of the IDAT chunks"""
+    stride = (width * depth + 7) // 8
+    decompressor = zlib.decompressobj()
+    data = bytearray()
+    prior = bytes(stride)
+    count = 0
+    for kind, chunk in chunks:
+        if kind != b'IDAT':
+            continue
+        while chunk and count < height:
+            data += decompressor.decompress(chunk, PNG_IDAT_SIZE)
+            chunk = decompressor.unconsumed_tail
+            start = 0
+            while len(data) - start > stride and count < height:
+                prior = _png_unfilter(data[start], data[start+1:start+1+stride], prior)
+                yield _png_unpack(prior, width, depth)
+                start += stride + 1
+                count += 1
+            del data[:start]
+    if count < height:
+        raise ValueError('PNG file is missing image data')
+
+def _png_unfilter(kind: int, line: bytes, prior: bytes) -> bytes:
+    """Returns the bytes of a row filtered with filter type kind, for one byte
+    per pixel. The None, Sub and Up filters are vectorized with NumPy."""
+    if kind == 0:
+        return bytes(line)
+    if np is not None and kind in (1, 2):
+        line = np.frombuffer(line, dtype=np.uint8)
+        if kind == 1:
+            return np.cumsum(line, dtype=np.uint8).tobytes()
+        return (line + np.frombuffer(prior, dtype=np.uint8)).tobytes()
+    out = bytearray(line)
+    left = up_left = 0
+    for i, up in enumerate(prior):
+        if kind == 1:
+            predictor = left
+        elif kind == 2:
+            predictor = up
+        elif kind == 3:
+            predictor = (left + up) >> 1
+        elif kind == 4:
+            estimate = left + up - up_left
+            dist_left, dist_up = abs(estimate - left), abs(estimate - up)
+            dist_up_left = abs(estimate - up_left)
+            if dist_left <= dist_up and dist_left <= dist_up_left:
+                predictor = left
+            elif dist_up <= dist_up_left:
+                predictor = up
+            else:
+                predictor = up_left
+        else:
+            raise ValueError(f'Unknown PNG filter type {kind}')
+        left = out[i] = (out[i] + predictor) & 0xFF
+        up_left = up
+    return bytes(out)
+
+def _png_unpack(line: bytes, width: int, depth: int) -> bytes:
+    """Returns the pixel values of a row packed depth bits per pixel"""
+    if depth == 8:
+        return line
+    shifts = range(8 - depth, -1, -depth)
+    mask = (1 << depth) - 1
+    if np is not None:
+        values = (np.frombuffer(line, dtype=np.uint8)[:, None] >>
+                  np.array(shifts, dtype=np.uint8)) & mask
+        return values.ravel()[:width].tobytes()
+    return bytes((byte >> shift) & mask for byte in line for shift in shifts)[:width]
+
+class ChrCodec(namedtuple('ChrCodec', ['name', 'description', 'encode', 'decode'])):
+    """Compression scheme of tile data. encode takes the raw data and returns
+    the compressed bytes; decode takes a buffer and the offset the compressed
+    data starts at, and returns the raw data and the offset after its end.
+    Both work on whole buffers rather than fed chunks: compressed graphics are
+    at most a few 8 KB banks, and the end of the data is only known once it
+    has been decoded."""
+    __slots__ = ()
+
+# Codec name: ChrCodec, extended by register_codec
+CHR_CODECS = {}
+
+def register_codec(codec: ChrCodec):
+    """Makes codec available to the tile set import and export and the batch commands"""
+    CHR_CODECS[codec.name] = codec
+    return codec
+
+# Runs of a same byte, matched in C rather than byte by byte
+_BYTE_RUNS = re.compile(rb'(.)\1*', re.DOTALL)
+
+def _truncated(data: bytes, end: int):
+    """Raises ValueError if the compressed data stops before end"""
+    if end > len(data):
+        raise ValueError('Compressed data is truncated')
+
+def rle_encode(chr_data: bytes) -> bytes:
+    """Compresses data in the RLE format of Shiru's neslib: a tag byte that
+    the data does not use, then literal bytes where a tag followed by a count
+    repeats the previous byte count times, and a tag followed by 0 ends it
+    Raises:
+        ValueError: the data uses all 256 byte values, leaving none for the tag
+    """
+    counts = [0] * 256
+    runs = [ (match.group(1), match.end() - match.start())
+             for match in _BYTE_RUNS.finditer(chr_data) ]
+    for byte, _ in runs:
+        counts[byte[0]] += 1
+    if 0 not in counts:
+        raise ValueError('RLE needs a byte value the data does not use')
+    tag = counts.index(0)
+    out = bytearray((tag,))
+    for byte, length in runs:
+        out += byte
+        length -= 1
+        # A repeat takes 2 bytes, so shorter runs stay literal
+        while length > 2:
+            count = min(length, 255)
+            out += bytes((tag, count))
+            length -= count
+        out += byte * length
+    out += bytes((tag, 0))
+    return bytes(out)
+
+def rle_decode(data: bytes, offset: int = 0) -> tuple[bytes, int]:
+    """Decompresses neslib RLE data starting at offset
+    Returns:
+        the data and the offset after the end tag
+    """
+    _truncated(data, offset + 1)
+    tag = data[offset]
+    pos = offset + 1
+    out = bytearray()
+    while True:
+        # Bytes up to the next tag are copied as they are
+        end = data.find(tag, pos)
+        if end < 0:
+            raise ValueError('Compressed data is truncated')
+        out += data[pos:end]
+        _truncated(data, end + 2)
+        count = data[end + 1]
+        pos = end + 2
+        if count == 0:
+            return bytes(out), pos
+        if not out:
+            raise ValueError('RLE repeat before any byte')
+        out += out[-1:] * count
+
+def konami_encode(chr_data: bytes) -> bytes:
+    """Compresses data in the Konami RLE format: a control byte 01-80 repeats
+    the next byte that many times, 81-FE copies the next control-80 bytes,
+    and FF ends the data"""
+    out = bytearray()
+    literal = bytearray()
+    def flush_literal():
+        for first in range(0, len(literal), 0x7E):
+            chunk = literal[first:first+0x7E]
+            out.append(0x80 + len(chunk))
+            out.extend(chunk)
+        literal.clear()
+    for match in _BYTE_RUNS.finditer(chr_data):
+        byte, length = match.group(1), match.end() - match.start()
+        # A repeat takes 2 bytes, so shorter runs join the literal bytes
+        if length < 3:
+            literal += byte * length
+            continue
+        flush_literal()
+        while length:
+            count = min(length, 0x80)
+            out.append(count)
+            out += byte
+            length -= count
+    flush_literal()
+    out.append(0xFF)
+    return bytes(out)
+
+def konami_decode(data: bytes, offset: int = 0) -> tuple[bytes, int]:
+    """Decompresses Konami RLE data starting at offset
+    Returns:
+        the data and the offset after the end byte
+    """
+    out = bytearray()
+    pos = offset
+    while True:
+        _truncated(data, pos + 1)
+        control = data[pos]
+        if control == 0xFF:
+            return bytes(out), pos + 1
+        if control <= 0x80:
+            _truncated(data, pos + 2)
+            out += data[pos+1:pos+2] * control
+            pos += 2
+        else:
+            count = control - 0x80
+            _truncated(data, pos + 1 + count)
+            out += data[pos+1:pos+1+count]
+            pos += 1 + count
+
+register_codec(ChrCodec('rle', "neslib RLE", rle_encode, rle_decode))
+register_codec(ChrCodec('konami', "Konami RLE", konami_encode, konami_decode))
+
+
+class TileHashIndex:
+    """Index of the tiles of a TileSet by their 16 byte encoding, and by the
+    encoding shared by their flipped, rotated and inverted forms.
+    The tiles reported through TileSet.mark_modified are only marked stale, and
+    reindexed by the next lookup, so drawing does not pay for the index.
+    """
+    def __init__(self, tile_set: 'TileSet'):
+        self._tile_set = tile_set
+        # Tile index to its (encoding, canonical encoding)
+        self._keys = []
+        # Encoding / canonical encoding to the set of tile indexes having it
+        self._by_data = {}
+        self._by_canonical = {}
+        # Indexes of the tiles changed since they were indexed
+        self._stale = set()
+        canonical_of = {}
+        for idx in range(len(tile_set)):
+            data = bytes(tile_set.tile_bytes(idx))
+            if data not in canonical_of:
+                canonical_of[data] = chr_canonical(data)
+            self._add(idx, data, canonical_of[data])
+
+    def _add(self, idx: int, data: bytes, canonical: bytes):
+        """Adds tile idx with its keys to the index"""
+        if idx == len(self._keys):
+            self._keys.append((data, canonical))
+        else:
+            self._keys[idx] = (data, canonical)
+        self._by_data.setdefault(data, set()).add(idx)
+        self._by_canonical.setdefault(canonical, set()).add(idx)
+
+    @staticmethod
+    def _remove_from(table: dict, key: bytes, idx: int):
+        """Removes idx from the set of key in table"""
+        idxs = table[key]
+        idxs.discard(idx)
+        if not idxs:
+            del table[key]
+
+    def mark_stale(self, idx: int):
+        """Records that tile idx has changed, to be reindexed on the next lookup"""
+        self._stale.add(idx)
+
+    def _refresh(self):
+        """Reindexes the tiles changed since the last lookup"""
+        for idx in self._stale:
+            data = bytes(self._tile_set.tile_bytes(idx))
+            old_data, old_canonical = self._keys[idx]
+            if data == old_data:
+                continue
+            self._remove_from(self._by_data, old_data, idx)
+            self._remove_from(self._by_canonical, old_canonical, idx)
+            self._add(idx, data, chr_canonical(data))
+        self._stale.clear()
+
+    def find(self, data: bytes) -> list[int]:
+        """Returns the indexes of the tiles encoded as data"""
+        self._refresh()
+        return sorted(self._by_data.get(bytes(data), ()))
+
+    def find_mirrors(self, data: bytes) -> list[int]:
+        """Returns the indexes of the tiles that are a flipped, rotated or
+        inverted form of the tile encoded as data"""
+        self._refresh()
+        return sorted(self._by_canonical.get(chr_canonical(data), ()))
+
+    def duplicates(self) -> list[list[int]]:
+        """Returns the groups of tile indexes having the same pixels"""
+        self._refresh()
+        return sorted(sorted(idxs) for idxs in self._by_data.values() if len(idxs) > 1)
+
+    def mirror_duplicates(self) -> list[list[int]]:
+        """Returns the groups of tile indexes having the same pixels up to
+        flipping, rotating and inverting"""
+        self._refresh()
+        return sorted(sorted(idxs) for idxs in self._by_canonical.values() if len(idxs) > 1)
+
+
+class LRUCache:
+    """Mapping holding at most maxsize items, dropping the least recently used first"""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        """Returns the item for key, marking it as the most recently used"""
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return default
+        return self._items[key]
+
+    def put(self, key, value):
+        """Adds or replaces the item for key, evicting the oldest items over maxsize"""
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def discard(self, key):
+        """Removes the item for key if it is cached"""
+        self._items.pop(key, None)
+
+    def clear(self):
+        """Removes all the items"""
+        self._items.clear()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class TaskCancelled(Exception):
+    """Raised by the progress callback of a cancelled BackgroundTask"""
+
+
+class BackgroundTask:
+    """Runs work on a worker thread and hands its progress and result back
+    through a queue, for the UI thread to poll.
+    Args:
+        work: function called on the worker thread with a progress(done, total)
+            callback, which raises TaskCancelled once cancel is called
+        description: what the task does, for the progress display
+    """
+    def __init__(self, work: 'Callable', description: str):
+        self.description = description
+        self.messages = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(work,), daemon=True)
+
+    def start(self):
+        """Starts the work on the worker thread"""
+        self._thread.start()
+
+    def _run(self, work: 'Callable'):
+        try:
+            self.messages.put(('done', work(self.progress)))
+        except TaskCancelled:
+            self.messages.put(('cancelled', None))
+        except Exception as err:
+            self.messages.put(('error', err))
+
+    def progress(self, done: int, total: int):
+        """Reports progress from the worker thread
+        Raises:
+            TaskCancelled: the task has been cancelled
+        """
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+        self.messages.put(('progress', done / total if total else 1.0))
+
+    def cancel(self):
+        """Asks the work to stop at its next progress report"""
+        self._cancelled.set()
+
+    def join(self):
+        """Waits for the work to end"""
+        self._thread.join()
+
+    def poll(self) -> list[tuple]:
+        """Returns the (kind, value) messages sent since the last poll. kind is
+        'progress' with the fraction done, or one of 'done' with the result,
+        'error' with the exception and 'cancelled' as the last message."""
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
+
+
+# Shared backing store of every all-zero Tile, copied on first write
+_ZERO_TILE_DATA = bytes(BYTES_PER_TILE)
+
 class Tile:
-    """Represents a single 8x8 Tile that could be mapped to various windows"""
+    """Represents a single 8x8 Tile that could be mapped to various windows
+
+    The pixels are kept in their native NES form, 16 bytes holding the low
+    bitplane rows followed by the high bitplane rows.
+    """
+    __slots__ = ('_data',)
+
     def __init__(self, data_yx=None):
-        if data_yx is None:
-            self._pixels = None
-        elif isinstance(data_yx, list):
-            self._pixels = [ row[:TILESIZE] for row in data_yx[:TILESIZE] ]
+        self._data = _ZERO_TILE_DATA
+        if isinstance(data_yx, list):
+            self._data = bytearray(BYTES_PER_TILE)
+            for y, row in enumerate(data_yx[:TILESIZE]):
+                for x, value in enumerate(row[:TILESIZE]):
+                    self.set(x, y, value)
         elif isinstance(data_yx, str):
             self.from_str( data_yx )
         elif isinstance(data_yx, Tile):
-            if data_yx._pixels is None:
-                self._pixels = None
-            else:
-                self._pixels = [ row[:] for row in data_yx._pixels ]
-        elif isinstance(data_yx, (bytes, bytearray)):
+            self.frombytes(data_yx._data)
+        elif isinstance(data_yx, (bytes, bytearray, memoryview)):
             self.frombytes(data_yx)
+
+    @classmethod
+    def view(cls, buffer) -> 'Tile':
+        """Returns a Tile reading and writing its 16 bytes directly in buffer,
+        such as a memoryview slice of a larger block of CHR data"""
+        tile = cls.__new__(cls)
+        tile._data = buffer
+        return tile
+
+    def _writable(self):
+        """Returns the tile buffer, replacing the shared zero data before the first write"""
+        if isinstance(self._data, bytes):
+            self._data = bytearray(self._data)
+        return self._data
+
+    def _replace(self, data: bytes):
+        """Replaces the 16 bytes of the tile, keeping the current buffer if it is writable
+        Raises:
+            ValueError: data is not 16 bytes long, which would resize the buffer
+        """
+        if len(data) != BYTES_PER_TILE:
+            raise ValueError(f'Tile data must be {BYTES_PER_TILE} bytes, not {len(data)}')
+        if isinstance(self._data, bytes):
+            self._data = _ZERO_TILE_DATA if data == _ZERO_TILE_DATA else bytearray(data)
         else:
-            self._pixels = None
+            self._data[:] = data
+        self._changed()
+
+    def _changed(self):
+        """Called after each change to the tile data, for views to report it"""
+
+    def is_blank(self) -> bool:
+        """Returns True if all the pixels of the tile are color 0"""
+        return self._data == _ZERO_TILE_DATA
 
     def set(self, x: int, y: int, value: int ):
         """Set color value(0-3) of pixel at (x,y)"""
-        if self._pixels is None:
-            self._pixels = [[0]*TILESIZE for _ in range(TILESIZE)]
-        self._pixels[y][x]=value
+        data = self._writable()
+        mask = 0x80 >> x
+        if value & 1:
+            data[y] |= mask
+        else:
+            data[y] &= ~mask
+        if value & 2:
+            data[y+TILESIZE] |= mask
+        else:
+            data[y+TILESIZE] &= ~mask
+        self._changed()
 
     def get(self, x: int, y: int ) -> int:
         """Returns color value(0-3) of pixel at (x,y)"""
-        if self._pixels is None:
-            return 0
-        return self._pixels[y][x]
+        shift = 7 - x
+        return ((self._data[y] >> shift) & 1) | (((self._data[y+TILESIZE] >> shift) & 1) << 1)
+
+    def tolist(self) -> list[list[int]]:
+        """Returns the color values(0-3) of the tile as a list of rows"""
+        data = self._data
+        return [ [ ((data[y] >> i) & 1) | (((data[y+TILESIZE] >> i) & 1) << 1)
+                   for i in range(7,-1,-1) ]
+                 for y in range(TILESIZE) ]
 
     def __repr__(self):
-        if self._pixels is None:
+        if self.is_blank():
             return f"{type(self).__name__}(None)"
         return ( f"{type(self).__name__}([\n    " +
-            ',\n    '.join( repr(row) for row in self._pixels) + "\n    ])" )
+            ',\n    '.join( repr(row) for row in self.tolist()) + "\n    ])" )
 
     def __eq__(self, value):
-        if self._pixels is None:
-            return value==[[0]*TILESIZE for _ in range(TILESIZE)]
-        return value==self._pixels
+        if isinstance(value, Tile):
+            return self._data == value._data
+        return value==self.tolist()
 
     def tobytes(self) ->  bytes:
         """Returns tile data as bytes containing raw NES graphics data,"""
-        if self._pixels is None:
-            return b"\0" * BYTES_PER_TILE
-        hi_data = bytearray(b"")
-        lo_data = bytearray(b"")
-        for row in self._pixels:
-            hi_bits = 0
-            lo_bits = 0
-            for col in row:
-                hi_bits = (hi_bits << 1)+((col >> 1) & 1)
-                lo_bits = (lo_bits << 1)+(col & 1)
-            hi_data.append(hi_bits)
-            lo_data.append(lo_bits)
-        return lo_data + hi_data
+        return bytes(self._data)
 
     def frombytes(self, data:bytes):
-        """Given bytes containing raw NES graphics data (in binary), sets tile data"""
-        if (b"\0" * BYTES_PER_TILE) == data[0:BYTES_PER_TILE]:
-            self._pixels = None
-            return self
-        self._pixels = []
-        for y in range(TILESIZE):
-            hi_bits = (data[y+8] << 1)
-            lo_bits = data[y]
-            self._pixels.append( [ ((hi_bits >> (i)) & 2) + ((lo_bits >> (i)) & 1)
-                                  for i in range(7,-1,-1) ] )
+        """Given bytes containing raw NES graphics data (in binary), sets tile data
+        Raises:
+            ValueError: data is shorter than a tile
+        """
+        self._replace(data[0:BYTES_PER_TILE])
         return self
 
     def from_str(self, data: str):
         """Sets tile data given a Tile string repr"""
         clean_whitespace = "".join(data.split())
         if clean_whitespace == f"{type(self).__name__}(None)":
-            self._pixels = None
+            self._replace(_ZERO_TILE_DATA)
         else:
             regex = re.compile(f"^{type(self).__name__}"r"\(\[\[([0-3,]*)\],"
                                 r"\[([0-3,]*)\],\[([0-3,]*)\],\[([0-3,]*)\],"
                                 r"\[([0-3,]*)\],\[([0-3,]*)\],\[([0-3,]*)\],"
                                 r"\[([0-3,]*)\]\]\)$")
             list_rows=regex.match(clean_whitespace).groups()
-            self._pixels=[[int(val) for val in row.split(",")] for row in list_rows]
+            self._replace(Tile([[int(val) for val in row.split(",")]
+                                for row in list_rows])._data)
+        return self
 
     def draw(self, draw: 'Callable', pal: list['Color']):
         """Draws the tile on to pixel resolution draw function.
@@ -641,73 +1775,210 @@ class Tile:
                 of the form Func(start_x:int, start_y:int, stop_x:int, stop_y:int, 'Color')
             pal: a list of 4 'Color's that will passed into the draw function when drawing.
         """
-        if self._pixels is None:
+        if self.is_blank():
             draw(0, 0, TILESIZE, TILESIZE, pal[0])
             return
-        for y, row in enumerate(self._pixels):
-            for x, pixel in enumerate(row):
-                draw(x, y, x+1, y+1, pal[pixel])
+        data = self._data
+        for y in range(TILESIZE):
+            lo_bits = data[y]
+            hi_bits = data[y+TILESIZE] << 1
+            for x in range(TILESIZE):
+                shift = 7 - x
+                draw(x, y, x+1, y+1, pal[((hi_bits >> shift) & 2) | ((lo_bits >> shift) & 1)])
+
+    def _transform(self, transform: 'Callable'):
+        """Replaces the tile data with transform applied to it, leaving blank
+        tiles, which no move changes, alone"""
+        if not self.is_blank():
+            self._writable()[:] = transform(self._data)
+            self._changed()
 
     def shift_up(self):
         """Shifts tile up 1 pixel"""
-        if self._pixels is not None:
-            self._pixels = self._pixels[1:] + [self._pixels[0]]
+        self._transform(chr_shift_up)
 
     def shift_down(self):
         """Shifts tile down 1 pixel"""
-        if self._pixels is not None:
-            self._pixels = [self._pixels[-1]] + self._pixels[:-1]
+        self._transform(chr_shift_down)
 
     def shift_left(self):
         """Shifts tile left 1 pixel"""
-        if self._pixels is not None:
-            self._pixels = [ row[1:]+[row[0]] for row in self._pixels]
+        self._transform(chr_shift_left)
 
     def shift_right(self):
         """Shifts tile right 1 pixel"""
-        if self._pixels is not None:
-            self._pixels = [ [row[-1]]+row[:-1] for row in self._pixels]
+        self._transform(chr_shift_right)
 
     def invert(self):
         """Inverts colors of pixels in tile"""
-        if self._pixels is None:
-            self._pixels = [[3]*TILESIZE for _ in range(TILESIZE)]
-        else:
-            self._pixels = [ [ (3-val) for val in row] for row in self._pixels ]
+        self._writable()[:] = chr_invert(self._data)
+        self._changed()
 
     def vflip(self):
         """Flips tile vertically"""
-        if self._pixels is not None:
-            self._pixels.reverse()
+        self._transform(chr_vflip)
 
     def hflip(self):
         """Flips tile horizontally"""
-        if self._pixels is not None:
-            for row in self._pixels:
-                row.reverse()
+        self._transform(chr_hflip)
 
     def cwrotate(self):
         """Rotates tile clockwise"""
-        if self._pixels is not None:
-            self._pixels = [[ self._pixels[y][x] for y in range(TILESIZE-1,-1,-1)]
-                            for x in range(TILESIZE)]
+        self._transform(chr_rotate_cw)
 
     def ccwrotate(self):
         """Rotates tile counter-clockwise"""
-        if self._pixels is not None:
-            self._pixels = [[ self._pixels[y][x] for y in range(TILESIZE)]
-                            for x in range(TILESIZE-1,-1,-1)]
+        self._transform(chr_rotate_ccw)
+
+class TileSetTile(Tile):
+    """A Tile view of one tile of a TileSet, reporting its changes to the set
+    so they are saved, journaled and redrawn"""
+    __slots__ = ('_tile_set', '_idx')
+
+    def _changed(self):
+        self._tile_set.mark_modified(self._idx)
+
+class TileSetSnapshot(namedtuple('TileSetSnapshot', ['filename', 'chunks', 'patch', 'dirty',
+                                                     'file_size', 'tile_count'])):
+    """Copy of what a save of a TileSet writes: the (file offset, bytes) chunks,
+    written over a copy of the existing file if patch or else as a new file"""
+    __slots__ = ()
+
+
+class InesIndex(namedtuple('InesIndex', ['nes2', 'header', 'trainer', 'prg', 'chr', 'misc'])):
+    """Byte (offset, length) of each part of an iNES file: the 16 byte header,
+    the trainer (empty without one), the PRG ROM, the CHR ROM and the misc ROM,
+    which is everything after the CHR ROM. Parts of a truncated file are cut
+    at its end."""
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, header: bytes, file_size: int) -> 'InesIndex':
+        """Returns the index of an iNES file of file_size bytes from its header,
+        in the iNES or the NES 2.0 format"""
+        if len(header) < INES_HEADER_SIZE:
+            raise ValueError(f'An iNES header is {INES_HEADER_SIZE} bytes')
+        nes2 = header[INES_HEADER_FLAGS7_IDX] & 0x0C == 0x08
+        msb = header[INES_HEADER_ROM_MSB_IDX] if nes2 else 0
+        sizes = ( INES_TRAINER_SIZE if header[INES_HEADER_FLAGS6_IDX] & INES_TRAINER_FLAG else 0,
+                  cls._rom_size(header[INES_HEADER_PROMS_IDX], msb & 0x0F, PROM_INC),
+                  cls._rom_size(header[INES_HEADER_CROMS_IDX], msb >> 4, CROM_INC) )
+        parts = [(0, INES_HEADER_SIZE)]
+        offset = INES_HEADER_SIZE
+        for size in sizes:
+            size = max(0, min(size, file_size - offset))
+            parts.append((offset, size))
+            offset += size
+        parts.append((offset, max(0, file_size - offset)))
+        return cls(nes2, *parts)
+
+    @staticmethod
+    def _rom_size(lsb: int, msb: int, unit: int) -> int:
+        """Returns a ROM size from its header bytes"""
+        if msb == 0x0F:
+            # NES 2.0 exponent-multiplier notation, 2^E * (MM*2+1) bytes
+            return (1 << (lsb >> 2)) * ((lsb & 3) * 2 + 1)
+        return ((msb << 8) | lsb) * unit
+
+    @classmethod
+    def from_file(cls, fin) -> 'InesIndex':
+        """Returns the index of the opened iNES file fin, only reading its header"""
+        fin.seek(0)
+        return cls.parse(fin.read(INES_HEADER_SIZE), os.fstat(fin.fileno()).st_size)
+
+
+def read_chr_bank(filename: str, bank: int) -> bytes:
+    """Returns the 8 KB CHR bank number bank of a raw or iNES file, reading
+    only that bank from the file. The last bank may be shorter."""
+    with open(filename, 'rb') as fin:
+        if filename.split('.')[-1] == 'nes':
+            chr_offset, chr_size = InesIndex.from_file(fin).chr
+        else:
+            chr_offset, chr_size = 0, os.fstat(fin.fileno()).st_size
+        if not 0 <= bank * CROM_INC < chr_size:
+            raise IndexError('bank index out of range')
+        fin.seek(chr_offset + bank * CROM_INC)
+        return fin.read(min(CROM_INC, chr_size - bank * CROM_INC))
+
 
 class TileSet:
     """Class holding the tile pixel data for the entire tile set.
-    Represents the data in the character ROM
+    Represents the data in the character ROM, kept as one buffer of raw NES
+    graphics data. Indexing returns 'Tile' views into that buffer.
+
+    With use_mmap the CHR data is a private memory map of the opened file,
+    so only the pages that are looked at get read. Saving back to the opened
+    file only writes the tiles reported through mark_modified.
     """
-    def __init__(self, rom_size=CROM_INC, filename=None):
+    def __init__(self, rom_size=CROM_INC, filename=None, use_mmap=False):
         # for pylint data member initialization detection
-        self.chr_rom_size = self.tile_data = self.file_format = None
-        self.ines_data = self.filename = self.modified = None
+        self.chr_rom_size = self.chr_data = self.file_format = None
+        self.ines_data = self.trailing_data = self.ines_index = self.filename = None
+        self.use_mmap = use_mmap
+        self._chr_view = self._mmap = None
+        self._hash_index = None
+        # Decoded pixels of the recently viewed banks, the others stay raw bytes
+        self._banks = LRUCache(BANK_CACHE_SIZE)
+        self._modified = False
+        # RecoveryJournal getting every change reported through mark_modified
+        self.journal = None
+        # Indexes of the tiles changed since the last save, None if unknown
+        self._dirty = set()
+        # Path and size of the file the data was last loaded from or saved to
+        self._file_path = self._file_size = None
         self.reset(rom_size, filename)
 
+    @property
+    def modified(self) -> bool:
+        """True if the tile data has changed since it was last opened or saved"""
+        return self._modified
+
+    @modified.setter
+    def modified(self, value: bool):
+        # Changes not reported through mark_modified could be anywhere
+        self._modified = value
+        self._dirty = None if value else set()
+        if value:
+            self._hash_index = None
+            self._banks.clear()
+
+    def mark_modified(self, idx: int):
+        """Records that the tile at idx has been changed"""
+        self._modified = True
+        if self._dirty is not None:
+            self._dirty.add(idx)
+        if self._hash_index is not None:
+            self._hash_index.mark_stale(idx)
+        self._banks.discard(idx // TILES_PER_BANK)
+        if self.journal is not None:
+            self.journal.record(idx, self.tile_bytes(idx))
+
+    def hash_index(self) -> TileHashIndex:
+        """Returns the index of the tiles by content, building it on first use"""
+        if self._hash_index is None:
+            self._hash_index = TileHashIndex(self)
+        return self._hash_index
+
+    def bank_count(self) -> int:
+        """Returns the number of 8 KB CHR banks, counting a partial last one"""
+        return -(-len(self) // TILES_PER_BANK)
+
+    def bank_pixels(self, bank: int):
+        """Returns the color values of the tiles of bank, as returned by
+        chr_decode. Banks are only decoded when asked for, and the last
+        BANK_CACHE_SIZE of them are kept until their tiles change."""
+        pixels = self._banks.get(bank)
+        if pixels is None:
+            if not 0 <= bank < self.bank_count():
+                raise IndexError('bank index out of range')
+            pixels = self.get_pixels(bank * TILES_PER_BANK, (bank + 1) * TILES_PER_BANK)
+            self._banks.put(bank, pixels)
+        return pixels
+
+    def tile_bytes(self, idx: int) -> memoryview:
+        """Returns a view of the 16 bytes of raw NES graphics data of tile idx"""
+        return self._chr_view[idx*BYTES_PER_TILE:(idx+1)*BYTES_PER_TILE]
+
     def reset(self, rom_size=None, filename=None):
         """Reinitialize class variables, except data size may be kept."""
         if filename is not None:
@@ -723,75 +1994,767 @@ class TileSet:
         self.modified = False
         # Holds iNES PRG and header data when opening iNES ROM's
         self.ines_data = None
-        # Holds the tile bitmaps as 'Tile's
-        self.tile_data = [Tile() for _ in range(self.chr_rom_size//BYTES_PER_TILE)]
+        # Holds the data found after the CHR data, such as NES 2.0 misc ROMs
+        self.trailing_data = None
+        # Where each part of the opened iNES file is
+        self.ines_index = None
+        self._file_path = self._file_size = None
+        # Holds the raw graphics data of all the tiles
+        self._set_chr_data(bytearray(self.chr_rom_size))
+
+    def _set_chr_data(self, chr_data):
+        """Replaces the tile data buffer"""
+        self.chr_data = chr_data
+        self.chr_rom_size = len(chr_data)
+        self._chr_view = memoryview(chr_data)
+        self._hash_index = None
+        self._banks.clear()
+
+    def _close_mmap(self):
+        """Drops the memory map of the previously opened file"""
+        if self._mmap is None:
+            return
+        self.chr_data = self._chr_view = self.ines_data = self.trailing_data = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Tile views are still around, the map goes away with them
+            pass
+        self._mmap = None
+
+    def _header_size(self) -> int:
+        """Returns the number of bytes stored in the file before the CHR data"""
+        return 0 if self.ines_data is None else len(self.ines_data)
+
+    def _file_layout_size(self) -> int:
+        """Returns the size of the file the tile data is saved in"""
+        return (self._header_size() + len(self.chr_data) +
+                (0 if self.trailing_data is None else len(self.trailing_data)))
+
+    def _can_patch(self, filename: str) -> bool:
+        """Returns True if filename still has the layout the tile data was loaded with"""
+        if self._file_path is None or not os.path.isfile(filename):
+            return False
+        if not os.path.exists(self._file_path):
+            return False
+        if not os.path.samefile(filename, self._file_path):
+            return False
+        expected_size = self._file_layout_size()
+        return self._file_size == expected_size == os.path.getsize(filename)
+
+    def _dirty_ranges(self) -> list[tuple[int, int]]:
+        """Returns the (start, stop) byte ranges of the CHR data that need saving"""
+        if self._dirty is None:
+            return [(0, len(self.chr_data))]
+        ranges = []
+        for idx in sorted(self._dirty):
+            start = idx * BYTES_PER_TILE
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], start + BYTES_PER_TILE)
+            else:
+                ranges.append((start, start + BYTES_PER_TILE))
+        return ranges
+
+    def snapshot(self, filename: str) -> TileSetSnapshot:
+        """Returns a copy of the data do_save would write to filename. Only the
+        changed tiles are copied when the rest of the file can be kept.
+        write_snapshot can then save it on another thread while the tiles keep
+        changing, the changes after the snapshot are kept for the next save.
+        """
+        patch = self._can_patch(filename)
+        if patch:
+            offset = self._header_size()
+            chunks = [ (offset + start, bytes(self._chr_view[start:stop]))
+                       for start, stop in self._dirty_ranges() ]
+        else:
+            chunks = [ (self._header_size(), bytes(self.chr_data)) ]
+            if self.file_format == 'ines':
+                chunks.insert(0, (0, bytes(self.ines_data)))
+            if self.trailing_data is not None:
+                chunks.append((self._header_size() + len(self.chr_data),
+                               bytes(self.trailing_data)))
+        # Changes from now on are tracked apart from the ones being saved
+        dirty, self._dirty = self._dirty, set()
+        return TileSetSnapshot(filename, chunks, patch, dirty,
+                               self._file_layout_size(), len(self))
+
+    @staticmethod
+    def write_snapshot(snapshot: TileSetSnapshot, progress: 'Callable' = None):
+        """Writes snapshot to its file, reporting progress(bytes done, bytes total)
+        after each chunk. The file is written to a temporary file renamed over
+        the old one, so it is left unchanged if writing fails or progress raises.
+        A patch copies the old file into the temporary file before writing the
+        changed tiles over it.
+        """
+        total = sum(len(data) for _, data in snapshot.chunks)
+        if snapshot.patch:
+            total += snapshot.file_size
+        done = 0
+        directory = os.path.dirname(os.path.abspath(snapshot.filename))
+        fd, tmp_name = tempfile.mkstemp(
+            prefix='.'+os.path.basename(snapshot.filename)+'.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                if snapshot.patch:
+                    with open(snapshot.filename, 'rb') as fin:
+                        while chunk := fin.read(FILE_CHUNK_SIZE):
+                            fout.write(chunk)
+                            done += len(chunk)
+                            if progress is not None:
+                                progress(done, total)
+                for offset, data in snapshot.chunks:
+                    fout.seek(offset)
+                    for start in range(0, len(data), FILE_CHUNK_SIZE):
+                        fout.write(data[start:start+FILE_CHUNK_SIZE])
+                        done += min(FILE_CHUNK_SIZE, len(data) - start)
+                        if progress is not None:
+                            progress(done, total)
+                fout.flush()
+                os.fsync(fout.fileno())
+            if os.path.exists(snapshot.filename):
+                shutil.copymode(snapshot.filename, tmp_name)
+            os.replace(tmp_name, snapshot.filename)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    def snapshot_saved(self, snapshot: TileSetSnapshot, saved: bool = True):
+        """Records the end of the save of snapshot
+        Args:
+            snapshot: the snapshot written by write_snapshot
+            saved: False if the writing failed, so its changes still need saving
+        """
+        if not saved:
+            if self._dirty is not None:
+                self._dirty = None if snapshot.dirty is None else self._dirty | snapshot.dirty
+            return
+        # Only changes made while saving are left
+        self._modified = self._dirty is None or bool(self._dirty)
+        self.filename = snapshot.filename
+        self._file_path = snapshot.filename
+        self._file_size = snapshot.file_size
+        if self.journal is not None:
+            if self._dirty is None:
+                records = [(RecoveryJournal.RESIZE, len(self).to_bytes(BYTES_PER_TILE, 'little'))]
+                records.extend((idx, bytes(self.tile_bytes(idx))) for idx in range(len(self)))
+            else:
+                records = [(idx, bytes(self.tile_bytes(idx))) for idx in sorted(self._dirty)]
+            self.journal.restart(snapshot.filename, snapshot.tile_count, records)
 
     def do_save(self, filename: str):
         """Saves the tile data to the file at filename"""
-        output_string = b"".join([tile.tobytes() for tile in self.tile_data ])
-        with open(filename, 'wb') as fout:
-            if self.file_format == 'raw':
-                fout.write(output_string)
-            elif self.file_format == 'ines':
-                fout.write(self.ines_data + output_string)
-            self.modified = False
-            self.filename = filename
+        snapshot = self.snapshot(filename)
+        try:
+            self.write_snapshot(snapshot)
+        except BaseException:
+            self.snapshot_saved(snapshot, saved=False)
+            raise
+        self.snapshot_saved(snapshot)
+
+    def _open_mmap(self, filename: str) -> bool:
+        """Maps the tile data of filename if its layout allows it
+        Returns:
+            True if the file was mapped, False if it has to be read instead
+        """
+        with open(filename, 'rb') as fin:
+            file_size = os.fstat(fin.fileno()).st_size
+            if file_size == 0:
+                return False
+            index = None
+            if filename.split('.')[-1] == 'nes' and file_size >= INES_HEADER_SIZE:
+                index = InesIndex.from_file(fin)
+                chr_start, chr_size = index.chr
+                # Only whole tiles are kept, the rest is saved with the trailing data
+                chr_stop = chr_start + chr_size - chr_size % BYTES_PER_TILE
+            elif file_size % CROM_INC == 0:
+                chr_start, chr_stop = 0, file_size
+            else:
+                return False
+            self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_COPY)
+        file_view = memoryview(self._mmap)
+        self.ines_index = index
+        self.file_format = 'raw' if index is None else 'ines'
+        self.ines_data = None if index is None else file_view[:chr_start]
+        self.trailing_data = file_view[chr_stop:] if chr_stop < file_size else None
+        self._set_chr_data(file_view[chr_start:chr_stop])
+        return True
 
-    def do_open(self, filename: str):
-        """Reads the tile data from the file at filename"""
+    def do_open(self, filename: str, use_mmap: bool = None, progress: 'Callable' = None):
+        """Reads the tile data from the file at filename
+        Args:
+            filename: the raw CHR or iNES file to read
+            use_mmap: map the file instead of reading it, defaults to the use_mmap
+                the TileSet was created with
+            progress: called with (bytes read, file size) as the file is read,
+                it can raise to stop reading
+        Raises:
+            OSError: the file cannot be read, the tile set is left as it was
+        """
+        if use_mmap is None:
+            use_mmap = self.use_mmap
+        # The file is read into another tile set, so that if it fails this one
+        # keeps its data
+        loaded = TileSet(0)
+        if not (use_mmap and loaded._open_mmap(filename)):
+            loaded._read_file(filename, progress)
+        file_size = os.path.getsize(filename)
+        self._close_mmap()
+        self._mmap = loaded._mmap
+        self.file_format, self.ines_index = loaded.file_format, loaded.ines_index
+        self.ines_data, self.trailing_data = loaded.ines_data, loaded.trailing_data
+        self._set_chr_data(loaded.chr_data)
         self.filename = filename
-        with open(self.filename, 'rb') as fin:
-            fdata = fin.read()
-
-        if self.filename.split('.')[-1] == 'nes' and len(fdata) >= INES_HEADER_SIZE:
+        self.modified = False
+        self._file_path = filename
+        self._file_size = file_size
+
+    def close(self):
+        """Releases the opened file, for a TileSet that is no longer used"""
+        self._close_mmap()
+
+    def _read_file(self, filename: str, progress: 'Callable' = None):
+        """Reads the tile data of filename into memory"""
+        with open(filename, 'rb') as fin:
+            file_size = os.fstat(fin.fileno()).st_size
+            fdata = bytearray()
+            while chunk := fin.read(FILE_CHUNK_SIZE):
+                fdata += chunk
+                if progress is not None:
+                    progress(len(fdata), file_size)
+
+        self.trailing_data = self.ines_index = None
+        if filename.split('.')[-1] == 'nes' and len(fdata) >= INES_HEADER_SIZE:
             self.file_format = 'ines'
-            proms = fdata[INES_HEADER_PROMS_IDX]
-            croms = fdata[INES_HEADER_CROMS_IDX]
-            prom_size = INES_HEADER_SIZE + PROM_INC * proms
-            self.chr_rom_size = CROM_INC * croms
-            self.ines_data = fdata[0: prom_size]
-            fdata = fdata[prom_size: prom_size + self.chr_rom_size]
+            self.ines_index = InesIndex.parse(fdata, len(fdata))
+            chr_start, chr_size = self.ines_index.chr
+            # Only whole tiles are kept, the rest is saved with the trailing data
+            chr_stop = chr_start + chr_size - chr_size % BYTES_PER_TILE
+            self.ines_data = bytes(fdata[0: chr_start])
+            if chr_stop < len(fdata):
+                self.trailing_data = bytes(fdata[chr_stop:])
+            chr_data = bytearray(memoryview(fdata)[chr_start: chr_stop])
         else:
             self.file_format = 'raw'
             self.ines_data = None
+            chr_data = fdata
             # if not iNES, make sure data length is a multiple of 8192
-            if len(fdata) % CROM_INC == 0:
-                self.chr_rom_size = len(fdata)
-            else:
-                fdata = fdata + (CROM_INC - (len(fdata) % CROM_INC)) * b'\0'
-                self.chr_rom_size = CROM_INC * (int(len(fdata) / CROM_INC) + 1)
+            if len(chr_data) % CROM_INC != 0:
+                chr_data.extend(bytes(CROM_INC - (len(chr_data) % CROM_INC)))
+        self._set_chr_data(chr_data)
+
+    def get_pixels(self, start: int = 0, stop: int = None):
+        """Returns the color values of the tiles from start up to stop,
+        decoded in one pass by chr_decode"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return chr_decode(self._chr_view[start*BYTES_PER_TILE:stop*BYTES_PER_TILE])
+
+    def set_pixels(self, pixels, start: int = 0):
+        """Replaces tiles starting at start with the color values in pixels,
+        encoded in one pass by chr_encode"""
+        self.set_chr(chr_encode(pixels), start)
+
+    def get_chr(self, start: int = 0, stop: int = None) -> bytes:
+        """Returns the raw NES graphics data of the tiles from start up to stop"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return bytes(self._chr_view[start*BYTES_PER_TILE:stop*BYTES_PER_TILE])
+
+    def set_chr(self, chr_data: bytes, start: int = 0):
+        """Replaces tiles starting at start with raw NES graphics data, in one
+        write to the tile data"""
+        first = start * BYTES_PER_TILE
+        if first + len(chr_data) > len(self.chr_data):
+            raise IndexError('tile index out of range')
+        self._chr_view[first:first+len(chr_data)] = chr_data
+        for idx in range(start, start + len(chr_data) // BYTES_PER_TILE):
+            self.mark_modified(idx)
+
+    def export_png(self, filename: str, colors=tileset_palette, span: int = TSET_SPAN):
+        """Saves the tiles as a PNG image, span tiles wide. The tiles are
+        decoded and compressed one row of tiles at a time.
+        Args:
+            colors: the 4 colors of the pixel values, '#RRGGBB' strings
+        """
+        def rows():
+            for first in range(0, len(self), span):
+                for row in tile_sheet_rows(self.get_pixels(first, first + span), span):
+                    yield bytes(row)
+        height = -(-len(self) // span) * TILESIZE
+        with open(filename, 'wb') as fout:
+            png_write(fout, span * TILESIZE, height, colors, rows())
+
+    def import_png(self, filename: str, start: int = 0, undo: 'TileUndoJournal' = None) -> int:
+        """Replaces tiles starting at start with those of an indexed color or
+        grayscale PNG image of at most 4 colors, mapped to colors 0-3 by
+        png_color_table. The image is read twice, once to find its colors and
+        once one row of tiles at a time. A raw tile set grows by whole 8 KB
+        banks to fit the image.
+        Args:
+            undo: a history to record the changed tiles in, as one step
+        Returns:
+            the number of tiles read
+        Raises:
+            ValueError: the image is not made of whole tiles of 4 colors, or
+                does not fit the iNES file
+        """
+        with open(filename, 'rb') as fin:
+            image = png_read(fin)
+            if image.width % TILESIZE or image.height % TILESIZE:
+                raise ValueError(f'The image size {image.width}x{image.height} '
+                                 'is not made of whole tiles')
+            values = set()
+            for row in image.rows:
+                values.update(row)
+                if len(values) > 4:
+                    break
+            table = png_color_table(image, values)
+            fin.seek(0)
+            rows = png_read(fin).rows
+            span = image.width // TILESIZE
+            count = span * (image.height // TILESIZE)
+            undo = self._make_room(start + count, undo)
+            for first in range(start, start + count, span):
+                strip = [ next(rows).translate(table) for _ in range(TILESIZE) ]
+                old = self.get_chr(first, first + span)
+                self.set_pixels(sheet_tiles(strip, span), first)
+                if undo is not None:
+                    for i in range(span):
+                        undo.record(first + i, old[i*BYTES_PER_TILE:(i+1)*BYTES_PER_TILE],
+                                    bytes(self.tile_bytes(first + i)), merge=True)
+        if undo is not None:
+            undo.end_merge()
+        return count
+
+    def import_compressed(self, filename: str, codec: str, offset: int = 0, start: int = 0,
+                          undo: 'TileUndoJournal' = None) -> int:
+        """Replaces tiles starting at start with tile data compressed by codec,
+        such as graphics stored in the PRG-ROM of a game. A raw tile set grows
+        by whole 8 KB banks to fit them. The file is read whole, as the codecs
+        decode from a buffer; a PRG-ROM is at most a few hundred KB.
+        Args:
+            codec: the name of the codec in CHR_CODECS
+            offset: the file offset the compressed data starts at
+            undo: a history to record the changed tiles in, as one step
+        Returns:
+            the number of tiles read, a partial last tile is padded with zeros
+        Raises:
+            ValueError: the data is not valid for the codec, or does not fit
+                the iNES file
+        """
+        with open(filename, 'rb') as fin:
+            data = fin.read()
+        chr_data, _ = CHR_CODECS[codec].decode(data, offset)
+        chr_data += bytes(-len(chr_data) % BYTES_PER_TILE)
+        count = len(chr_data) // BYTES_PER_TILE
+        undo = self._make_room(start + count, undo)
+        old = self.get_chr(start, start + count)
+        self.set_chr(chr_data, start)
+        if undo is not None:
+            for i in range(count):
+                tile = slice(i * BYTES_PER_TILE, (i + 1) * BYTES_PER_TILE)
+                undo.record(start + i, old[tile], chr_data[tile], merge=True)
+            undo.end_merge()
+        return count
+
+    def export_compressed(self, filename: str, codec: str, start: int = 0,
+                          stop: int = None) -> int:
+        """Saves the tiles from start up to stop compressed by codec
+        Returns:
+            the size of the compressed data
+        """
+        data = CHR_CODECS[codec].encode(self.get_chr(start, stop))
+        with open(filename, 'wb') as fout:
+            fout.write(data)
+        return len(data)
 
-        if len(fdata) < self.chr_rom_size:
-            self.chr_rom_size = len(fdata)
-        self.tile_data = [Tile().frombytes( fdata[i*BYTES_PER_TILE:(i+1)*BYTES_PER_TILE] )
-                          for i in range(0, len(fdata)//BYTES_PER_TILE) ]
-        self.modified = False
+    def _make_room(self, stop: int, undo: 'TileUndoJournal' = None) -> 'TileUndoJournal':
+        """Grows a raw tile set by whole 8 KB banks to hold stop tiles
+        Returns:
+            undo, or None if the resize cleared it
+        Raises:
+            ValueError: an iNES tile set would have to grow
+        """
+        if stop <= len(self):
+            return undo
+        if self.file_format == 'ines':
+            raise ValueError('The tiles do not fit the CHR-ROM')
+        self.resize(-(-stop // TILES_PER_BANK) * TILES_PER_BANK)
+        if undo is not None:
+            # The resize can't be undone tile by tile
+            undo.clear()
+        return None
+
+    def transform(self, transform: 'Callable', start: int = 0, stop: int = None):
+        """Applies a chr_* transform, such as chr_hflip, to the tiles from
+        start up to stop in one pass over their raw data"""
+        self.set_chr(transform(self.get_chr(start, stop)), start)
+
+    def set_file_format(self, file_format: str, ines_data: bytes = None,
+                        trailing_data: bytes = None):
+        """Changes the format the tile data is saved in
+        Args:
+            file_format: 'raw' or 'ines'
+            ines_data: the iNES header, trainer and PRG data to save in front of
+                the tile data, with the header CHR size updated to match it
+            trailing_data: data to save after the tile data in the iNES format
+        """
+        if file_format == 'ines':
+            if ines_data is None or len(ines_data) < INES_HEADER_SIZE:
+                raise ValueError('iNES format needs the iNES header and PRG data')
+            if len(self.chr_data) % CROM_INC != 0 or len(self.chr_data) // CROM_INC > 255:
+                raise ValueError(f'CHR size {len(self.chr_data)} does not fit an iNES header')
+            ines_data = bytearray(ines_data)
+            ines_data[INES_HEADER_CROMS_IDX] = len(self.chr_data) // CROM_INC
+            if InesIndex.parse(ines_data, len(ines_data)).nes2:
+                # The CHR size fits the low byte, drop the NES 2.0 high bits
+                ines_data[INES_HEADER_ROM_MSB_IDX] &= 0x0F
+            self.ines_data = bytes(ines_data)
+            self.trailing_data = None if trailing_data is None else bytes(trailing_data)
+        elif file_format == 'raw':
+            self.ines_data = self.trailing_data = None
+        else:
+            raise ValueError(f'Unknown file format {file_format}')
+        self.file_format = file_format
+        # The file layout changed, everything has to be written
+        self.ines_index = None
+        self._file_path = None
 
     def update_tile_pixel(self, idx, x, y, color):
         """Updates tile at idx to set color of pixel at (x,y)"""
-        self.modified = True
-        self.tile_data[idx].set(x,y,color)
+        self[idx].set(x,y,color)
 
     def resize(self, new_size):
         """Resize the number of tile data elements"""
-        if len(self.tile_data)>new_size:
-            self.tile_data = self.tile_data[:new_size]
-        else:
-            for _ in range(len(self.tile_data),new_size):
-                self.tile_data.append(Tile())
+        chr_data = bytearray(new_size * BYTES_PER_TILE)
+        keep = min(len(chr_data), len(self.chr_data))
+        chr_data[:keep] = self._chr_view[:keep]
+        self._set_chr_data(chr_data)
+        self.modified = True
+        if self.journal is not None:
+            self.journal.record_resize(new_size)
 
     def __getitem__(self, key):
-        return self.tile_data[key]
+        if isinstance(key, slice):
+            # Like the list of tiles this used to be, a slice is a list of tiles
+            return [self[i] for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('tile index out of range')
+        start = key * BYTES_PER_TILE
+        tile = TileSetTile.view(self._chr_view[start:start+BYTES_PER_TILE])
+        tile._tile_set = self
+        tile._idx = key
+        return tile
 
     def __iter__(self):
-        return iter(self.tile_data)
+        return (self[i] for i in range(len(self)))
 
     def __len__(self):
-        return len(self.tile_data)
+        return len(self.chr_data) // BYTES_PER_TILE
 
     def __repr__(self):
         line = "\n---------------------------------------------------------"
-        return f"{type(self).__name__}\n"+"\n".join( repr(tile)+line for tile in self.tile_data)
+        return f"{type(self).__name__}\n"+"\n".join( repr(tile)+line for tile in self)
+
+
+def nametable_encode(tiles, slots) -> bytes:
+    """Packs screens into NES nametables with their attribute tables.
+    Args:
+        tiles: the tile numbers(0-255) of each screen as 30 rows of 32, an
+            array or nested sequence of shape (screens, 30, 32)
+        slots: the palette slot(0-3) of each 16x16 pixel quad of each screen as
+            15 rows of 16, of shape (screens, 15, 16)
+    Returns:
+        1024 bytes per screen
+    """
+    if np is not None:
+        tiles = np.asarray(tiles, dtype=np.uint8).reshape(-1, TLAYOUT_YSPAN, TLAYOUT_XSPAN)
+        slots = np.asarray(slots, dtype=np.uint8).reshape(-1, QUAD_YSPAN, QUAD_XSPAN) & 3
+        # the last attribute row only covers the top half of its area
+        slots = np.pad(slots, ((0, 0), (0, 1), (0, 0)))
+        quads = slots.reshape(-1, ATTRIBUTE_SPAN, 2, ATTRIBUTE_SPAN, 2)
+        attributes = (quads[:, :, 0, :, 0] | (quads[:, :, 0, :, 1] << 2) |
+                      (quads[:, :, 1, :, 0] << 4) | (quads[:, :, 1, :, 1] << 6))
+        return np.concatenate((tiles.reshape(len(tiles), -1),
+                               attributes.reshape(len(tiles), -1)), axis=1).tobytes()
+    data = bytearray()
+    for screen_tiles, screen_slots in zip(tiles, slots):
+        for row in screen_tiles:
+            data.extend(row)
+        attributes = bytearray(NAMETABLE_SIZE - ATTRIBUTE_TABLE_IDX)
+        for quad_y, row in enumerate(screen_slots):
+            for quad_x, slot in enumerate(row):
+                attributes[(quad_y//2)*ATTRIBUTE_SPAN + quad_x//2] |= \
+                    (slot & 3) << (((quad_y & 1) << 2) | ((quad_x & 1) << 1))
+        data.extend(attributes)
+    return bytes(data)
+
+def nametable_decode(data: bytes):
+    """Unpacks NES nametables with their attribute tables, the reverse of nametable_encode
+    Args:
+        data: 1024 bytes per screen
+    Returns:
+        (tiles, slots) of shape (screens, 30, 32) and (screens, 15, 16), as arrays
+        when NumPy is installed and nested lists otherwise
+    """
+    if len(data) % NAMETABLE_SIZE != 0:
+        raise ValueError(f'Nametable data is {len(data)} bytes, not a multiple of 1024')
+    if np is not None:
+        screens = np.frombuffer(data, dtype=np.uint8).reshape(-1, NAMETABLE_SIZE)
+        tiles = screens[:, :ATTRIBUTE_TABLE_IDX].reshape(-1, TLAYOUT_YSPAN, TLAYOUT_XSPAN)
+        attributes = screens[:, ATTRIBUTE_TABLE_IDX:].reshape(-1, ATTRIBUTE_SPAN, 1,
+                                                               ATTRIBUTE_SPAN, 1)
+        shifts = np.array([[0, 2], [4, 6]], dtype=np.uint8).reshape(1, 1, 2, 1, 2)
+        slots = ((attributes >> shifts) & 3).reshape(-1, 2*ATTRIBUTE_SPAN, 2*ATTRIBUTE_SPAN)
+        return tiles, slots[:, :QUAD_YSPAN]
+    tiles = []
+    slots = []
+    for base in range(0, len(data), NAMETABLE_SIZE):
+        tiles.append([ list(data[base+y*TLAYOUT_XSPAN:base+(y+1)*TLAYOUT_XSPAN])
+                       for y in range(TLAYOUT_YSPAN) ])
+        attributes = data[base+ATTRIBUTE_TABLE_IDX:base+NAMETABLE_SIZE]
+        slots.append([ [ (attributes[(quad_y//2)*ATTRIBUTE_SPAN + quad_x//2] >>
+                          (((quad_y & 1) << 2) | ((quad_x & 1) << 1))) & 3
+                         for quad_x in range(QUAD_XSPAN) ]
+                       for quad_y in range(QUAD_YSPAN) ])
+    return tiles, slots
+
+
+class TileUndoJournal:
+    """Undo and redo history of tile changes.
+    Each step is a list of (tile index, old 16 bytes, new 16 bytes) deltas. The
+    oldest steps are dropped when the deltas use more than max_bytes.
+    """
+    # Approximate memory used by one delta
+    DELTA_SIZE = 2 * BYTES_PER_TILE + 16
+
+    def __init__(self, max_bytes: int = UNDO_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._undo = deque()
+        self._redo = []
+        self._size = 0
+        # Tile index to [old, new] of the step still taking merged changes
+        self._merging = None
+
+    def record(self, idx: int, old: bytes, new: bytes, merge: bool = False):
+        """Records that tile idx changed from old to new
+        Args:
+            merge: add the change to the step started by the previous merged
+                change, until end_merge is called
+        """
+        self._redo.clear()
+        if merge and self._merging is not None:
+            if idx in self._merging:
+                self._merging[idx][1] = new
+                return
+            self._merging[idx] = [old, new]
+            self._undo[-1].append(idx)
+            self._size += self.DELTA_SIZE
+        else:
+            self.end_merge()
+            if old == new:
+                return
+            self._undo.append([idx])
+            self._merging = {idx: [old, new]}
+            self._size += self.DELTA_SIZE
+            if not merge:
+                self.end_merge()
+        self._evict()
+
+    def end_merge(self):
+        """Closes the step taking merged changes"""
+        if self._merging is None:
+            return
+        idxs = self._undo.pop()
+        step = [(idx, *self._merging[idx]) for idx in idxs
+                if self._merging[idx][0] != self._merging[idx][1]]
+        self._size -= (len(idxs) - len(step)) * self.DELTA_SIZE
+        if step:
+            self._undo.append(step)
+        self._merging = None
+
+    def _evict(self):
+        """Drops the oldest steps until the history fits in max_bytes"""
+        while self._size > self.max_bytes and len(self._undo) > 1:
+            self._size -= len(self._undo.popleft()) * self.DELTA_SIZE
+
+    def undo(self) -> list[tuple[int, bytes]]:
+        """Returns the (tile index, 16 bytes) to write to undo the last step,
+        or None if there is nothing to undo"""
+        self.end_merge()
+        if not self._undo:
+            return None
+        step = self._undo.pop()
+        self._size -= len(step) * self.DELTA_SIZE
+        self._redo.append(step)
+        return [(idx, old) for idx, old, _ in reversed(step)]
+
+    def redo(self) -> list[tuple[int, bytes]]:
+        """Returns the (tile index, 16 bytes) to write to redo the last undone
+        step, or None if there is nothing to redo"""
+        self.end_merge()
+        if not self._redo:
+            return None
+        step = self._redo.pop()
+        self._undo.append(step)
+        self._size += len(step) * self.DELTA_SIZE
+        self._evict()
+        return [(idx, new) for idx, _, new in step]
+
+    def clear(self):
+        """Forgets all the history"""
+        self._undo.clear()
+        self._redo.clear()
+        self._size = 0
+        self._merging = None
+
+
+class RecoveryJournal:
+    """Append-only journal of the tile changes not saved yet, kept next to the
+    file being edited so they can be replayed after a crash.
+
+    The file holds a header with the number of tiles and the modification time
+    of the file it belongs to, then one record per change: the tile index and
+    the 16 new bytes of the tile, or RESIZE and the new number of tiles.
+    record only queues the change, a worker thread appends the queued changes
+    and syncs them to disk once per JOURNAL_SYNC_MS. If writing fails, error
+    holds the OSError and the journal stops.
+    Args:
+        filename: the tile set file the changes belong to
+        tile_count: the number of tiles in that file
+        append: keep the records already in the journal, after a replay
+    """
+    HEADER = struct.Struct('<8sIq')
+    MAGIC = b'NESTILEJ'
+    RECORD = struct.Struct(f'<I{BYTES_PER_TILE}s')
+    RESIZE = 0xFFFFFFFF
+
+    def __init__(self, filename: str, tile_count: int, append: bool = False):
+        self.error = None
+        self._queue = queue.Queue()
+        self._queue.put(('open', filename, tile_count, append, []))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def path(filename: str) -> str:
+        """Returns the name of the journal of filename"""
+        return filename + JOURNAL_SUFFIX
+
+    def record(self, idx: int, data: bytes):
+        """Journals that tile idx now holds the 16 bytes data"""
+        self._queue.put(('tile', idx, bytes(data)))
+
+    def record_resize(self, tile_count: int):
+        """Journals that the tile set now holds tile_count tiles"""
+        self._queue.put(('tile', self.RESIZE, tile_count.to_bytes(BYTES_PER_TILE, 'little')))
+
+    def restart(self, filename: str, tile_count: int, records: list[tuple[int, bytes]]):
+        """Starts the journal over once the tile set has been saved to filename
+        Args:
+            tile_count: the number of tiles saved to filename
+            records: the (tile index, 16 bytes) of the changes the save missed
+        """
+        self._queue.put(('open', filename, tile_count, False, records))
+
+    def sync(self):
+        """Waits for the changes recorded so far to be written to disk"""
+        done = threading.Event()
+        self._queue.put(('sync', done))
+        done.wait()
+
+    def close(self):
+        """Stops journaling and deletes the journal, once the changes have been
+        saved or dropped"""
+        self._queue.put(('close',))
+        self._thread.join()
+
+    def _run(self):
+        journal = path = None
+        while True:
+            # Changes coming in until the next sync are written together
+            commands = [self._queue.get()]
+            deadline = time.monotonic() + JOURNAL_SYNC_MS / 1000
+            while commands[-1][0] == 'tile':
+                try:
+                    commands.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            records = bytearray()
+            try:
+                for command in commands:
+                    if command[0] == 'tile':
+                        records += self.RECORD.pack(command[1], command[2])
+                        continue
+                    if journal is not None:
+                        journal.write(records)
+                        records.clear()
+                    if command[0] == 'open':
+                        _, filename, tile_count, append, restart_records = command
+                        if journal is not None:
+                            journal.close()
+                            if path != self.path(filename):
+                                os.remove(path)
+                        path = self.path(filename)
+                        if append:
+                            journal = open(path, 'ab')
+                        else:
+                            journal = open(path, 'wb')
+                            journal.write(self.HEADER.pack(
+                                self.MAGIC, tile_count, os.stat(filename).st_mtime_ns))
+                        for idx, data in restart_records:
+                            records += self.RECORD.pack(idx, data)
+                    elif command[0] == 'close':
+                        if journal is not None:
+                            journal.close()
+                            os.remove(path)
+                        return
+                if journal is not None:
+                    journal.write(records)
+                    journal.flush()
+                    os.fsync(journal.fileno())
+            except OSError as err:
+                # Editing goes on without a journal
+                self.error = err
+                journal = None
+            finally:
+                for command in commands:
+                    if command[0] == 'sync':
+                        command[1].set()
+
+    @classmethod
+    def read(cls, filename: str) -> list[tuple[int, bytes]]:
+        """Returns the (tile index or RESIZE, 16 bytes) records of the journal of
+        filename, or None if there is no journal or it belongs to another
+        version of the file
+        """
+        try:
+            with open(cls.path(filename), 'rb') as journal:
+                data = journal.read()
+            mtime = os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+        if len(data) < cls.HEADER.size:
+            return None
+        magic, tile_count, journal_mtime = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or journal_mtime != mtime:
+            return None
+        # A record cut short by a crash is dropped
+        end = len(data) - (len(data) - cls.HEADER.size) % cls.RECORD.size
+        records = [(cls.RESIZE, tile_count.to_bytes(BYTES_PER_TILE, 'little'))]
+        records.extend(cls.RECORD.iter_unpack(data[cls.HEADER.size:end]))
+        return records
+
+    @classmethod
+    def replay(cls, tile_set: 'TileSet', records: list[tuple[int, bytes]]):
+        """Applies the records returned by read to tile_set"""
+        for idx, data in records:
+            if idx == cls.RESIZE:
+                tile_count = int.from_bytes(data, 'little')
+                if tile_count != len(tile_set):
+                    tile_set.resize(tile_count)
+            elif idx < len(tile_set):
+                tile_set[idx].frombytes(data)
 
 
 class TileLayerEntry(namedtuple('TileLayerEntry', ['tile', 'palette'])):
@@ -808,50 +2771,380 @@ class TilePixelUpdate(namedtuple('TilePixelUpdate', ['x', 'y', 'color'])):
     __slots__ = ()
 
 class TileLayerData:
-    """Class holding the Tile Layout data in the Tile Layer window"""
+    """Class holding the Tile Layout data in the Tile Layer window
+
+    In 'tile' palette mode each laid tile keeps the palette it was laid with.
+    In 'ppu' palette mode tiles take their palette from one of 4 shared
+    background palettes, chosen for each 16x16 quad by its attribute, as on
+    the NES.
+    """
     def __init__(self):
         self.modified = False # for pylint initialization detection
         self.filename = None  # for pylint initialization detection
+        self.palette_mode = 'tile'
+        self.bg_palettes = None
+        self._tile_at_xy = self._tile_positions = self._quad_slot = None
         self.reset()
 
     def reset(self):
-        """Reinitialize class variables"""
+        """Reinitialize class variables, except the palette mode"""
         self.filename = ''
         self.modified = False
         # Holds information for drawing tiles on the tile layer
         # Initialize tile map
         self._tile_at_xy = [ TLAYOUT_YSPAN * [None] for _ in range(TLAYOUT_XSPAN) ]
+        # Reverse index of the tile map, tile number to {(x, y): palette}
+        self._tile_positions = {}
+        # The 4 background palettes and the slot each quad uses, for ppu mode
+        self.bg_palettes = [ tuple(default_palette) for _ in range(PALETTE_SLOTS) ]
+        self._quad_slot = [ [0] * QUAD_XSPAN for _ in range(QUAD_YSPAN) ]
+
+    def _quad_palette(self, col: int, row: int) -> tuple:
+        """Returns the background palette used at col, row in ppu mode"""
+        return self.bg_palettes[self._quad_slot[row//QUAD_SIZE][col//QUAD_SIZE]]
 
     def tile_layout(self, tile_num: int) -> list('TileLayout'):
         """ Returns a list of tuples containing the x,y positions and
         palettes for a specific tile"""
-        return [TileLayout(x, y, data.palette)
-                for x, col in enumerate(self._tile_at_xy)
-                for y, data in enumerate(col)
-                if data is not None and tile_num==data.tile ]
+        positions = self._tile_positions.get(tile_num)
+        if not positions:
+            return []
+        if self.palette_mode == 'ppu':
+            return [TileLayout(x, y, self._quad_palette(x, y)) for x, y in positions]
+        return [TileLayout(x, y, palette) for (x, y), palette in positions.items()]
 
     def lay_tile(self, col: int, row: int, tile_num: int, pal: list[int]):
         '''places tile_num with pal and postion (col, row)'''
         self.modified = True
-        self._tile_at_xy[col][row] = TileLayerEntry(tile_num, tuple(pal))
+        old = self._tile_at_xy[col][row]
+        if old is not None:
+            positions = self._tile_positions[old.tile]
+            del positions[(col, row)]
+            if not positions:
+                del self._tile_positions[old.tile]
+        entry = TileLayerEntry(tile_num, tuple(pal))
+        self._tile_at_xy[col][row] = entry
+        self._tile_positions.setdefault(tile_num, {})[(col, row)] = entry.palette
 
     def tile_at_xy(self, col: int, row: int) -> 'TileLayerEntry':
         '''Returns the tuple of tile number and palette for the tile at positon col,row'''
         tle = self._tile_at_xy[col][row]
+        if tle is not None and self.palette_mode == 'ppu':
+            return TileLayerEntry(tle.tile, self._quad_palette(col, row))
         return tle
 
+    def _laid_cells(self, quads) -> list[tuple[int, int]]:
+        """Returns the (x, y) positions holding a tile in the (quad x, quad y) quads"""
+        return [ (col, row) for quad_x, quad_y in quads
+                 for col in range(quad_x*QUAD_SIZE, (quad_x+1)*QUAD_SIZE)
+                 for row in range(quad_y*QUAD_SIZE, (quad_y+1)*QUAD_SIZE)
+                 if self._tile_at_xy[col][row] is not None ]
+
+    def set_quad_slot(self, col: int, row: int, slot: int) -> list[tuple[int, int]]:
+        '''Sets the background palette slot(0-3) of the 16x16 quad holding col, row
+        Returns:
+            the (x, y) positions whose colors changed in ppu mode
+        '''
+        quad_x, quad_y = col // QUAD_SIZE, row // QUAD_SIZE
+        if self._quad_slot[quad_y][quad_x] == slot:
+            return []
+        self.modified = True
+        self._quad_slot[quad_y][quad_x] = slot
+        if self.palette_mode != 'ppu':
+            return []
+        return self._laid_cells([(quad_x, quad_y)])
+
+    def set_bg_color(self, slot: int, color_idx: int, nes_color: int) -> list[tuple[int, int]]:
+        '''Changes color color_idx(0-3) of background palette slot(0-3) to nes_color(0-63)
+        Returns:
+            the (x, y) positions whose colors changed in ppu mode
+        '''
+        palette = list(self.bg_palettes[slot])
+        if palette[color_idx] == nes_color:
+            return []
+        palette[color_idx] = nes_color
+        self.bg_palettes[slot] = tuple(palette)
+        self.modified = True
+        if self.palette_mode != 'ppu':
+            return []
+        return self._laid_cells([ (quad_x, quad_y)
+                                  for quad_y, row in enumerate(self._quad_slot)
+                                  for quad_x, quad_slot in enumerate(row)
+                                  if quad_slot == slot ])
+
+    def _majority_palettes(self) -> tuple[list[tuple], list[list[int]]]:
+        '''Returns the distinct palettes of the laid tiles, in order of first use,
+        and the index in them of the palette most tiles of each quad use'''
+        palettes = []
+        slots = [ [0] * QUAD_XSPAN for _ in range(QUAD_YSPAN) ]
+        for quad_y in range(QUAD_YSPAN):
+            for quad_x in range(QUAD_XSPAN):
+                counts = {}
+                for col, row in self._laid_cells([(quad_x, quad_y)]):
+                    palette = self._tile_at_xy[col][row].palette
+                    counts[palette] = counts.get(palette, 0) + 1
+                if not counts:
+                    continue
+                palette = max(counts, key=counts.get)
+                if palette not in palettes:
+                    palettes.append(palette)
+                slots[quad_y][quad_x] = palettes.index(palette)
+        return palettes, slots
+
+    def set_palette_mode(self, mode: str):
+        '''Switches between 'tile' and 'ppu' palette modes.
+        Going to ppu mode, quads take the palette most of their tiles use, the
+        first 4 distinct palettes becoming the background palettes. Going to
+        tile mode, tiles keep the colors they were shown with.
+        '''
+        if mode not in ('tile', 'ppu'):
+            raise ValueError(f'Unknown palette mode {mode}')
+        if mode == self.palette_mode:
+            return
+        if mode == 'ppu':
+            palettes, slots = self._majority_palettes()
+            if palettes:
+                for slot, palette in enumerate(palettes[:PALETTE_SLOTS]):
+                    self.bg_palettes[slot] = palette
+                self._quad_slot = [ [ slot if slot < PALETTE_SLOTS else 0 for slot in row ]
+                                    for row in slots ]
+        else:
+            for col in range(TLAYOUT_XSPAN):
+                for row in range(TLAYOUT_YSPAN):
+                    tle = self.tile_at_xy(col, row)
+                    if tle is not None:
+                        self.lay_tile(col, row, tle.tile, tle.palette)
+        self.palette_mode = mode
+
+    def to_nametable(self) -> tuple[bytes, bytes]:
+        '''Returns the layer as NES data: the 1024 byte nametable with its
+        attribute table, and the 16 byte palette RAM image of its palettes.
+        Tile numbers are stored modulo 256, empty places as tile 0. In tile
+        palette mode each 16x16 quad gets the palette used by most of its tiles.
+        Raises:
+            ValueError: the layer uses more than 4 palettes in tile palette mode
+        '''
+        if self.palette_mode == 'ppu':
+            palettes, slots = list(self.bg_palettes), self._quad_slot
+        else:
+            palettes, slots = self._majority_palettes()
+        if len(palettes) > PALETTE_SLOTS:
+            raise ValueError(f'The tile layer uses {len(palettes)} palettes, '
+                             f'a nametable can only use {PALETTE_SLOTS}')
+        tiles = [ [ 0 if self._tile_at_xy[col][row] is None else
+                    self._tile_at_xy[col][row].tile & 0xFF
+                    for col in range(TLAYOUT_XSPAN) ]
+                  for row in range(TLAYOUT_YSPAN) ]
+        palettes += [default_palette] * (PALETTE_SLOTS - len(palettes))
+        return nametable_encode([tiles], [slots]), bytes(c for pal in palettes for c in pal)
+
+    def from_nametable(self, data: bytes, palette_data: bytes, tile_base: int = 0):
+        '''Replaces the layer with NES data, the reverse of to_nametable
+        Args:
+            data: the 1024 byte nametable with its attribute table
+            palette_data: the 16 byte palette RAM image
+            tile_base: the number of the first tile the nametable refers to
+        '''
+        if len(data) != NAMETABLE_SIZE or len(palette_data) != PALETTE_RAM_SIZE:
+            raise ValueError('A nametable is 1024 bytes and its palettes 16 bytes')
+        tiles, slots = nametable_decode(data)
+        tiles, slots = tiles[0], slots[0]
+        filename = self.filename
+        self.reset()
+        self.filename = filename
+        self.bg_palettes = [ tuple(palette_data[i:i+4]) for i in range(0, PALETTE_RAM_SIZE, 4) ]
+        self._quad_slot = [ [ int(slot) for slot in row ] for row in slots ]
+        for row in range(TLAYOUT_YSPAN):
+            for col in range(TLAYOUT_XSPAN):
+                self.lay_tile(col, row, tile_base + int(tiles[row][col]),
+                              self.bg_palettes[self._quad_slot[row//QUAD_SIZE][col//QUAD_SIZE]])
+        self.modified = False
+
+    @staticmethod
+    def palette_filename(filename: str) -> str:
+        '''Returns the name of the palette file saved along the nametable filename'''
+        return os.path.splitext(filename)[0] + '.pal'
+
+    def do_save(self, filename: str):
+        '''Saves the layer as a nametable at filename, and its palettes next to it'''
+        data, palette_data = self.to_nametable()
+        with open(filename, 'wb') as fout:
+            fout.write(data)
+        with open(self.palette_filename(filename), 'wb') as fout:
+            fout.write(palette_data)
+        self.filename = filename
+        self.modified = False
+
+    def export_png(self, filename: str, tile_set: 'TileSet'):
+        '''Saves the layer as a PNG image in the NES colors of its tiles, one
+        row of tiles at a time. Empty places take the tile set background color.'''
+        empty = len(nes_palette)
+        colors = list(nes_palette) + [tileset_palette[0]]
+        def rows():
+            for y in range(TLAYOUT_YSPAN):
+                entries = [ self.tile_at_xy(x, y) for x in range(TLAYOUT_XSPAN) ]
+                pixels = chr_decode(b''.join(bytes(BYTES_PER_TILE) if tle is None else
+                                             tile_set.tile_bytes(tle.tile) for tle in entries))
+                palettes = [ (empty,) * 4 if tle is None else tle.palette for tle in entries ]
+                if np is not None:
+                    pixels = np.array(palettes, dtype=np.uint8)[
+                        np.arange(TLAYOUT_XSPAN)[:, None, None], pixels]
+                else:
+                    pixels = [ [ [ palette[value] for value in row ] for row in tile ]
+                               for tile, palette in zip(pixels, palettes) ]
+                for row in tile_sheet_rows(pixels, TLAYOUT_XSPAN):
+                    yield bytes(row)
+        with open(filename, 'wb') as fout:
+            png_write(fout, TLAYOUT_XSPAN * TILESIZE, TLAYOUT_YSPAN * TILESIZE, colors, rows())
+
+    def do_open(self, filename: str, tile_base: int = 0):
+        '''Loads the layer from the nametable at filename, and the palettes next to it'''
+        with open(filename, 'rb') as fin:
+            data = fin.read()
+        try:
+            with open(self.palette_filename(filename), 'rb') as fin:
+                palette_data = fin.read()
+        except FileNotFoundError:
+            palette_data = bytes(default_palette) * PALETTE_SLOTS
+        self.from_nametable(data, palette_data, tile_base)
+        self.filename = filename
+
+
+class Profiler:
+    """Counts and times the calls to the model and rendering methods of the editor
+
+    The methods are only wrapped while the profiler is installed, so the editor
+    runs unchanged without it.
+    Args:
+        output: file written by dump, a cProfile dump if it ends in .prof and a
+            JSON trace otherwise. With None a summary is printed instead.
+    """
+    # Class: methods to count and time
+    METHODS = {
+        NesTileEditTk: ('tileset_redraw_all', '_tileset_update_viewport', '_tileset_render_row',
+                          'edit_redraw_all', 'colors_redraw_all', 'tlayout_redraw_all',
+                          'tlayout_update_cells', 'update_tile', 'update_tiles',
+                          'update_tile_pixels', 'lay_tile'),
+        TileSet: ('do_open', 'do_save', 'update_tile_pixel', 'resize'),
+        TileLayerData: ('do_open', 'do_save', 'lay_tile', 'tile_layout'),
+    }
+
+    def __init__(self, output: str = None):
+        self.output = output
+        # name: [call count, total seconds, longest call seconds]
+        self.counters = {}
+        # The last calls as (name, start seconds, seconds)
+        self.trace = deque(maxlen=PROFILE_TRACE_SIZE)
+        self.canvas_items = {}
+        self._start = time.perf_counter()
+        self._installed = []
+        self._cprofile = None
+
+    @classmethod
+    def from_setting(cls, setting: str) -> 'Profiler':
+        """Returns the profiler asked for by the --profile or environment setting,
+        '1' for the status line only or the name of the file to dump, None if unset"""
+        if not setting:
+            return None
+        return cls(None if setting == '1' else setting)
+
+    def install(self):
+        """Starts counting the calls"""
+        for cls, names in self.METHODS.items():
+            for name in names:
+                method = cls.__dict__[name]
+                self._installed.append((cls, name, method))
+                setattr(cls, name, self._wrap(f'{cls.__name__}.{name}', method))
+        if self.output is not None and self.output.endswith('.prof'):
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def uninstall(self):
+        """Stops counting the calls, restoring the methods"""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        for cls, name, method in reversed(self._installed):
+            setattr(cls, name, method)
+        self._installed = []
+
+    def _wrap(self, name: str, method: 'Callable') -> 'Callable':
+        counter = self.counters.setdefault(name, [0, 0.0, 0.0])
+        trace = self.trace
+        origin = self._start
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                counter[0] += 1
+                counter[1] += elapsed
+                counter[2] = max(counter[2], elapsed)
+                trace.append((name, start - origin, elapsed))
+        return timed
+
+    def summary(self, limit: int = 4) -> str:
+        """Returns the methods that took the most time and the canvas item counts"""
+        busiest = sorted(((total, name, count) for name, (count, total, _)
+                          in self.counters.items() if count), reverse=True)[:limit]
+        lines = [ f"{name} {count}x {total*1000:.1f}ms" for total, name, count in busiest ]
+        if self.canvas_items:
+            lines.append("canvas items " + " ".join(
+                f"{name}:{count}" for name, count in self.canvas_items.items()))
+        return "\n".join(lines)
+
+    def to_json(self) -> dict:
+        """Returns the counters and the trace of the last calls"""
+        return {
+            'seconds': time.perf_counter() - self._start,
+            'counters': { name: {'count': count, 'seconds': total, 'max_seconds': longest}
+                          for name, (count, total, longest) in self.counters.items() },
+            'canvas_items': self.canvas_items,
+            'trace': [ {'name': name, 'start': start, 'seconds': elapsed}
+                       for name, start, elapsed in self.trace ],
+        }
+
+    def dump(self):
+        """Writes the results to the output file, or prints them"""
+        if self.output is None:
+            print(self.summary(limit=len(self.counters)), file=sys.stderr)
+        elif self._cprofile is not None:
+            self._cprofile.dump_stats(self.output)
+        else:
+            with open(self.output, 'w', encoding='utf-8') as output_file:
+                json.dump(self.to_json(), output_file, indent=1)
+
 
 class NesTileEdit:
     """Class for the NES Tile Editor program"""
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, profiler: Profiler = None):
+        # Counts from the first redraw
+        self._profiler = profiler
+        if profiler is not None:
+            profiler.install()
         # Initialize class variables
-        self._tile_set = TileSet(CROM_INC, filename)
+        self._tile_set = TileSet(CROM_INC, filename, use_mmap=True)
         self._tlayer = TileLayerData()
         self._ui = NesTileEditTk(self)
         self.current_pal = list(default_palette)
         # Index into self.current_pal, not nes_palette
         self.current_col = 1
+        # The background palette used in the Tile Layer ppu palette mode
+        self.current_slot = 0
         self.current_tile_num = 0
+        # The other end of the tiles selected with shift click, None when only
+        # the current tile is selected
+        self._selection_anchor = None
+        # Pixels drawn but not rendered yet, tile number: {(x, y): color}
+        self._pending_pixels = {}
+        self._undo = TileUndoJournal()
+        # File access running in the background, and whether edits wait for it
+        self._task = self._task_on_end = None
+        self._task_blocks_edits = False
+        # Whether _poll_journal is watching the journal for write errors
+        self._journal_polled = False
+        self._start_journal()
 
         # Widget display
         self._ui.tileset_redraw_all(self._tile_set, self.current_tile_num)
@@ -860,6 +3153,111 @@ class NesTileEdit:
                                 self.current_pal)
         self._ui.colors_redraw_all(self.current_pal, self.current_col)
         self._ui.tlayout_redraw_all(self._tile_set, self._tlayer)
+        if profiler is not None:
+            self._update_profile_status()
+
+    def _update_profile_status(self):
+        '''Shows the profiler numbers in the status line, twice a second'''
+        self._profiler.canvas_items = self._ui.canvas_item_counts()
+        self._ui.show_status(self._profiler.summary())
+        self._ui.after_frame(self._update_profile_status, PROFILE_STATUS_MS)
+
+    def _run_task(self, work: 'Callable', description: str, on_end: 'Callable',
+                  blocks_edits: bool = False):
+        '''Runs work on a worker thread, showing its progress until it ends
+        Args:
+            work: function doing the work, see BackgroundTask
+            description: what the work does, shown with its progress
+            on_end: called on the UI thread with ('done', result),
+                ('error', exception) or ('cancelled', None)
+            blocks_edits: True to ignore tile edits until the work ends
+        '''
+        self._task = BackgroundTask(work, description)
+        self._task_on_end = on_end
+        self._task_blocks_edits = blocks_edits
+        self._ui.show_progress(description, 0.0)
+        self._task.start()
+        self._ui.after_frame(self._poll_task, TASK_POLL_MS)
+
+    def _poll_task(self):
+        '''Handles the messages of the background task, until it ends'''
+        task = self._task
+        if task is None:
+            return
+        for kind, value in task.poll():
+            if kind == 'progress':
+                self._ui.show_progress(task.description, value)
+                continue
+            self._task = None
+            self._task_blocks_edits = False
+            self._ui.hide_progress()
+            self._task_on_end(kind, value)
+            return
+        self._ui.after_frame(self._poll_task, TASK_POLL_MS)
+
+    def cancel_task(self):
+        '''Callback for the Cancel button of the background task progress'''
+        if self._task is not None:
+            self._task.cancel()
+
+    def _cancel_load(self):
+        '''Drops the file being opened, even if it finished loading meanwhile'''
+        if self._task is None or not self._task_blocks_edits:
+            return
+        def drop(status, value):
+            if status == 'done':
+                value.close()
+        self._task_on_end = drop
+        self._task.cancel()
+        self._task.join()
+        self._poll_task()
+
+    def _task_running(self) -> bool:
+        '''Returns True, telling the user to wait, if a background task runs'''
+        if self._task is None:
+            return False
+        self._ui.showwarning(f"Wait for {self._task.description} to finish")
+        return True
+
+    def _edits_blocked(self) -> bool:
+        '''Returns True if tile edits are ignored because a file is loading'''
+        return self._task_blocks_edits
+
+    def _start_journal(self):
+        '''Starts journaling the changes to the opened file, first offering to
+        replay the changes a previous session did not save'''
+        filename = self._tile_set.filename
+        if not filename or not os.path.isfile(filename):
+            return
+        records = RecoveryJournal.read(filename)
+        recover = records is not None and len(records) > 1 and self._ui.askyesno(
+            f"{os.path.basename(filename)} has unsaved changes from a previous "
+            "session. Recover them?")
+        if recover:
+            RecoveryJournal.replay(self._tile_set, records)
+        self._tile_set.journal = RecoveryJournal(filename, len(self._tile_set), append=recover)
+        if not self._journal_polled:
+            self._journal_polled = True
+            self._ui.after_frame(self._poll_journal, JOURNAL_SYNC_MS)
+
+    def _poll_journal(self):
+        '''Tells the user once the journal cannot be written, as the changes are
+        then lost in a crash'''
+        journal = self._tile_set.journal
+        if journal is None or journal.error is not None:
+            self._journal_polled = False
+            if journal is not None:
+                self._stop_journal()
+                self._ui.showerror("Unable to write the recovery journal, unsaved "
+                                   f"changes will not be recovered after a crash: {journal.error}")
+            return
+        self._ui.after_frame(self._poll_journal, JOURNAL_SYNC_MS)
+
+    def _stop_journal(self):
+        '''Deletes the journal once its changes are saved or dropped'''
+        if self._tile_set.journal is not None:
+            self._tile_set.journal.close()
+            self._tile_set.journal = None
 
     def _check_to_save_tileset(self ):
         if self._tile_set.modified:
@@ -871,25 +3269,43 @@ class NesTileEdit:
             if not result:
                 # No
                 return True
-            # Yes
-            if not self.save_as_tileset():
-                self._ui.showerror("Unable to save tile set!")
+            # Yes, the data has to be saved before it is dropped
+            self._cancel_load()
+            if not self.save_as_tileset(background=False):
                 return False
         return True
 
+    def _check_to_save_tlayer(self):
+        '''Asks to save a modified tile layer before it is dropped
+        Returns:
+            False if the user cancelled, or the save failed
+        '''
+        if self._tlayer.modified:
+            result = self._ui.askyesnocancel("Save current tile layer?")
+            if result is None:
+                return False
+            if result:
+                return self.save_tlayer()
+        return True
+
     def new_tileset(self):
         '''Callback for New as selected from tileset menu.
         Erases all tile data.
         '''
-        if not self._check_to_save_tileset():
+        if (self._task_running() or not self._check_to_save_tileset() or
+                not self._check_to_save_tlayer()):
             return
 
+        self._stop_journal()
         self._tile_set.reset()
         self._tlayer.reset()
+        self._pending_pixels = {}
+        self._undo.clear()
         self.current_pal = list(default_palette)
         # Index into self.current_pal, not nes_palette
         self.current_col = 1
         self.current_tile_num = 0
+        self._clear_selection()
         # Widget display
         self._ui.tileset_redraw_all(self._tile_set, self.current_tile_num)
         self._ui.edit_redraw_all(self.current_tile_num,
@@ -900,15 +3316,34 @@ class NesTileEdit:
 
     def open_tileset(self):
         '''Callback for Open selected from tileset menu.
-        triggers event to load a tileset
+        triggers event to load a tileset, in the background
         '''
-        if not self._check_to_save_tileset():
+        if self._task_running() or not self._check_to_save_tileset():
             return
         filename = filedialog.askopenfilename(filetypes=nes_filetypes)
         if not filename:
             return
-        self._tile_set.do_open( filename )
+        use_mmap = self._tile_set.use_mmap
+        def work(progress):
+            tile_set = TileSet(CROM_INC, use_mmap=use_mmap)
+            tile_set.do_open(filename, progress=progress)
+            return tile_set
+        self._run_task(work, f"opening {os.path.basename(filename)}",
+                       self._tileset_opened, blocks_edits=True)
+
+    def _tileset_opened(self, status: str, value):
+        '''Replaces the tile set with the one loaded by open_tileset'''
+        if status == 'error':
+            self._ui.showerror(f"Unable to open tile set: {value}")
+        if status != 'done':
+            return
+        self._stop_journal()
+        old_tile_set, self._tile_set = self._tile_set, value
+        old_tile_set.close()
+        self._start_journal()
         self._tlayer.reset()
+        self._pending_pixels = {}
+        self._undo.clear()
         # redraw the windows
         self.set_current_tile_num(0)
         self._ui.tileset_redraw_all(self._tile_set, self.current_tile_num)
@@ -921,15 +3356,21 @@ class NesTileEdit:
         '''What does it even mean to Close a tile set?'''
         self.new_tileset()
 
-    def save_as_tileset(self):
+    def save_as_tileset(self, background: bool = True) -> bool:
         '''Callback for save as selected from tileset menu.
         triggers event to try to save tileset
+        Args:
+            background: save on a worker thread, else wait for the save to end
+        Returns:
+            False if no file was chosen, or if the save failed without background
         '''
+        if self._task_running():
+            return False
         filename = filedialog.asksaveasfilename(
             filetypes=nes_filetypes, initialfile=self._tile_set.filename )
         if not filename:
-            return
-        self._tile_set.do_save( filename )
+            return False
+        return self._save_tileset(filename, background)
 
     def save_tileset(self):
         '''Callback for save selected from tileset menu.
@@ -938,8 +3379,175 @@ class NesTileEdit:
         if not self._tile_set.filename:
             # do save as if there's no filename for now
             self.save_as_tileset()
-        else:
-            self._tile_set.do_save(self._tile_set.filename)
+        elif not self._task_running():
+            self._save_tileset(self._tile_set.filename)
+
+    def _save_tileset(self, filename: str, background: bool = True) -> bool:
+        '''Saves a snapshot of the tile set, so editing can go on while it is written'''
+        snapshot = self._tile_set.snapshot(filename)
+        def on_end(status, value):
+            self._tile_set.snapshot_saved(snapshot, saved=status == 'done')
+            if status == 'done' and self._tile_set.journal is None:
+                # A new tile set has a file to keep the journal next to now
+                self._start_journal()
+            if status == 'error':
+                self._ui.showerror(f"Unable to save tile set: {value}")
+        if background:
+            self._run_task(lambda progress: TileSet.write_snapshot(snapshot, progress),
+                           f"saving {os.path.basename(filename)}", on_end)
+            return True
+        try:
+            TileSet.write_snapshot(snapshot)
+        except OSError as err:
+            on_end('error', err)
+            return False
+        on_end('done', None)
+        return True
+
+    def import_tileset_png(self):
+        '''Callback for Import PNG selected from tileset menu.
+        Replaces the tiles from the current one on with those of a 4 color image
+        '''
+        if self._edits_blocked():
+            return
+        filename = filedialog.askopenfilename(filetypes=png_filetypes)
+        if not filename:
+            return
+        self._flush_tile_pixels()
+        try:
+            self._tile_set.import_png(filename, self.current_tile_num, self._undo)
+        except (OSError, ValueError) as err:
+            self._ui.showerror(f"Unable to import PNG: {err}")
+        self._ui.tileset_redraw_all(self._tile_set, self.current_tile_num)
+        self._ui.edit_redraw_all(self.current_tile_num,
+                                self._tile_set[self.current_tile_num],
+                                self.current_pal)
+        self._ui.tlayout_redraw_all(self._tile_set, self._tlayer)
+
+    def export_tileset_png(self):
+        '''Callback for Export PNG selected from tileset menu.
+        Saves the tiles as an image in the tileset colors
+        '''
+        filename = filedialog.asksaveasfilename(filetypes=png_filetypes,
+                                                defaultextension='.png')
+        if not filename:
+            return
+        self._flush_tile_pixels()
+        try:
+            self._tile_set.export_png(filename)
+        except OSError as err:
+            self._ui.showerror(f"Unable to export PNG: {err}")
+
+    def import_tileset_compressed(self, codec: str):
+        '''Callback for Import Compressed selected from tileset menu.
+        Replaces the tiles from the first selected one on with those
+        decompressed from a file, at an offset such as in the PRG-ROM of a game
+        Args:
+            codec: the name of the codec in CHR_CODECS
+        '''
+        if self._edits_blocked():
+            return
+        filename = filedialog.askopenfilename(filetypes=nes_filetypes)
+        if not filename:
+            return
+        offset = self._ui.askoffset(os.path.getsize(filename))
+        if offset is None:
+            return
+        self._flush_tile_pixels()
+        first, _ = self.selected_tiles()
+        try:
+            self._tile_set.import_compressed(filename, codec, offset, first, self._undo)
+        except (OSError, ValueError) as err:
+            self._ui.showerror(f"Unable to import {CHR_CODECS[codec].description}: {err}")
+        self._ui.tileset_redraw_all(self._tile_set, self.current_tile_num)
+        self._ui.edit_redraw_all(self.current_tile_num,
+                                self._tile_set[self.current_tile_num],
+                                self.current_pal)
+        self._ui.tlayout_redraw_all(self._tile_set, self._tlayer)
+
+    def export_tileset_compressed(self, codec: str):
+        '''Callback for Export Compressed selected from tileset menu.
+        Saves the selected tiles, or all of them if only one is selected,
+        compressed by codec
+        Args:
+            codec: the name of the codec in CHR_CODECS
+        '''
+        filename = filedialog.asksaveasfilename(filetypes=(('All files', '.*'),),
+                                                defaultextension='.bin')
+        if not filename:
+            return
+        self._flush_tile_pixels()
+        first, stop = self.selected_tiles() if self._selection_anchor is not None \
+            else (0, len(self._tile_set))
+        try:
+            size = self._tile_set.export_compressed(filename, codec, first, stop)
+        except (OSError, ValueError) as err:
+            self._ui.showerror(f"Unable to export {CHR_CODECS[codec].description}: {err}")
+            return
+        self._ui.showinfo(f"{stop - first} tiles compressed to {size} bytes "
+                          f"({size * 100 // max(1, (stop - first) * BYTES_PER_TILE)}%)")
+
+    def export_tlayer_png(self):
+        '''Callback for Export PNG selected from tile layer menu.
+        Saves the tile layer as an image in its NES colors
+        '''
+        filename = filedialog.asksaveasfilename(filetypes=png_filetypes,
+                                                defaultextension='.png')
+        if not filename:
+            return
+        self._flush_tile_pixels()
+        try:
+            self._tlayer.export_png(filename, self._tile_set)
+        except OSError as err:
+            self._ui.showerror(f"Unable to export PNG: {err}")
+
+    def open_tlayer(self):
+        '''Callback for Open selected from tile layer menu.
+        Loads a nametable into the tile layer
+        '''
+        filename = filedialog.askopenfilename(filetypes=nametable_filetypes)
+        if not filename:
+            return
+        try:
+            self._tlayer.do_open(filename)
+        except (OSError, ValueError) as err:
+            self._ui.showerror(f"Unable to open nametable: {err}")
+            return
+        if self._tlayer.palette_mode == 'ppu':
+            self._select_palette(self._tlayer.bg_palettes[self.current_slot])
+        self._ui.tlayout_redraw_all(self._tile_set, self._tlayer)
+
+    def save_as_tlayer(self):
+        '''Callback for save as selected from tile layer menu.
+        Saves the tile layer as a nametable
+        Returns:
+            True if the layer was saved
+        '''
+        filename = filedialog.asksaveasfilename(
+            filetypes=nametable_filetypes, defaultextension='.nam',
+            initialfile=self._tlayer.filename )
+        if not filename:
+            return False
+        return self._save_tlayer(filename)
+
+    def save_tlayer(self):
+        '''Callback for save selected from tile layer menu.
+        Saves the tile layer as a nametable
+        Returns:
+            True if the layer was saved
+        '''
+        if not self._tlayer.filename:
+            return self.save_as_tlayer()
+        return self._save_tlayer(self._tlayer.filename)
+
+    def _save_tlayer(self, filename: str):
+        try:
+            self._tlayer.do_save(filename)
+        except (OSError, ValueError) as err:
+            self._ui.showerror(f"Unable to save nametable: {err}")
+            return False
+        self._ui.tlayout_redraw_all(self._tile_set, self._tlayer)
+        return True
 
     def config_tileset(self):
         '''Gets configuration from the user
@@ -962,10 +3570,14 @@ class NesTileEdit:
             config_db : a dictonary of config items to update
             arg : Descr
         '''
+        if self._edits_blocked():
+            return
         # Read new Config
         chr_rom_cnt = config_db["crom_size"]
         # Update Settings
         self._tile_set.resize( chr_rom_cnt * CROM_INC // BYTES_PER_TILE )
+        self._undo.clear()
+        self._clear_selection()
         if self.current_tile_num > len(self._tile_set):
             self.current_tile_num=0
         # Redraw the windows
@@ -983,6 +3595,10 @@ class NesTileEdit:
             new_nes_color : an NES pallete color (0-63)
         '''
         self.current_pal[palette_idx] = new_nes_color
+        if self._tlayer.palette_mode == 'ppu':
+            # The current palette is one of the shared background palettes
+            cells = self._tlayer.set_bg_color(self.current_slot, palette_idx, new_nes_color)
+            self._ui.tlayout_update_cells(self._tile_set, self._tlayer, cells)
         # Redraw the colors bar to show updated palette selection
         self._ui.colors_redraw_all(self.current_pal, self.current_col)
         # Redraw the edit window with updated palette
@@ -1002,14 +3618,32 @@ class NesTileEdit:
 
     def _draw_tile_pixel( self, col, row, tile_color):
         '''Modifies a pixel in the current tile in all windows
+        The windows are updated once per frame with all the pixels drawn during it.
         Args:
             col: the x position
             row: the y position
             tile_color: tile pixel color (0-3)
         '''
+        if self._edits_blocked():
+            return
+        if self._tile_set[self.current_tile_num].get(col, row) == tile_color:
+            return
+        old_data = bytes(self._tile_set.tile_bytes(self.current_tile_num))
         self._tile_set.update_tile_pixel(self.current_tile_num,col,row,tile_color)
-        self._ui.update_tile_pixel(self._tlayer, self.current_tile_num, self.current_pal,
-                                   TilePixelUpdate(col, row, tile_color) )
+        # All the pixels of a mouse drag are undone together
+        self._undo.record(self.current_tile_num, old_data,
+                          bytes(self._tile_set.tile_bytes(self.current_tile_num)), merge=True)
+        if not self._pending_pixels:
+            self._ui.after_frame(self._flush_tile_pixels)
+        self._pending_pixels.setdefault(self.current_tile_num, {})[(col, row)] = tile_color
+
+    def _flush_tile_pixels(self):
+        '''Renders the pixels drawn since the last frame, grouped by tile'''
+        pending, self._pending_pixels = self._pending_pixels, {}
+        for tile_num, pixels in pending.items():
+            self._ui.update_tile_pixels(self._tlayer, tile_num, self.current_pal,
+                                        [ TilePixelUpdate(col, row, tile_color)
+                                          for (col, row), tile_color in pixels.items() ])
 
     def draw_tile_pixel_fg( self, col, row):
         '''Draws a current fg color pixel on the current tile at location (col, row)'''
@@ -1021,15 +3655,53 @@ class NesTileEdit:
 
     def lay_tile(self, col, row):
         '''Draw the current tile at the block in location col, row'''
+        if self._edits_blocked():
+            return
         self._tlayer.lay_tile( col, row, self.current_tile_num, self.current_pal)
+        if self._tlayer.palette_mode == 'ppu':
+            # The whole quad switches to the current background palette
+            cells = self._tlayer.set_quad_slot(col, row, self.current_slot)
+            self._ui.tlayout_update_cells(self._tile_set, self._tlayer, cells)
         self._ui.lay_tile( col, row, self._tile_set[self.current_tile_num], self.current_pal)
 
+    def _select_palette(self, pal: list[int]):
+        '''Makes pal the current palette and redraws the windows showing it'''
+        self.current_pal = list(pal)
+        self._ui.colors_redraw_all(self.current_pal, self.current_col)
+        self._ui.edit_redraw_all(self.current_tile_num,
+                                self._tile_set[self.current_tile_num],
+                                self.current_pal)
+
+    def set_tlayer_palette_mode(self, mode: str):
+        '''Callback for the Tile Layer palette mode menu
+        Args:
+            mode: 'tile' for a palette per laid tile, 'ppu' for the 4 background
+                palettes picked per 16x16 quad by the attribute table
+        '''
+        self._tlayer.set_palette_mode(mode)
+        if mode == 'ppu':
+            self._select_palette(self._tlayer.bg_palettes[self.current_slot])
+        self._ui.tlayout_redraw_all(self._tile_set, self._tlayer)
+
+    def set_palette_slot(self, slot: int):
+        '''Callback for the Tile Layer background palette menu
+        Args:
+            slot: the background palette (0-3) used by palette edits and laid tiles
+                in ppu palette mode
+        '''
+        self.current_slot = slot
+        if self._tlayer.palette_mode == 'ppu':
+            self._select_palette(self._tlayer.bg_palettes[slot])
+
     def set_current_tile_num(self, idx: int ):
         '''Sets by index the current tile that is selected for placing or editing
         Args:
             idx : the tile number
         '''
+        self._clear_selection()
         if idx != self.current_tile_num and idx < len(self._tile_set):
+            # The edit window shows the pixels still pending for the old tile
+            self._flush_tile_pixels()
             self._ui.tileset_updatehighlight(self._tile_set, self.current_tile_num, idx)
             self.current_tile_num = idx
             # Update edit box with new selected tile
@@ -1037,98 +3709,229 @@ class NesTileEdit:
                                     self._tile_set[self.current_tile_num],
                                     self.current_pal)
 
+    def select_tile_range(self, idx: int):
+        '''Selects the tiles from the current one, or the first tile of the
+        selection, up to idx, making idx the current tile
+        Args:
+            idx : the tile number
+        '''
+        if idx >= len(self._tile_set):
+            return
+        anchor = self.current_tile_num if self._selection_anchor is None \
+            else self._selection_anchor
+        self.set_current_tile_num(idx)
+        self._selection_anchor = anchor
+        self._ui.tileset_select(*self.selected_tiles())
+
+    def selected_tiles(self) -> tuple[int, int]:
+        '''Returns the first selected tile number and the number after the last'''
+        if self._selection_anchor is None:
+            return self.current_tile_num, self.current_tile_num + 1
+        first = min(self._selection_anchor, self.current_tile_num)
+        stop = max(self._selection_anchor, self.current_tile_num) + 1
+        return first, min(stop, len(self._tile_set))
+
+    def _clear_selection(self):
+        '''Leaves only the current tile selected'''
+        if self._selection_anchor is not None:
+            self._selection_anchor = None
+            self._ui.tileset_select(self.current_tile_num, self.current_tile_num + 1)
+
+    def _write_tiles(self, chr_data: bytes, start: int):
+        """Replaces tiles starting at start in one write, recording them for
+        undo as one step and redrawing them together
+        Args:
+            chr_data: the raw NES graphics data of the tiles
+        """
+        if self._edits_blocked():
+            return
+        # Pending pixels would draw over the written tiles
+        self._flush_tile_pixels()
+        stop = start + len(chr_data) // BYTES_PER_TILE
+        old_data = self._tile_set.get_chr(start, stop)
+        self._tile_set.set_chr(chr_data, start)
+        for idx in range(start, stop):
+            offset = (idx - start) * BYTES_PER_TILE
+            self._undo.record(idx, old_data[offset:offset+BYTES_PER_TILE],
+                              chr_data[offset:offset+BYTES_PER_TILE], merge=True)
+        self._undo.end_merge()
+        self._ui.update_tiles(self._tlayer, self._tile_set, start, stop, self.current_pal,
+                              self.current_tile_num)
+
+    def _transform_tiles(self, transform: 'Callable'):
+        """Applies a chr_* transform to the selected tiles, recording it for undo
+        as one step"""
+        if self._edits_blocked():
+            return
+        first, stop = self.selected_tiles()
+        self._flush_tile_pixels()
+        self._write_tiles(transform(self._tile_set.get_chr(first, stop)), first)
+
     def tile_cut(self):
-        """Cuts current tile to clipboard"""
+        """Cuts the selected tiles to clipboard"""
         self.tile_copy()
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].frombytes(b"\0" * BYTES_PER_TILE)
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        first, stop = self.selected_tiles()
+        self._write_tiles(bytes((stop - first) * BYTES_PER_TILE), first)
 
     def tile_copy(self):
-        """Copies current tile to clipboard"""
-        self._ui.clipboard_set( self._tile_set[self.current_tile_num] )
+        """Copies the selected tiles to clipboard"""
+        self._flush_tile_pixels()
+        self._ui.clipboard_set(clipboard_encode(self._tile_set.get_chr(*self.selected_tiles())))
 
     def tile_paste(self):
-        """Pastes clipboard to current tile"""
+        """Pastes the tiles on the clipboard from the first selected tile on,
+        dropping those past the end of the tile set"""
         try:
-            self._tile_set[self.current_tile_num].from_str(self._ui.clipboard_get() )
-            self._tile_set.modified=True
+            chr_data = clipboard_decode(self._ui.clipboard_get())
         except Exception as err:
             print(err)
             traceback.print_exc()
             self._ui.showerror("Unable to paste as tile")
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+            return
+        first, _ = self.selected_tiles()
+        self._write_tiles(chr_data[:(len(self._tile_set) - first) * BYTES_PER_TILE], first)
 
     def tile_shift_up(self):
-        """Shifts current tile up 1 pixel"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].shift_up()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Shifts the selected tiles up 1 pixel"""
+        self._transform_tiles(chr_shift_up)
 
     def tile_shift_down(self):
-        """Shifts current tile down 1 pixel"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].shift_down()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Shifts the selected tiles down 1 pixel"""
+        self._transform_tiles(chr_shift_down)
 
     def tile_shift_left(self):
-        """Shifts current tile left 1 pixel"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].shift_left()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Shifts the selected tiles left 1 pixel"""
+        self._transform_tiles(chr_shift_left)
 
     def tile_shift_right(self):
-        """Shifts current tile right 1 pixel"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].shift_right()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Shifts the selected tiles right 1 pixel"""
+        self._transform_tiles(chr_shift_right)
 
     def tile_invert(self):
-        """Inverts colors of pixels in current tile"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].invert()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Inverts colors of pixels in the selected tiles"""
+        self._transform_tiles(chr_invert)
 
     def tile_hflip(self):
-        """Flips current tile horizontally"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].hflip()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Flips the selected tiles horizontally"""
+        self._transform_tiles(chr_hflip)
 
     def tile_vflip(self):
-        """Flips current tile vertically"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].vflip()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Flips the selected tiles vertically"""
+        self._transform_tiles(chr_vflip)
 
     def tile_cwrotate(self):
-        """Rotates current tile clockwise"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].cwrotate()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Rotates the selected tiles clockwise"""
+        self._transform_tiles(chr_rotate_cw)
 
     def tile_ccwrotate(self):
-        """Rotates current tile counter-clockwise"""
-        self._tile_set.modified=True
-        self._tile_set[self.current_tile_num].ccwrotate()
-        self._ui.update_tile(self._tlayer, self._tile_set,
-                             self.current_tile_num, self.current_pal)
+        """Rotates the selected tiles counter-clockwise"""
+        self._transform_tiles(chr_rotate_ccw)
+
+    def _apply_tile_changes(self, changes: list[tuple[int, bytes]]):
+        """Writes undone or redone tile data and redraws the changed tiles
+        Args:
+            changes: the (tile index, 16 bytes) to write
+        """
+        # Pending pixels would draw over the restored tiles
+        self._flush_tile_pixels()
+        for idx, data in changes:
+            self._tile_set[idx].frombytes(data)
+        for idx in dict.fromkeys(idx for idx, _ in changes):
+            self._ui.update_tile(self._tlayer, self._tile_set, idx, self.current_pal,
+                                 current=idx == self.current_tile_num)
+
+    def undo(self):
+        """Reverts the last change to the tiles"""
+        if self._edits_blocked():
+            return
+        changes = self._undo.undo()
+        if changes:
+            self._apply_tile_changes(changes)
+
+    def redo(self):
+        """Applies again the last change to the tiles that was undone"""
+        if self._edits_blocked():
+            return
+        changes = self._undo.redo()
+        if changes:
+            self._apply_tile_changes(changes)
+
+    def end_stroke(self):
+        """Ends the mouse drag whose drawn pixels are undone together"""
+        self._undo.end_merge()
+
+    def show_bank(self, bank: int):
+        '''Scrolls the tileset to bank and selects its first tile
+        Args:
+            bank: the 8 KB CHR bank number, out of range numbers are ignored
+        '''
+        if not 0 <= bank < self._tile_set.bank_count():
+            return
+        self._ui.tileset_show_bank(self._tile_set, bank)
+        self.set_current_tile_num(bank * TILES_PER_BANK)
+
+    def prev_bank(self):
+        '''Callback for Previous Bank selected from the bank menu'''
+        self.show_bank(self.current_tile_num // TILES_PER_BANK - 1)
+
+    def next_bank(self):
+        '''Callback for Next Bank selected from the bank menu'''
+        self.show_bank(self.current_tile_num // TILES_PER_BANK + 1)
+
+    def goto_bank(self):
+        '''Callback for Go to Bank selected from the bank menu'''
+        bank = self._ui.askbank(self.current_tile_num // TILES_PER_BANK,
+                                self._tile_set.bank_count())
+        if bank is not None:
+            self.show_bank(bank)
+
+    def select_bank(self):
+        '''Callback for Select Bank selected from the bank menu.
+        Selects all the tiles of the bank of the current tile, for the Tile
+        menu and clipboard commands to apply to
+        '''
+        first = self.current_tile_num - self.current_tile_num % TILES_PER_BANK
+        last = min(first + TILES_PER_BANK, len(self._tile_set)) - 1
+        self.set_current_tile_num(first)
+        self._selection_anchor = last
+        self._ui.tileset_select(*self.selected_tiles())
+
+    def find_duplicates(self, mirrors: bool = False):
+        """Shows the groups of tiles that are the same
+        Args:
+            mirrors: also group tiles that are flipped, rotated or inverted forms
+                of each other
+        """
+        index = self._tile_set.hash_index()
+        groups = index.mirror_duplicates() if mirrors else index.duplicates()
+        if not groups:
+            self._ui.showinfo("No duplicate tiles found")
+            return
+        spare = sum(len(group) - 1 for group in groups)
+        lines = [f"{spare} tiles could be reclaimed:"]
+        lines += [", ".join(str(idx) for idx in group[:16]) + (", ..." if len(group) > 16 else "")
+                  for group in groups[:20]]
+        if len(groups) > 20:
+            lines.append(f"and {len(groups) - 20} more groups")
+        self._ui.showinfo("\n".join(lines))
 
     def destroy(self):
         '''Shutsdown the NesTileEditor'''
-        if not self._check_to_save_tileset():
+        if self._task is not None and not self._task_blocks_edits:
+            # A save has to be finished before asking about what it left
+            self._task.join()
+            self._poll_task()
+        # A load goes on, as the quit can still be cancelled
+        if not self._check_to_save_tlayer() or not self._check_to_save_tileset():
             return False
+        self._cancel_load()
+        self._stop_journal()
+        if self._profiler is not None:
+            self._profiler.canvas_items = self._ui.canvas_item_counts()
         self._ui.destroy()
+        if self._profiler is not None:
+            self._profiler.uninstall()
+            self._profiler.dump()
         return True
 
     def main(self):
@@ -1136,15 +3939,271 @@ class NesTileEdit:
         self._ui.mainloop()
 
 
+# Headless batch processing, does not create any windows
+
+BATCH_EXTENSIONS = ('.nes', '.chr')
+# Jobs submitted to the worker processes ahead of the results, per worker
+BATCH_QUEUE_DEPTH = 4
+
+def _batch_open(path: str) -> TileSet:
+    """Opens the raw or iNES file at path. Unlike TileSet(filename=path), which
+    starts a blank tile set for a new file, a missing input is an error.
+    Raises:
+        OSError: the file is missing or cannot be read
+    """
+    tile_set = TileSet()
+    tile_set.do_open(path)
+    return tile_set
+
+def batch_stats(path: str) -> dict:
+    """Returns statistics about the tile data of the file at path"""
+    tile_set = _batch_open(path)
+    tiles = [bytes(tile_set.chr_data[i:i+BYTES_PER_TILE])
+             for i in range(0, len(tile_set.chr_data), BYTES_PER_TILE)]
+    stats = {"file": path, "format": tile_set.file_format,
+             "chr_size": len(tile_set.chr_data), "tiles": len(tiles),
+             "blank_tiles": tiles.count(bytes(BYTES_PER_TILE)),
+             "unique_tiles": len(set(tiles))}
+    if tile_set.file_format == 'ines':
+        index = tile_set.ines_index
+        stats["nes2"] = index.nes2
+        stats["trainer"] = index.trainer[1] > 0
+        stats["prg_banks"] = index.prg[1] // PROM_INC
+        stats["chr_banks"] = index.chr[1] // CROM_INC
+        stats["misc_size"] = index.misc[1]
+    return stats
+
+def batch_extract(path: str, output: str) -> dict:
+    """Saves the CHR data of the iNES file at path as a raw file
+    Args:
+        path: the iNES file
+        output: the raw file, or a directory to save <name>.chr into
+    """
+    tile_set = _batch_open(path)
+    if tile_set.file_format != 'ines':
+        raise ValueError(f'{path} is not an iNES file')
+    if os.path.isdir(output):
+        output = os.path.join(output, os.path.splitext(os.path.basename(path))[0] + '.chr')
+    tile_set.set_file_format('raw')
+    tile_set.do_save(output)
+    return {"file": path, "output": output, "chr_size": len(tile_set.chr_data)}
+
+def batch_inject(path: str, rom: str, output: str = None) -> dict:
+    """Replaces the CHR data of an iNES file with the tile data of the file at path
+    Args:
+        path: the file holding the new tile data, raw or iNES
+        rom: the iNES file to take the header and PRG data from
+        output: the iNES file to write, rom itself if None
+    """
+    tile_set = _batch_open(path)
+    rom_set = _batch_open(rom)
+    if rom_set.file_format != 'ines':
+        raise ValueError(f'{rom} is not an iNES file')
+    tile_set.set_file_format('ines', rom_set.ines_data, rom_set.trailing_data)
+    tile_set.do_save(output or rom)
+    return {"file": path, "output": output or rom, "chr_size": len(tile_set.chr_data)}
+
+def batch_convert(path: str, output: str, template: str = None) -> dict:
+    """Saves the file at path in the format given by the extension of output
+    Args:
+        path: the file to convert, raw or iNES
+        output: the file to write, iNES if it ends in .nes, raw otherwise
+        template: iNES file giving the header and PRG data for raw to iNES conversion
+    """
+    if output.split('.')[-1] != 'nes':
+        return batch_extract(path, output) if path.split('.')[-1] == 'nes' else \
+            _batch_copy(path, output)
+    if template is None and path.split('.')[-1] != 'nes':
+        raise ValueError(f'Converting {path} to iNES needs a template ROM')
+    return batch_inject(path, template or path, output)
+
+def batch_export_png(path: str, output: str) -> dict:
+    """Saves the tiles of the file at path as a PNG image in the tileset colors
+    Args:
+        path: the raw or iNES file
+        output: the image, or a directory to save <name>.png into
+    """
+    tile_set = _batch_open(path)
+    if os.path.isdir(output):
+        output = os.path.join(output, os.path.splitext(os.path.basename(path))[0] + '.png')
+    tile_set.export_png(output)
+    return {"file": path, "output": output, "tiles": len(tile_set)}
+
+def batch_import_png(path: str, chr_file: str, output: str = None, start: int = 0) -> dict:
+    """Replaces tiles of a raw or iNES file with those of the 4 color PNG image at path
+    Args:
+        chr_file: the file to update
+        output: the file to write, chr_file itself if None
+        start: the index of the first tile to replace
+    """
+    tile_set = _batch_open(chr_file)
+    count = tile_set.import_png(path, start)
+    tile_set.do_save(output or chr_file)
+    return {"file": path, "output": output or chr_file, "tiles": count}
+
+def batch_compress(path: str, output: str, codec: str) -> dict:
+    """Saves the tile data of the file at path compressed by codec"""
+    tile_set = _batch_open(path)
+    size = tile_set.export_compressed(output, codec)
+    return {"file": path, "output": output, "chr_size": len(tile_set.chr_data),
+            "compressed_size": size}
+
+def batch_decompress(path: str, output: str, codec: str, offset: int = 0) -> dict:
+    """Saves the tile data compressed by codec at offset in the file at path
+    as a raw file. Like TileSet.import_compressed, the file is read whole."""
+    with open(path, 'rb') as fin:
+        data = fin.read()
+    chr_data, end = CHR_CODECS[codec].decode(data, offset)
+    with open(output, 'wb') as fout:
+        fout.write(chr_data)
+    return {"file": path, "output": output, "compressed_size": end - offset,
+            "chr_size": len(chr_data)}
+
+def _batch_copy(path: str, output: str) -> dict:
+    """Saves the raw tile data of the file at path, padded as the editor would"""
+    tile_set = _batch_open(path)
+    tile_set.do_save(output)
+    return {"file": path, "output": output, "chr_size": len(tile_set.chr_data)}
+
+def _batch_files(paths: list[str]):
+    """Yields the files in paths, walking into directories for ROM and CHR files"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(BATCH_EXTENSIONS):
+                    yield os.path.join(dirpath, filename)
+
+def _batch_job(job: tuple) -> tuple:
+    """Runs one batch job in a worker process, returning (result, error)"""
+    func, path, args = job
+    try:
+        return func(path, *args), None
+    except Exception as err: # pylint: disable=broad-except
+        return None, f"{path}: {err}"
+
+def _batch_results(jobs, workers: int):
+    """Runs jobs in workers processes, yielding their (result, error) in the
+    order they finish. Only a few jobs per worker are submitted at a time, so
+    a slow file does not hold back the others or the reading of the job list."""
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        for job in jobs:
+            pending.add(executor.submit(_batch_job, job))
+            if len(pending) >= workers * BATCH_QUEUE_DEPTH:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+def batch_main(argv: list[str]) -> int:
+    """Entry point of `nestile batch`
+    Returns:
+        the exit status, 1 if any file failed
+    """
+    parser = argparse.ArgumentParser(
+        prog='nestile batch', description='Process NES tile data without the GUI')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON lines')
+    commands = parser.add_subparsers(dest='command', required=True)
+    cmd = commands.add_parser('stats', help='print tile statistics of each file')
+    cmd.add_argument('paths', nargs='+', help='files or directories')
+    cmd = commands.add_parser('extract', help='save the CHR data of iNES files as raw files')
+    cmd.add_argument('paths', nargs='+', help='iNES files or directories')
+    cmd.add_argument('-o', '--output', required=True, help='output directory')
+    cmd = commands.add_parser('inject', help='replace the CHR data of an iNES file')
+    cmd.add_argument('chr', help='file holding the new tile data')
+    cmd.add_argument('rom', help='iNES file to update')
+    cmd.add_argument('-o', '--output', help='write the result here instead of to ROM')
+    cmd = commands.add_parser('convert', help='convert between raw and iNES files')
+    cmd.add_argument('input', help='file to convert')
+    cmd.add_argument('output', help='file to write, iNES if it ends in .nes')
+    cmd.add_argument('-t', '--template', help='iNES file giving the header and PRG data')
+    cmd = commands.add_parser('export-png', help='save the tiles of files as PNG images')
+    cmd.add_argument('paths', nargs='+', help='files or directories')
+    cmd.add_argument('-o', '--output', required=True, help='output directory')
+    cmd = commands.add_parser('import-png', help='replace tiles with those of a PNG image')
+    cmd.add_argument('png', help='4 color indexed or grayscale image')
+    cmd.add_argument('chr', help='raw or iNES file to update')
+    cmd.add_argument('-o', '--output', help='write the result here instead of to CHR')
+    cmd.add_argument('-s', '--start', type=int, default=0,
+                     help='index of the first tile to replace (default: 0)')
+    cmd = commands.add_parser('compress', help='compress the tile data of a file')
+    cmd.add_argument('input', help='raw or iNES file')
+    cmd.add_argument('output', help='file to write the compressed data to')
+    cmd.add_argument('-c', '--codec', choices=CHR_CODECS, required=True, help='compression')
+    cmd = commands.add_parser('decompress', help='save compressed tile data as a raw file')
+    cmd.add_argument('input', help='file holding the compressed data, such as a ROM')
+    cmd.add_argument('output', help='raw file to write')
+    cmd.add_argument('-c', '--codec', choices=CHR_CODECS, required=True, help='compression')
+    cmd.add_argument('--offset', type=lambda text: int(text, 0), default=0,
+                     help='file offset of the compressed data (default: 0)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'stats':
+        jobs = ((batch_stats, path, ()) for path in _batch_files(args.paths))
+    elif args.command == 'extract':
+        os.makedirs(args.output, exist_ok=True)
+        jobs = ((batch_extract, path, (args.output,))
+                for path in _batch_files(args.paths) if path.lower().endswith('.nes'))
+    elif args.command == 'export-png':
+        os.makedirs(args.output, exist_ok=True)
+        jobs = ((batch_export_png, path, (args.output,)) for path in _batch_files(args.paths))
+    elif args.command == 'import-png':
+        jobs = iter([(batch_import_png, args.png, (args.chr, args.output, args.start))])
+    elif args.command == 'compress':
+        jobs = iter([(batch_compress, args.input, (args.output, args.codec))])
+    elif args.command == 'decompress':
+        jobs = iter([(batch_decompress, args.input, (args.output, args.codec, args.offset))])
+    elif args.command == 'inject':
+        jobs = iter([(batch_inject, args.chr, (args.rom, args.output))])
+    else:
+        jobs = iter([(batch_convert, args.input, (args.output, args.template))])
+
+    status = 0
+    if args.jobs == 1:
+        results = map(_batch_job, jobs)
+    else:
+        results = _batch_results(jobs, args.jobs or os.cpu_count() or 1)
+    # Results are printed as they come in
+    for result, error in results:
+        if error is not None:
+            print(error, file=sys.stderr)
+            status = 1
+        elif args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(" ".join(f"{key}={value}" for key, value in result.items()), flush=True)
+    return status
+
+
 # Main program loop
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        if len(sys.argv) > 2 or '-h' in sys.argv:
-            print("Usage: {} [FILE]".format(sys.argv[0]))
-            print("\tFILE - sets name of the FILE to open.")
-            sys.exit(0)
-        else:
-            nes_tile_edit = NesTileEdit(sys.argv[1])
-    else:
-        nes_tile_edit = NesTileEdit()
+    if sys.argv[1:2] == ['batch']:
+        sys.exit(batch_main(sys.argv[2:]))
+    args = sys.argv[1:]
+    profile_setting = os.environ.get(PROFILE_ENV)
+    for arg in list(args):
+        if arg == '--profile' or arg.startswith('--profile='):
+            args.remove(arg)
+            profile_setting = arg.partition('=')[2] or '1'
+    if len(args) > 1 or '-h' in args:
+        print("Usage: {} [--profile[=OUT]] [FILE]".format(sys.argv[0]))
+        print("\tFILE - sets name of the FILE to open.")
+        print("\t--profile - counts and times redraws and file access, showing them")
+        print("\t            in a status line, and writes them on exit to OUT: a")
+        print("\t            cProfile dump if it ends in .prof, else a JSON trace.")
+        print("\t            Also enabled by setting {}=1 or {}=OUT.".format(
+            PROFILE_ENV, PROFILE_ENV))
+        print("       {} batch COMMAND ...".format(sys.argv[0]))
+        print("\tprocesses files without the GUI, see batch -h.")
+        sys.exit(0)
+    nes_tile_edit = NesTileEdit(args[0] if args else None,
+                                Profiler.from_setting(profile_setting))
     nes_tile_edit.main()
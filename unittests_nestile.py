@@ -3,8 +3,32 @@
 Unit tests for the nestile NES Tile Editor
 """
 
+import contextlib
+import io
+import json
+import os
+import tempfile
 import unittest
-from nestile import Tile
+import zlib
+from unittest import mock
+import benchmarks_nestile
+import nestile
+from nestile import (BackgroundTask, InesIndex, LRUCache, Profiler, RecoveryJournal,
+                     TaskCancelled, Tile, TileLayerData, TileSet, TileUndoJournal,
+                     batch_main, chr_decode, chr_encode, clipboard_decode, clipboard_encode,
+                     nametable_decode, nametable_encode, png_read, png_write, read_chr_bank,
+                     tile_sheet_rows)
+
+
+def png_chunk(kind: bytes, body: bytes) -> bytes:
+    """Returns a PNG chunk of kind holding body, to build test images by hand"""
+    return (len(body).to_bytes(4, 'big') + kind + body +
+            zlib.crc32(kind + body).to_bytes(4, 'big'))
+
+def using_numpy(enabled: bool):
+    """Returns a context running its block with or without NumPy, restoring it
+    on the way out even if an assertion fails"""
+    return mock.patch.object(nestile, 'np', nestile.np if enabled else None)
 
 class TestNesTileEditor(unittest.TestCase):
     """Class containing the method to unit test nestile"""
@@ -43,6 +67,11 @@ class TestNesTileEditor(unittest.TestCase):
         self.assertNotEqual(first_tile, tile4)
         tile4.set(7,7,3-tile4.get(7,7))
         self.assertEqual(first_tile, tile4)
+        self.assertRaises(ValueError, Tile().frombytes, base_bytes[:15])
+        tile_set = TileSet()
+        self.assertRaises(ValueError, tile_set[1].frombytes, base_bytes[:8])
+        self.assertEqual(len(tile_set.chr_data), 512 * 16)
+        self.assertTrue(tile_set[1].is_blank())
 
 
     def tile_edits(self, init_tile_data):
@@ -84,5 +113,765 @@ class TestNesTileEditor(unittest.TestCase):
         self.tile_edits(None)
 
 
+    def test_tile_transforms(self):
+        """
+        Checks the bitplane transforms against the equivalent operations on pixel rows
+        """
+        base_bytes = b"\x41\xC2\x44\x48\x10\x20\x40\x80\x01\x02\x04\x08\x16\x21\x42\x87"
+        rows = Tile(base_bytes).tolist()
+        tile = Tile(base_bytes)
+        tile.hflip()
+        self.assertEqual(tile, [row[::-1] for row in rows])
+        tile = Tile(base_bytes)
+        tile.vflip()
+        self.assertEqual(tile, rows[::-1])
+        tile = Tile(base_bytes)
+        tile.cwrotate()
+        self.assertEqual(tile, [[rows[7-x][y] for x in range(8)] for y in range(8)])
+        tile.ccwrotate()
+        self.assertEqual(tile.tobytes(), base_bytes)
+        blank = Tile()
+        self.assertEqual(repr(blank), "Tile(None)")
+        blank.invert()
+        self.assertEqual(blank.tobytes(), b"\xFF" * 16)
+        self.assertEqual(Tile().tobytes(), b"\0" * 16)
+
+
+    def test_chr_range_transforms(self):
+        """
+        The transforms of many tiles at once match the pixel operations on each
+        tile, with or without NumPy
+        """
+        chr_data = bytes((i * 37 + 11) % 256 for i in range(16 * 64))
+        tiles = [Tile(chr_data[i:i+16]).tolist() for i in range(0, len(chr_data), 16)]
+        expected = {
+            nestile.chr_hflip: [[row[::-1] for row in rows] for rows in tiles],
+            nestile.chr_vflip: [rows[::-1] for rows in tiles],
+            nestile.chr_rotate_cw: [[[rows[7-x][y] for x in range(8)] for y in range(8)]
+                                    for rows in tiles],
+            nestile.chr_rotate_ccw: [[[rows[x][7-y] for x in range(8)] for y in range(8)]
+                                     for rows in tiles],
+            nestile.chr_invert: [[[3 - col for col in row] for row in rows] for rows in tiles],
+            nestile.chr_shift_left: [[row[1:] + row[:1] for row in rows] for rows in tiles],
+            nestile.chr_shift_right: [[row[-1:] + row[:-1] for row in rows] for rows in tiles],
+            nestile.chr_shift_up: [rows[1:] + rows[:1] for rows in tiles],
+            nestile.chr_shift_down: [rows[-1:] + rows[:-1] for rows in tiles],
+        }
+        for use_numpy in (True, False):
+            with using_numpy(use_numpy):
+                for transform, result in expected.items():
+                    transformed = transform(chr_data)
+                    self.assertEqual([Tile(transformed[i:i+16]).tolist()
+                                      for i in range(0, len(chr_data), 16)], result,
+                                     transform.__name__)
+        tile_set = TileSet()
+        tile_set.set_chr(chr_data, 10)
+        tile_set.transform(nestile.chr_hflip, 12, 14)
+        self.assertEqual(tile_set.get_chr(12, 14), nestile.chr_hflip(chr_data[32:64]))
+        self.assertEqual(tile_set.get_chr(10, 12), chr_data[:32])
+        self.assertEqual(tile_set.get_chr(14, 15), chr_data[64:80])
+
+
+    def test_chr_codec(self):
+        """
+        Bulk decoding matches Tile and encoding gets back the original data
+        """
+        chr_data = bytes(range(256)) * 2
+        pixels = chr_decode(chr_data)
+        self.assertEqual(len(pixels), 32)
+        for idx in range(32):
+            tile = Tile(chr_data[idx*16:(idx+1)*16])
+            self.assertEqual(tile, [list(row) for row in pixels[idx]])
+        self.assertEqual(chr_encode(pixels), chr_data)
+        self.assertRaises(ValueError, chr_decode, chr_data[:40])
+        if nestile.np is not None:
+            # Also check the pure Python fallback
+            numpy = nestile.np
+            with using_numpy(False):
+                self.assertEqual(chr_encode(chr_decode(chr_data)), chr_data)
+                self.assertTrue((numpy.array(chr_decode(chr_data)) == pixels).all())
+                self.assertRaises(ValueError, chr_decode, chr_data[:40])
+
+
+    def test_tile_sheet_rows(self):
+        """
+        Tiles are laid out left to right, padding the last row with blank tiles
+        """
+        tiles = [Tile(bytes([idx]*8 + [0]*8)) for idx in (0x80, 0x40, 0x20)]
+        rows = tile_sheet_rows(chr_decode(b"".join(t.tobytes() for t in tiles)), 2)
+        self.assertEqual(len(rows), 16)
+        self.assertEqual(list(rows[0]), [1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(list(rows[15]), [0, 0, 1, 0, 0, 0, 0, 0] + [0] * 8)
+
+
+    def test_clipboard_codec(self):
+        """
+        Tiles copied to the clipboard paste back, as do single tile reprs
+        """
+        chr_data = bytes(range(256)) * 16
+        text = clipboard_encode(chr_data)
+        self.assertTrue(text.startswith('NESTILE-CHR:v1:256:'))
+        self.assertEqual(clipboard_decode(text + '\n'), chr_data)
+        tile = Tile(chr_data[16:32])
+        self.assertEqual(clipboard_decode(repr(tile)), chr_data[16:32])
+        self.assertEqual(clipboard_decode(repr(Tile())), bytes(16))
+        self.assertRaises(ValueError, clipboard_decode, 'hello')
+        self.assertRaises(ValueError, clipboard_decode, text[:-8])
+        self.assertRaises(ValueError, clipboard_decode, text.replace(':v1:', ':v9:'))
+        tile_set = TileSet()
+        tile_set.set_chr(chr_data, 256)
+        self.assertEqual(tile_set.get_chr(256), chr_data)
+        self.assertEqual(tile_set.get_chr(0, 2), bytes(32))
+        self.assertRaises(IndexError, tile_set.set_chr, chr_data, 300)
+
+
+    def test_lru_cache(self):
+        """
+        The least recently used item is evicted first
+        """
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b', 0), 0)
+        self.assertEqual(len(cache), 2)
+
+
+    def test_benchmark_compare(self):
+        """
+        Benchmarks slower than the baseline beyond the threshold are regressions
+        """
+        baseline = {'results': {'a': {'seconds': 1.0}, 'b': {'seconds': 1.0}}}
+        results = {'results': {'a': {'seconds': 1.2}, 'b': {'seconds': 1.5},
+                               'c': {'seconds': 9.0}}}
+        self.assertEqual(benchmarks_nestile.compare(results, baseline, 0.25),
+                         [('b', 1.0, 1.5, 1.5)])
+        self.assertEqual(benchmarks_nestile.compare(results, baseline, 0.5), [])
+
+
+class TestTileSet(unittest.TestCase):
+    """Class containing the methods to unit test the TileSet file handling"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_file(self, name, data):
+        """Writes data to a file in the temporary directory and returns its path"""
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'wb') as fout:
+            fout.write(data)
+        return path
+
+    def test_raw_roundtrip(self):
+        """
+        Edits through Tile views land in the CHR buffer and are saved back
+        """
+        path = self.write_file('test.chr', bytes(range(256)) * 32)
+        tile_set = TileSet(filename=path)
+        self.assertEqual(len(tile_set), 512)
+        self.assertEqual(tile_set[1].tobytes(), bytes(range(16, 32)))
+        tile_set.update_tile_pixel(0, 0, 0, 3)
+        tile_set[1].frombytes(b"\0" * 16)
+        tile_set.do_save(path)
+        with open(path, 'rb') as fin:
+            saved = fin.read()
+        self.assertEqual(saved[0], 0x80)
+        self.assertEqual(saved[8], 0x88)
+        self.assertEqual(saved[16:32], b"\0" * 16)
+        self.assertEqual(saved[32:], (bytes(range(256)) * 32)[32:])
+
+    def test_ines_open(self):
+        """
+        Loads the CHR data following the PRG data of an iNES file
+        """
+        header = b"NES\x1a\x01\x01" + b"\0" * 10
+        chr_data = bytes(range(256)) * 32
+        path = self.write_file('test.nes', header + b"\xEA" * 16384 + chr_data)
+        tile_set = TileSet(filename=path)
+        self.assertEqual(tile_set.file_format, 'ines')
+        self.assertEqual(bytes(tile_set.chr_data), chr_data)
+        tile_set.resize(1024)
+        self.assertEqual(len(tile_set), 1024)
+        self.assertEqual(tile_set[-1], Tile())
+        tiles = tile_set[2:8:2]
+        self.assertEqual(len(tiles), 3)
+        tiles[1].set(0, 0, 3)
+        self.assertEqual(tile_set[4].get(0, 0), 3)
+        self.assertEqual(tile_set[-2:], [Tile(), Tile()])
+
+
+    def test_mmap_patch_save(self):
+        """
+        Saving a memory mapped iNES file only copies the changed tiles from
+        memory, and replaces the file as a whole
+        """
+        header = b"NES\x1a\x01\x01" + b"\0" * 10
+        prg_data = b"\xEA" * 16384
+        chr_data = bytes(range(256)) * 32
+        path = self.write_file('test.nes', header + prg_data + chr_data)
+        tile_set = TileSet(filename=path, use_mmap=True)
+        self.assertEqual(bytes(tile_set.chr_data), chr_data)
+        tile_set.update_tile_pixel(2, 7, 0, 1)
+        snapshot = tile_set.snapshot(path)
+        self.assertTrue(snapshot.patch)
+        self.assertEqual(snapshot.chunks, [(16400 + 32, tile_set.tile_bytes(2))])
+        # A save stopped halfway leaves the old file whole
+        def cancel(done, total):
+            if done < total:
+                raise TaskCancelled()
+        self.assertRaises(TaskCancelled, TileSet.write_snapshot, snapshot, cancel)
+        with open(path, 'rb') as fin:
+            self.assertEqual(fin.read(), header + prg_data + chr_data)
+        TileSet.write_snapshot(snapshot)
+        tile_set.snapshot_saved(snapshot)
+        self.assertFalse(tile_set.modified)
+        with open(path, 'rb') as fin:
+            saved = fin.read()
+        self.assertEqual(saved[:16400], header + prg_data)
+        self.assertEqual(saved[16400+32], 0x21)
+        self.assertEqual(saved[16400+48:], chr_data[48:])
+        # The mapped data stays usable once the file is replaced
+        tile_set.update_tile_pixel(3, 7, 0, 1)
+        tile_set.do_save(path)
+        with open(path, 'rb') as fin:
+            self.assertEqual(fin.read()[16400+32:16400+64:16], b"\x21\x31")
+        # A size change writes the whole file
+        tile_set.resize(1024)
+        tile_set.modified = True
+        self.assertFalse(tile_set.snapshot(path).patch)
+        tile_set.modified = True
+        tile_set.do_save(path)
+        self.assertEqual(os.path.getsize(path), 16400 + 16384)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['test.nes'])
+
+
+    def test_failed_open(self):
+        """
+        A file that cannot be opened leaves the opened tile set as it was
+        """
+        chr_data = bytes(range(256)) * 32
+        path = self.write_file('test.chr', chr_data)
+        tile_set = TileSet(filename=path, use_mmap=True)
+        tile_set.update_tile_pixel(0, 0, 0, 3)
+        changed = bytes(tile_set.chr_data)
+        def stop(done, total):
+            raise TaskCancelled()
+        for use_mmap in (True, False):
+            self.assertRaises(FileNotFoundError, tile_set.do_open,
+                              os.path.join(self.tmpdir.name, 'missing.chr'), use_mmap)
+            self.assertRaises(TaskCancelled, tile_set.do_open, path, False, stop)
+            self.assertEqual(bytes(tile_set.chr_data), changed)
+            self.assertEqual(tile_set.filename, path)
+            self.assertTrue(tile_set.modified)
+        tile_set.do_save(path)
+        with open(path, 'rb') as fin:
+            self.assertEqual(fin.read(), changed)
+
+    def test_batch(self):
+        """
+        Extracts and re-injects CHR data without the GUI
+        """
+        header = b"NES\x1a\x01\x01" + b"\0" * 10
+        chr_data = bytes(range(256)) * 32
+        rom = self.write_file('game.nes', header + b"\xEA" * 16384 + chr_data)
+        out_dir = os.path.join(self.tmpdir.name, 'out')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(batch_main(['-j', '1', 'extract', rom, '-o', out_dir]), 0)
+            self.assertEqual(batch_main(['-j', '1', '--json', 'stats', out_dir]), 0)
+        self.assertIn('"unique_tiles": 16', output.getvalue())
+        with open(os.path.join(out_dir, 'game.chr'), 'rb') as fin:
+            self.assertEqual(fin.read(), chr_data)
+        new_chr = self.write_file('new.chr', b"\x55" * 16384)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(batch_main(['-j', '1', 'inject', new_chr, rom]), 0)
+        with open(rom, 'rb') as fin:
+            saved = fin.read()
+        self.assertEqual(saved[5], 2)
+        self.assertEqual(saved[16400:], b"\x55" * 16384)
+        # A missing input fails instead of standing for a blank tile set
+        missing = os.path.join(self.tmpdir.name, 'missing.chr')
+        errors = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+            self.assertEqual(batch_main(['-j', '1', 'stats', missing]), 1)
+            self.assertEqual(batch_main(['-j', '1', 'inject', missing, rom]), 1)
+        self.assertEqual(len(errors.getvalue().splitlines()), 2)
+        self.assertTrue(errors.getvalue().startswith(missing))
+        self.assertRaises(FileNotFoundError, nestile.batch_stats, missing)
+        with open(rom, 'rb') as fin:
+            self.assertEqual(fin.read(), saved)
+
+
+    def test_ines_index(self):
+        """
+        Trainers, NES 2.0 sizes and misc ROMs are found, kept and saved back
+        """
+        header = b"NES\x1a\x01\x02\x04\x08\x00\x00" + b"\0" * 6
+        trainer = b"\xAA" * 512
+        prg_data = b"\xEA" * 16384
+        chr_data = bytes(range(256)) * 64
+        misc = b"MISC"
+        path = self.write_file('trainer.nes', header + trainer + prg_data + chr_data + misc)
+        index = InesIndex.parse(header, os.path.getsize(path))
+        self.assertEqual(index, (True, (0, 16), (16, 512), (528, 16384),
+                                 (16912, 16384), (33296, 4)))
+        self.assertEqual(read_chr_bank(path, 1), chr_data[8192:])
+        self.assertRaises(IndexError, read_chr_bank, path, 2)
+        for use_mmap in (True, False):
+            tile_set = TileSet(filename=path, use_mmap=use_mmap)
+            self.assertEqual(bytes(tile_set.chr_data), chr_data)
+            self.assertEqual(bytes(tile_set.trailing_data), misc)
+            tile_set.update_tile_pixel(0, 0, 0, 0)
+            tile_set.do_save(path)
+            tile_set.update_tile_pixel(0, 0, 0, 3)
+            saved = os.path.join(self.tmpdir.name, 'saved.nes')
+            tile_set.do_save(saved)
+            with open(saved, 'rb') as fin:
+                data = fin.read()
+            self.assertEqual(data[:16912], header + trainer + prg_data)
+            self.assertEqual(data[16912:], bytes(tile_set.chr_data) + misc)
+            tile_set.close()
+        # Exponent-multiplier sizes: 2^4 * 3 bytes of PRG
+        header = b"NES\x1a\x11\x00\x00\x08\x00\x0F" + b"\0" * 6
+        self.assertEqual(InesIndex.parse(header, 100).prg, (16, 48))
+
+    def test_bank_pixels(self):
+        """
+        Banks are decoded on first use, cached, and decoded again once changed
+        """
+        path = self.write_file('test.chr', bytes(range(256)) * 32 * 40)
+        tile_set = TileSet(filename=path, use_mmap=True)
+        self.assertEqual(tile_set.bank_count(), 40)
+        pixels = tile_set.bank_pixels(39)
+        self.assertEqual(len(pixels), 512)
+        self.assertEqual([list(map(list, tile)) for tile in pixels[3:4]],
+                         [tile_set[39 * 512 + 3].tolist()])
+        self.assertIs(tile_set.bank_pixels(39), pixels)
+        banks = [tile_set.bank_pixels(bank) for bank in range(nestile.BANK_CACHE_SIZE)]
+        # The least recently used bank makes room for the others
+        self.assertIsNot(tile_set.bank_pixels(39), pixels)
+        self.assertIs(tile_set.bank_pixels(1), banks[1])
+        tile_set.update_tile_pixel(512 + 5, 0, 0, 3)
+        self.assertIsNot(tile_set.bank_pixels(1), banks[1])
+        self.assertEqual(tile_set.bank_pixels(1)[5][0][0], 3)
+        self.assertRaises(IndexError, tile_set.bank_pixels, 40)
+
+    def test_png_roundtrip(self):
+        """
+        Tiles exported as a PNG import back, growing a raw set to fit, with or
+        without NumPy
+        """
+        chr_data = bytes(range(256)) * 32
+        path = self.write_file('test.chr', chr_data)
+        png_path = os.path.join(self.tmpdir.name, 'test.png')
+        tile_set = TileSet(filename=path)
+        tile_set.export_png(png_path)
+        with open(png_path, 'rb') as fin:
+            image = png_read(fin)
+            self.assertEqual((image.width, image.height), (128, 256))
+            self.assertEqual(image.palette[:4], [(0, 0, 0), (0, 255, 255), (255, 0, 255),
+                                                 (255, 255, 0)])
+            self.assertEqual(list(next(image.rows)),
+                             list(tile_sheet_rows(tile_set.get_pixels(0, 16), 16)[0]))
+        for use_numpy in (True, False):
+            with using_numpy(use_numpy):
+                imported = TileSet()
+                self.assertEqual(imported.import_png(png_path), 512)
+                self.assertEqual(bytes(imported.chr_data), chr_data)
+                # Only the tiles the image changes are undone, in one step
+                imported[3].set(0, 0, 3)
+                undo = TileUndoJournal()
+                imported.import_png(png_path, 0, undo)
+                self.assertEqual([idx for idx, _ in undo.undo()], [3])
+                imported.import_png(png_path, 256, undo)
+                self.assertEqual(len(imported), 1024)
+                self.assertEqual(bytes(imported.tile_bytes(256)), chr_data[:16])
+                self.assertIsNone(undo.undo())
+        bad_path = os.path.join(self.tmpdir.name, 'bad.png')
+        with open(bad_path, 'wb') as fout:
+            png_write(fout, 8, 8, ['#000000'] * 5, [bytes(range(5)) + bytes(3)] * 8)
+        self.assertRaises(ValueError, tile_set.import_png, bad_path)
+
+    def test_png_colors(self):
+        """
+        Gray levels and palette entries other than 0-3 are mapped to tile colors
+        """
+        def import_rows(header, extra, rows):
+            data = bytearray()
+            for row in rows:
+                data += b"\0" + row
+            path = self.write_file('colors.png', nestile.PNG_SIGNATURE +
+                                   png_chunk(b'IHDR', header) + extra +
+                                   png_chunk(b'IDAT', zlib.compress(bytes(data))) +
+                                   png_chunk(b'IEND', b''))
+            tile_set = TileSet()
+            tile_set.import_png(path)
+            return tile_set[0].tolist()
+        size = (8).to_bytes(4, 'big') * 2
+        gray = [bytes([0, 85, 170, 255] * 2)] * 8
+        self.assertEqual(import_rows(size + bytes([8, 0, 0, 0, 0]), b'', gray),
+                         [[0, 1, 2, 3] * 2] * 8)
+        gray = [bytes([40, 200, 90, 40] * 2)] * 8
+        self.assertEqual(import_rows(size + bytes([8, 0, 0, 0, 0]), b'', gray),
+                         [[0, 2, 1, 0] * 2] * 8)
+        plte = png_chunk(b'PLTE', b"\0" * 18 + bytes(range(12)))
+        indexed = [bytes([4, 5, 6, 7] * 2)] * 8
+        self.assertEqual(import_rows(size + bytes([8, 3, 0, 0, 0]), plte, indexed),
+                         [[0, 1, 2, 3] * 2] * 8)
+
+    def test_png_filters(self):
+        """
+        Rows filtered with any PNG filter and packed 2 bits per pixel read back
+        """
+        rows = [bytes((x * 7 + y * 13) % 256 for x in range(16)) for y in range(5)]
+        def paeth(left, up, up_left):
+            estimate = left + up - up_left
+            return min((abs(estimate - left), 0, left), (abs(estimate - up), 1, up),
+                       (abs(estimate - up_left), 2, up_left))[2]
+        data = bytearray()
+        prior = bytes(16)
+        for kind, row in enumerate(rows):
+            data.append(kind)
+            for i, byte in enumerate(row):
+                left = row[i-1] if i else 0
+                up_left = prior[i-1] if i else 0
+                predictor = (0, left, prior[i], (left + prior[i]) >> 1,
+                             paeth(left, prior[i], up_left))[kind]
+                data.append((byte - predictor) & 0xFF)
+            prior = row
+        png_data = (nestile.PNG_SIGNATURE +
+                    png_chunk(b'IHDR', (64).to_bytes(4, 'big') + (5).to_bytes(4, 'big') +
+                              bytes([2, 0, 0, 0, 0])) +
+                    png_chunk(b'IDAT', zlib.compress(bytes(data))) + png_chunk(b'IEND', b''))
+        expected = [[(byte >> shift) & 3 for byte in row for shift in (6, 4, 2, 0)]
+                    for row in rows]
+        for use_numpy in (True, False):
+            with using_numpy(use_numpy):
+                image = png_read(io.BytesIO(png_data))
+                self.assertEqual((image.width, image.height, image.depth), (64, 5, 2))
+                self.assertEqual([list(row) for row in image.rows], expected)
+        self.assertRaises(ValueError, png_read, io.BytesIO(b'GIF89a' + png_data[6:]))
+
+    def test_chr_codecs(self):
+        """
+        Every codec decodes what it encodes, from an offset in a larger file,
+        and the RLE formats match their known byte layouts
+        """
+        chr_data = bytes(64) + bytes(range(100)) + b"\x07" * 300 + bytes(range(8)) * 4
+        for codec in nestile.CHR_CODECS.values():
+            encoded = codec.encode(chr_data)
+            decoded, end = codec.decode(b"PRG" + encoded + b"more", 3)
+            self.assertEqual(decoded[:len(chr_data)], chr_data, codec.name)
+            self.assertEqual(end, 3 + len(encoded), codec.name)
+            self.assertRaises(ValueError, codec.decode, encoded[:-1])
+        self.assertEqual(nestile.rle_encode(b"\1\1\1\1\2"), b"\0\1\0\3\2\0\0")
+        self.assertEqual(nestile.rle_decode(b"\x09\5\x09\2\6\x09\0"), (b"\5\5\5\6", 7))
+        self.assertRaises(ValueError, nestile.rle_encode, bytes(range(256)))
+        self.assertEqual(nestile.konami_encode(b"\1\1\1\1\2\3"), b"\4\1\x82\2\3\xff")
+        self.assertEqual(nestile.konami_decode(b"\x02\7\x81\6\xff"), (b"\7\7\6", 5))
+
+        path = self.write_file('prg.bin', b"\0" * 16 + nestile.konami_encode(chr_data))
+        tile_set = TileSet()
+        undo = TileUndoJournal()
+        self.assertEqual(tile_set.import_compressed(path, 'konami', 16, 2, undo), 31)
+        self.assertEqual(tile_set.get_chr(2, 33), chr_data)
+        # The 4 blank tiles did not change
+        self.assertEqual(len(undo.undo()), 27)
+        out_path = os.path.join(self.tmpdir.name, 'out.bin')
+        size = tile_set.export_compressed(out_path, 'rle', 2, 33)
+        with open(out_path, 'rb') as fin:
+            self.assertEqual(nestile.rle_decode(fin.read()), (chr_data, size))
+
+    def test_snapshot_save(self):
+        """
+        Tiles changed while a snapshot is being written stay modified, and a
+        failed or cancelled save leaves the file and the changes as they were
+        """
+        chr_data = bytes(range(256)) * 32
+        path = self.write_file('test.chr', chr_data)
+        tile_set = TileSet(filename=path, use_mmap=True)
+        tile_set.update_tile_pixel(1, 0, 0, 3)
+        snapshot = tile_set.snapshot(path)
+        self.assertTrue(snapshot.patch)
+        tile_set.update_tile_pixel(2, 0, 0, 3)
+        TileSet.write_snapshot(snapshot)
+        tile_set.snapshot_saved(snapshot)
+        self.assertTrue(tile_set.modified)
+        with open(path, 'rb') as fin:
+            saved = fin.read()
+        self.assertEqual(saved[16:32], tile_set.tile_bytes(1))
+        self.assertEqual(saved[32:48], chr_data[32:48])
+
+        other = os.path.join(self.tmpdir.name, 'other.chr')
+        snapshot = tile_set.snapshot(other)
+        self.assertFalse(snapshot.patch)
+        def cancel(done, total):
+            raise TaskCancelled()
+        self.assertRaises(TaskCancelled, TileSet.write_snapshot, snapshot, cancel)
+        tile_set.snapshot_saved(snapshot, saved=False)
+        self.assertFalse(os.path.exists(other))
+        self.assertEqual(os.listdir(self.tmpdir.name), ['test.chr'])
+        # Only the tile changed during the first save is left to write
+        snapshot = tile_set.snapshot(path)
+        self.assertEqual(snapshot.chunks, [(32, tile_set.tile_bytes(2))])
+
+    def test_recovery_journal(self):
+        """
+        Changes journaled before a crash are replayed, and a save starts the
+        journal over with the changes it missed
+        """
+        chr_data = bytes(range(256)) * 32
+        path = self.write_file('test.chr', chr_data)
+        tile_set = TileSet(filename=path)
+        tile_set.journal = RecoveryJournal(path, len(tile_set))
+        tile_set.update_tile_pixel(3, 0, 0, 3)
+        tile_set.update_tile_pixel(3, 1, 0, 3)
+        tile_set.resize(1024)
+        tile_set.update_tile_pixel(600, 0, 0, 1)
+        tile_set.journal.sync()
+
+        records = RecoveryJournal.read(path)
+        recovered = TileSet(filename=path)
+        RecoveryJournal.replay(recovered, records)
+        self.assertEqual(len(recovered), 1024)
+        self.assertEqual(bytes(recovered.chr_data), bytes(tile_set.chr_data))
+
+        snapshot = tile_set.snapshot(path)
+        tile_set.update_tile_pixel(4, 0, 0, 2)
+        TileSet.write_snapshot(snapshot)
+        tile_set.snapshot_saved(snapshot)
+        tile_set.journal.sync()
+        self.assertEqual(RecoveryJournal.read(path)[1:],
+                         [(4, bytes(tile_set.tile_bytes(4)))])
+        tile_set.journal.close()
+        self.assertFalse(os.path.exists(RecoveryJournal.path(path)))
+        self.assertIsNone(tile_set.journal.error)
+
+        # A journal that cannot be written reports why
+        other = self.write_file('other.chr', chr_data)
+        os.mkdir(RecoveryJournal.path(other))
+        journal = RecoveryJournal(other, 512)
+        journal.record(1, bytes(16))
+        journal.sync()
+        self.assertIsInstance(journal.error, OSError)
+        journal.close()
+
+    def test_background_task(self):
+        """
+        A background task reports its progress and result, and stops when cancelled
+        """
+        path = self.write_file('test.chr', bytes(range(256)) * 32)
+        def work(progress):
+            tile_set = TileSet()
+            tile_set.do_open(path, progress=progress)
+            return tile_set
+        task = BackgroundTask(work, 'opening')
+        task.start()
+        task.join()
+        messages = task.poll()
+        self.assertEqual(messages[0], ('progress', 1.0))
+        self.assertEqual(messages[1][0], 'done')
+        self.assertEqual(bytes(messages[1][1].chr_data), bytes(range(256)) * 32)
+        task = BackgroundTask(work, 'opening')
+        task.cancel()
+        task.start()
+        task.join()
+        self.assertEqual(task.poll(), [('cancelled', None)])
+
+    def test_profiler(self):
+        """
+        The profiler counts the calls while installed and dumps them as JSON
+        """
+        original = TileSet.do_save
+        filename = os.path.join(self.tmpdir.name, 'profile.json')
+        profiler = Profiler.from_setting(filename)
+        self.assertIsNone(Profiler.from_setting(''))
+        profiler.install()
+        try:
+            tile_set = TileSet()
+            tile_set.update_tile_pixel(0, 0, 0, 1)
+            tile_set.do_save(os.path.join(self.tmpdir.name, 'profile.chr'))
+        finally:
+            profiler.uninstall()
+        self.assertIs(TileSet.do_save, original)
+        tile_set.do_save(os.path.join(self.tmpdir.name, 'profile.chr'))
+        self.assertEqual(profiler.counters['TileSet.do_save'][0], 1)
+        self.assertEqual(profiler.counters['TileSet.update_tile_pixel'][0], 1)
+        profiler.dump()
+        with open(filename, encoding='utf-8') as json_file:
+            trace = json.load(json_file)
+        self.assertEqual([call['name'] for call in trace['trace']],
+                         ['TileSet.update_tile_pixel', 'TileSet.do_save'])
+
+    def test_hash_index(self):
+        """
+        Duplicates and mirrored tiles are found and follow tile edits
+        """
+        base_bytes = b"\x41\xC2\x44\x48\x10\x20\x40\x80\x01\x02\x04\x08\x16\x21\x42\x87"
+        tile_set = TileSet(64 * 16)
+        tile_set[1].frombytes(base_bytes)
+        tile_set[5].frombytes(base_bytes)
+        tile_set[9].frombytes(base_bytes)
+        tile_set[9].cwrotate()
+        tile_set[9].invert()
+        index = tile_set.hash_index()
+        self.assertEqual(index.find(base_bytes), [1, 5])
+        self.assertEqual(index.find_mirrors(base_bytes), [1, 5, 9])
+        self.assertIn([1, 5], index.duplicates())
+        self.assertIn([1, 5, 9], index.mirror_duplicates())
+        with mock.patch.object(nestile, 'chr_canonical', wraps=nestile.chr_canonical) as canonical:
+            # Edits only mark the tiles, they are reindexed by the next lookup
+            tile_set[5].hflip()
+            for y in range(8):
+                tile_set.update_tile_pixel(1, 0, y, 3)
+            self.assertEqual(canonical.call_count, 0)
+            self.assertEqual(index.find(base_bytes), [])
+            self.assertEqual(canonical.call_count, 2)
+        self.assertEqual(index.find_mirrors(base_bytes), [5, 9])
+
+
+class TestTileUndoJournal(unittest.TestCase):
+    """Class containing the methods to unit test the undo history"""
+
+    def test_undo_redo(self):
+        """
+        Merged changes are undone as one step and redo replays them
+        """
+        journal = TileUndoJournal()
+        data = [bytes([i]) * 16 for i in range(4)]
+        journal.record(0, data[0], data[1], merge=True)
+        journal.record(0, data[1], data[2], merge=True)
+        journal.record(3, data[0], data[3], merge=True)
+        journal.end_merge()
+        journal.record(5, data[2], data[3])
+        self.assertEqual(journal.undo(), [(5, data[2])])
+        self.assertEqual(journal.undo(), [(3, data[0]), (0, data[0])])
+        self.assertIsNone(journal.undo())
+        self.assertEqual(journal.redo(), [(0, data[2]), (3, data[3])])
+        journal.record(1, data[0], data[1])
+        self.assertIsNone(journal.redo())
+
+    def test_memory_cap(self):
+        """
+        The oldest steps are dropped once the history is over its size
+        """
+        journal = TileUndoJournal(max_bytes=10 * TileUndoJournal.DELTA_SIZE)
+        for idx in range(25):
+            journal.record(idx, b"\0" * 16, b"\1" * 16)
+        steps = []
+        while True:
+            step = journal.undo()
+            if step is None:
+                break
+            steps.append(step[0][0])
+        self.assertEqual(steps, list(range(24, 14, -1)))
+
+
+class TestTileLayerData(unittest.TestCase):
+    """Class containing the methods to unit test the TileLayerData"""
+
+    def test_tile_layout_index(self):
+        """
+        The positions of a tile follow tiles being laid over each other
+        """
+        tlayer = TileLayerData()
+        tlayer.lay_tile(0, 0, 5, [15, 2, 10, 6])
+        tlayer.lay_tile(3, 4, 5, [15, 1, 2, 3])
+        tlayer.lay_tile(1, 1, 7, [15, 2, 10, 6])
+        self.assertEqual(sorted(tlayer.tile_layout(5)),
+                         [(0, 0, (15, 2, 10, 6)), (3, 4, (15, 1, 2, 3))])
+        tlayer.lay_tile(0, 0, 7, [15, 2, 10, 6])
+        self.assertEqual(tlayer.tile_layout(5), [(3, 4, (15, 1, 2, 3))])
+        self.assertEqual(len(tlayer.tile_layout(7)), 2)
+        tlayer.reset()
+        self.assertEqual(tlayer.tile_layout(7), [])
+
+
+    def test_nametable_codec(self):
+        """
+        Attribute bits follow the NES layout and decode back to the same slots
+        """
+        tiles = [[[(x + y) & 0xFF for x in range(32)] for y in range(30)]]
+        slots = [[[0] * 16 for _ in range(15)]]
+        slots[0][0][1] = 1
+        slots[0][1][0] = 2
+        slots[0][14][15] = 3
+        data = nametable_encode(tiles, slots)
+        self.assertEqual(len(data), 1024)
+        self.assertEqual(data[33], 2)
+        self.assertEqual(data[960], 0x24)
+        self.assertEqual(data[1023], 0x0C)
+        for use_numpy in (True, False):
+            with using_numpy(use_numpy):
+                self.assertEqual(nametable_encode(tiles, slots), data)
+                dec_tiles, dec_slots = nametable_decode(data * 2)
+            self.assertEqual(len(dec_tiles), 2)
+            self.assertEqual([list(row) for row in dec_tiles[1]], tiles[0])
+            self.assertEqual([list(row) for row in dec_slots[1]], slots[0])
+
+    def test_nametable_roundtrip(self):
+        """
+        A layer saved as a nametable loads back with the same tiles and palettes
+        """
+        tlayer = TileLayerData()
+        tlayer.lay_tile(0, 0, 5, [15, 2, 10, 6])
+        tlayer.lay_tile(31, 29, 300, [15, 1, 2, 3])
+        data, palette_data = tlayer.to_nametable()
+        self.assertEqual(palette_data[:8], bytes([15, 2, 10, 6, 15, 1, 2, 3]))
+        loaded = TileLayerData()
+        loaded.from_nametable(data, palette_data)
+        self.assertEqual(loaded.tile_at_xy(0, 0), (5, (15, 2, 10, 6)))
+        self.assertEqual(loaded.tile_at_xy(31, 29), (44, (15, 1, 2, 3)))
+        self.assertEqual(loaded.tile_at_xy(1, 1), (0, (15, 2, 10, 6)))
+        for idx in range(5):
+            tlayer.lay_tile(idx * 2, 10, 1, [15, idx, 10, 6])
+        self.assertRaises(ValueError, tlayer.to_nametable)
+
+    def test_png_export(self):
+        """
+        The layer exports as an image in the NES colors of its tiles
+        """
+        tlayer = TileLayerData()
+        tlayer.lay_tile(1, 0, 1, [15, 2, 10, 6])
+        tile_set = TileSet()
+        tile_set[1].set(0, 0, 3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'layer.png')
+            tlayer.export_png(path, tile_set)
+            with open(path, 'rb') as fin:
+                image = png_read(fin)
+                self.assertEqual((image.width, image.height), (256, 240))
+                self.assertEqual(list(next(image.rows)[:10]), [64] * 8 + [6, 15])
+                self.assertEqual(len(list(image.rows)), 239)
+
+    def test_ppu_palette_mode(self):
+        """
+        In ppu mode tiles take the background palette of their quad, and
+        palette changes report only the places to redraw
+        """
+        tlayer = TileLayerData()
+        tlayer.lay_tile(0, 0, 1, [15, 2, 10, 6])
+        tlayer.lay_tile(1, 1, 2, [15, 2, 10, 6])
+        tlayer.lay_tile(2, 0, 3, [15, 1, 2, 3])
+        tlayer.set_palette_mode('ppu')
+        self.assertEqual(tlayer.bg_palettes[:2], [(15, 2, 10, 6), (15, 1, 2, 3)])
+        self.assertEqual(tlayer.set_quad_slot(0, 1, 1), [(0, 0), (1, 1)])
+        self.assertEqual(tlayer.set_quad_slot(0, 1, 1), [])
+        self.assertEqual(tlayer.tile_at_xy(1, 1), (2, (15, 1, 2, 3)))
+        self.assertEqual(sorted(tlayer.set_bg_color(1, 3, 0x30)), [(0, 0), (1, 1), (2, 0)])
+        self.assertEqual(tlayer.tile_layout(3), [(2, 0, (15, 1, 2, 0x30))])
+        data, palette_data = tlayer.to_nametable()
+        self.assertEqual(data[960], 0x05)
+        self.assertEqual(palette_data[4:8], bytes([15, 1, 2, 0x30]))
+        tlayer.set_palette_mode('tile')
+        self.assertEqual(tlayer.tile_at_xy(0, 0), (1, (15, 1, 2, 0x30)))
+        self.assertEqual(tlayer.set_bg_color(0, 0, 0x0F), [])
+
+
 if __name__ == '__main__':
     unittest.main()